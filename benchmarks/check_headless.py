@@ -0,0 +1,69 @@
+"""
+检查命令行在没有安装PySide2的环境中(例如渲染节点)可以导入和运行, 失败时返回非0
+示例:
+    python -m benchmarks.check_headless
+"""
+import os
+import sys
+import shutil
+import tempfile
+import subprocess as sp
+
+from benchmarks import fixtures
+
+
+# 在子进程中禁止导入的模块
+BLOCKED_MODULES = ('PySide2', 'shiboken2', 'dayu_widgets')
+
+# 命令行使用的模块
+HEADLESS_MODULES = ('pmtm.core', 'pmtm.helper', 'pmtm.engine', 'pmtm.export_utils', 'pmtm.history_store', 'pmtm.cli')
+
+CHECK_CODE = '''
+import sys
+import runpy
+import importlib
+
+
+class QtBlocker(object):
+    def find_spec(self, name, path=None, target=None):
+        if name.split('.')[0] in {blocked!r}:
+            raise ImportError(f'headless check: {{name}} is blocked')
+        return None
+
+
+sys.meta_path.insert(0, QtBlocker())
+for module in {modules!r}:
+    importlib.import_module(module)
+sys.argv = ['pmtm'] + {argv!r}
+runpy.run_module('pmtm', run_name='__main__')
+'''
+
+
+def run_check(argv):
+    """
+    在禁止导入Qt的子进程中导入命令行模块并执行命令, 返回 (返回值, 输出)
+    """
+    code = CHECK_CODE.format(blocked=BLOCKED_MODULES, modules=HEADLESS_MODULES, argv=argv)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([os.getcwd(), os.environ.get('PYTHONPATH', '')]))
+    process = sp.run([sys.executable, '-c', code], stdout=sp.PIPE, stderr=sp.STDOUT, env=env)
+    return process.returncode, process.stdout.decode(errors='ignore')
+
+
+def main():
+    work_folder = tempfile.mkdtemp(prefix='pmtm_headless_')
+    try:
+        fixtures.make_maya_files(work_folder, count=2, ref_count=2, node_count=10)
+        returncode, output = run_check(['scan-maya-frames', work_folder, '-f', 'json'])
+    finally:
+        shutil.rmtree(work_folder, ignore_errors=True)
+
+    print(output)
+    if returncode != 0:
+        print('[失败] 没有PySide2时命令行无法运行')
+        return 1
+    print('[通过] 没有PySide2时命令行可以运行')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
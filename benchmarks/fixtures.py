@@ -0,0 +1,170 @@
+"""
+生成基准测试使用的测试文件
+"""
+import os
+import struct
+import subprocess as sp
+
+from PIL import Image
+
+
+MA_HEADER = '''//Maya ASCII 2022 scene
+//Name: {name}
+requires maya "2022";
+currentUnit -l centimeter -a degree -t film;
+fileInfo "application" "maya";
+'''
+
+MA_REFERENCE = '''file -rdi 1 -ns "{ns}" -rfn "{ns}RN" -op "v=0;" -typ "mayaAscii" "{path}";
+file -r -ns "{ns}" -dr 1 -rfn "{ns}RN" -op "v=0;" -typ "mayaAscii" "{path}";
+'''
+
+MA_NODE = '''createNode transform -n "node{index}";
+	setAttr ".t" -type "double3" {index} 0 0 ;
+	setAttr ".r" -type "double3" 0 {index} 0 ;
+'''
+
+MA_PLAYBACK = '''createNode script -n "sceneConfigurationScriptNode";
+	setAttr ".b" -type "string" "playbackOptions -min {start} -max {end} -ast {start} -aet {end} ";
+	setAttr ".st" 6;
+// End of {name}
+'''
+
+# maya binary 数据块头的struct和对齐字节数
+MB_FORMAT_DICT = {
+    b'FOR4': (struct.Struct('>4sI'), 4),
+    b'FOR8': (struct.Struct('>4s4xQ'), 8),
+}
+
+
+def make_movies(folder, count, ffmpeg='ffmpeg', duration=2, size='1920x1080', rate=25):
+    """
+    使用ffmpeg testsrc 生成count个mov文件, 返回文件列表
+    """
+    os.makedirs(folder, exist_ok=True)
+    files_list = []
+    for index in range(count):
+        file_path = os.path.join(folder, f'shot_{index:04d}.mov')
+        cmd = [ffmpeg, '-y', '-v', 'error',
+               '-f', 'lavfi', '-i', f'testsrc=duration={duration}:size={size}:rate={rate}',
+               '-f', 'lavfi', '-i', f'sine=frequency={440 + index}:duration={duration}',
+               '-c:v', 'mjpeg', '-c:a', 'pcm_s16le', '-shortest', file_path]
+        sp.run(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE, check=True)
+        files_list.append(file_path)
+    return files_list
+
+
+def make_image_sequences(folder, count, length, gap_every=0, size=(1920, 1080), ext='png', start_frame=1001):
+    """
+    生成count组图片序列, 每组length帧
+    gap_every 大于0时, 每隔 gap_every 帧缺一帧, 用于测试断帧的序列
+    同一组序列的图片内容相同, 返回序列所在目录列表
+    """
+    folder_list = []
+    for index in range(count):
+        seq_folder = os.path.join(folder, f'seq_{index:04d}')
+        os.makedirs(seq_folder, exist_ok=True)
+
+        image = Image.new('RGB', size, ((index * 40) % 256, 128, 200))
+        first_file = None
+        for frame in range(start_frame, start_frame + length):
+            if gap_every and (frame - start_frame) % gap_every == gap_every - 1:
+                continue
+            file_path = os.path.join(seq_folder, f'seq_{index:04d}.{frame:04d}.{ext}')
+            if first_file is None:
+                image.save(file_path)
+                first_file = file_path
+            else:
+                # 同样的内容直接复制数据, 比重新编码快很多
+                with open(first_file, 'rb') as src, open(file_path, 'wb') as dst:
+                    dst.write(src.read())
+        folder_list.append(seq_folder)
+    return folder_list
+
+
+def make_assets(asset_folder, ref_count):
+    """
+    生成引用的资产文件路径列表, 其中一半文件是不存在的
+    """
+    os.makedirs(asset_folder, exist_ok=True)
+    ref_list = []
+    for index in range(ref_count):
+        ref_path = os.path.join(asset_folder, f'asset_{index:04d}.ma').replace('\\', '/')
+        if index % 2 == 0:
+            with open(ref_path, 'w') as f:
+                f.write(MA_HEADER.format(name=os.path.basename(ref_path)))
+        ref_list.append(ref_path)
+    return ref_list
+
+
+def make_maya_files(folder, count, ref_count, node_count=1000, start=1001, end=1100, asset_folder=None):
+    """
+    生成count个maya ascii文件, 每个文件有ref_count个引用和node_count个节点, 以及playbackOptions
+    引用路径指向 asset_folder(默认为 folder/assets) 下的文件, 其中一半引用是丢失的
+    返回 (maya文件列表, 引用路径列表)
+    """
+    ref_list = make_assets(asset_folder or os.path.join(folder, 'assets'), ref_count)
+
+    os.makedirs(folder, exist_ok=True)
+    files_list = []
+    for index in range(count):
+        name = f'scene_{index:04d}.ma'
+        file_path = os.path.join(folder, name)
+        with open(file_path, 'w') as f:
+            f.write(MA_HEADER.format(name=name))
+            for ref_index, ref_path in enumerate(ref_list):
+                f.write(MA_REFERENCE.format(ns=f'asset{ref_index}', path=ref_path))
+            for node_index in range(node_count):
+                f.write(MA_NODE.format(index=node_index))
+            f.write(MA_PLAYBACK.format(start=start, end=end, name=name))
+        files_list.append(file_path)
+    return files_list, ref_list
+
+
+def mb_chunk(tag, data, magic):
+    header_struct, alignment = MB_FORMAT_DICT[magic]
+    chunk = header_struct.pack(tag, len(data)) + data
+    return chunk + b'\0' * (-len(chunk) % alignment)
+
+
+def mb_group(form_type, children, magic):
+    """
+    生成数据块组, 组类型之后补齐到对齐字节数, 子数据块从对齐的位置开始
+    """
+    header_struct, alignment = MB_FORMAT_DICT[magic]
+    body = form_type + b'\0' * (-(header_struct.size + len(form_type)) % alignment) + b''.join(children)
+    return header_struct.pack(magic, len(body)) + body
+
+
+def make_maya_binary_files(folder, count, ref_count, node_count=1000, start=1001, end=1100, asset_folder=None,
+                           magic=b'FOR8', payload_every=10, payload_size=4096):
+    """
+    生成count个maya binary文件, 结构和ma文件相同: ref_count个引用(FREF), node_count个节点和playbackOptions
+    每隔 payload_every 个节点添加一个 payload_size 字节的数据块, 模拟模型等大数据, 读取时应该被跳过
+    返回 (maya文件列表, 引用路径列表)
+    """
+    ref_list = make_assets(asset_folder or os.path.join(folder, 'assets'), ref_count)
+
+    os.makedirs(folder, exist_ok=True)
+    files_list = []
+    for index in range(count):
+        name = f'scene_{index:04d}.mb'
+        children = [mb_group(b'HEAD', [mb_chunk(b'VERS', b'2022\0', magic)], magic)]
+        for ref_index, ref_path in enumerate(ref_list):
+            data = f'{ref_path}\0asset{ref_index}\0asset{ref_index}RN\0'.encode()
+            children.append(mb_chunk(b'FREF', data, magic))
+        for node_index in range(node_count):
+            node_children = [mb_chunk(b'CREA', f'node{node_index}\0'.encode(), magic),
+                             mb_chunk(b'DBL3', struct.pack('>3d', node_index, 0, 0), magic)]
+            if payload_every and node_index % payload_every == 0:
+                node_children.append(mb_chunk(b'MESH', b'\x01' * payload_size, magic))
+            children.append(mb_group(b'XFRM', node_children, magic))
+        script = f'playbackOptions -min {start} -max {end} -ast {start} -aet {end} \0'.encode()
+        children.append(mb_group(b'SCRP', [mb_chunk(b'CREA', b'sceneConfigurationScriptNode\0', magic),
+                                           mb_chunk(b'STR ', script, magic)], magic))
+
+        file_path = os.path.join(folder, name)
+        with open(file_path, 'wb') as f:
+            f.write(mb_group(b'Maya', children, magic))
+        files_list.append(file_path)
+    return files_list, ref_list
@@ -0,0 +1,376 @@
+"""
+基准测试, 生成测试文件后对各个任务的核心逻辑计时, 结果保存为json, 可以和之前的结果对比
+示例:
+    python -m benchmarks.run --profile small -o result.json
+    python -m benchmarks.run --profile small -o new.json --baseline result.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import statistics
+
+from benchmarks import fixtures
+from pmtm import engine
+from pmtm.core import user_setting
+from pmtm.helper import scan_files, FileStatCache
+from pmtm.maya_utils import (replace_maya_references, read_ma_references_lines, read_ma_references_mmap, scan_ma_file,
+                             read_maya_lines, MA_PLAYBACK_PATTERN)
+from pmtm.export_utils import export_report, encode_thumbnails
+
+
+PROFILE_DICT = {
+    'small': {'movies': 4, 'seq_count': 4, 'seq_length': 24, 'maya_count': 20, 'ref_count': 20,
+              'node_count': 2000, 'large_ma_nodes': 100000, 'export_rows': 500},
+    'large': {'movies': 20, 'seq_count': 10, 'seq_length': 100, 'maya_count': 200, 'ref_count': 100,
+              'node_count': 20000, 'large_ma_nodes': 500000, 'export_rows': 20000},
+}
+
+CASE_LIST = []
+
+
+def case(name, tools=()):
+    """
+    注册一个测试项, 被装饰的函数接收 context, 返回 (setup, run, items)
+    setup 在每次计时前执行(不计时), 可以为None; items 为处理的数据量
+    tools 为需要的依赖软件, 缺少时跳过
+    """
+    def wrapper(func):
+        CASE_LIST.append({'name': name, 'tools': tools, 'func': func})
+        return func
+    return wrapper
+
+
+# -----------------------测试项--------------------------------
+@case('scan_files')
+def case_scan_files(ctx):
+    def run():
+        scan_files(scan_folder=ctx['maya_folder'], is_include=True, ext_list=['.ma'])
+    return None, run, len(ctx['maya_files'])
+
+
+@case('scan_maya_references')
+def case_scan_maya_references(ctx):
+    def run():
+        list(engine.scan_maya_references(ctx['maya_files'], max_workers=ctx['workers']))
+    return None, run, len(ctx['maya_files'])
+
+
+@case('scan_large_ma_lines')
+def case_scan_large_ma_lines(ctx):
+    def run():
+        read_ma_references_lines(ctx['large_ma_file'])
+        next(line for line in read_maya_lines(ctx['large_ma_file']) if 'playbackOptions' in line)
+    return None, run, 1
+
+
+@case('scan_large_ma_mmap')
+def case_scan_large_ma_mmap(ctx):
+    def run():
+        read_ma_references_mmap(ctx['large_ma_file'])
+        scan_ma_file(ctx['large_ma_file'], MA_PLAYBACK_PATTERN, first_only=True)
+    return None, run, 1
+
+
+@case('scan_maya_binary')
+def case_scan_maya_binary(ctx):
+    def run():
+        list(engine.scan_maya_references(ctx['mb_files'], max_workers=ctx['workers']))
+        list(engine.scan_maya_frames(ctx['mb_files'], max_workers=ctx['workers']))
+    return None, run, len(ctx['mb_files'])
+
+
+@case('validate_references')
+def case_validate_references(ctx):
+    def run():
+        FileStatCache().check(ctx['ref_list'])
+    return None, run, len(ctx['ref_list'])
+
+
+@case('scan_maya_frames')
+def case_scan_maya_frames(ctx):
+    def run():
+        list(engine.scan_maya_frames(ctx['maya_files'], max_workers=ctx['workers']))
+    return None, run, len(ctx['maya_files'])
+
+
+@case('replace_maya_references')
+def case_replace_maya_references(ctx):
+    work_folder = os.path.join(ctx['root'], 'replace')
+    replace_path_map_dict = {ref_path: ref_path.replace('/assets/', '/assets_new/')
+                             for ref_path in ctx['ref_list'][::2]}
+
+    def setup():
+        shutil.rmtree(work_folder, ignore_errors=True)
+        os.makedirs(work_folder)
+        for file_path in ctx['maya_files']:
+            shutil.copy(file_path, work_folder)
+
+    def run():
+        for file_path in scan_files(scan_folder=work_folder, is_include=False, ext_list=['.ma']):
+            replace_maya_references(file_path, replace_path_map_dict)
+    return setup, run, len(ctx['maya_files'])
+
+
+@case('probe_movies', tools=('ffmpeg', 'ffprobe'))
+def case_probe_movies(ctx):
+    def run():
+        list(engine.scan_movies(ctx['movies'], max_workers=ctx['workers']))
+    return None, run, len(ctx['movies'])
+
+
+@case('extract_thumbnails', tools=('ffmpeg',))
+def case_extract_thumbnails(ctx):
+    def run():
+        list(engine.extract_movie_thumbnails(ctx['movies'], poster_percent=50, max_workers=ctx['workers']))
+    return None, run, len(ctx['movies'])
+
+
+@case('export_audio', tools=('ffmpeg', 'ffprobe'))
+def case_export_audio(ctx):
+    output_folder = os.path.join(ctx['root'], 'audio')
+
+    def setup():
+        shutil.rmtree(output_folder, ignore_errors=True)
+        os.makedirs(output_folder)
+
+    def run():
+        list(engine.export_audio_files(ctx['movies'], output_folder, max_workers=ctx['workers']))
+    return setup, run, len(ctx['movies'])
+
+
+@case('export_xlsx')
+def case_export_xlsx(ctx):
+    rows = ctx['profile']['export_rows']
+    image_list = ctx['first_frames']
+    data_list = [{'thumbnail': '',
+                  'file_name': f'shot_{index:05d}',
+                  'frame_count': 100,
+                  'fps': 25,
+                  'resolution': '1920x1080',
+                  'file_path': f'D:/show/shot_{index:05d}.mov',
+                  'image': image_list[index % len(image_list)]}
+                 for index in range(rows)]
+    header_list = [{'label': key, 'key': key} for key in data_list[0] if key != 'image']
+    output_path = os.path.join(ctx['root'], 'export.xlsx')
+
+    def run():
+        encoded_images = encode_thumbnails([data['image'] for data in data_list])
+        export_report(output_path=output_path,
+                      header_list=header_list,
+                      data_list=data_list,
+                      encoded_images=encoded_images)
+    return None, run, rows
+
+
+@case('first_sequence_rows')
+def case_first_sequence_rows(ctx):
+    """
+    从开始扫描到第一批基础信息的行可以显示的时间
+    """
+    def run():
+        seq_files = engine.scan_sequences(scan_folder=ctx['seq_folder'], is_include=True, ext_tuple=('.png',))
+        next(engine.iter_batches(data for data in map(engine.get_sequence_skeleton, seq_files) if data))
+    return None, run, 1
+
+
+@case('convert_seq_to_video', tools=('ffmpeg', 'ffprobe'))
+def case_convert(ctx):
+    output_folder = os.path.join(ctx['root'], 'convert')
+    output_settings = {'convert_method': 'img_to_video', 'output_ext': 'mov', 'fps': 25, 'start_frame': 1001}
+    seq_files = engine.scan_sequences(scan_folder=ctx['seq_folder'], is_include=True, ext_tuple=('.png',))
+    data_list = [data for data in engine.scan_sequences_data(seq_files, with_thumbnail=False) if data]
+
+    def setup():
+        shutil.rmtree(output_folder, ignore_errors=True)
+        os.makedirs(output_folder)
+
+    def run():
+        list(engine.map_parallel(lambda data: engine.convert_file(data, output_settings, output_folder),
+                                 data_list, max_workers=ctx['workers']))
+    return setup, run, len(data_list)
+
+
+@case('annotate_collage', tools=('magick',))
+def case_annotate_collage(ctx):
+    output_path = os.path.join(ctx['root'], 'collage.jpg')
+    data_list = [{'file_name': os.path.basename(path), 'file_path': path, 'text': os.path.basename(path),
+                  'color': '#00aa00'}
+                 for path in ctx['first_frames']]
+
+    def run():
+        engine.annotate_collage_image(data_list=data_list,
+                                      output_path=output_path,
+                                      gravity='South',
+                                      text_size=6,
+                                      text_transparency=100,
+                                      gamma=1.0)
+    return None, run, len(data_list)
+
+
+# -----------------------执行和对比--------------------------------
+def resolve_tools(args):
+    """
+    获取依赖软件路径, 命令行参数优先, 其次是软件中的设置, 最后从PATH中查找
+    找到的路径在当前进程中生效
+    """
+    tool_dict = {}
+    for key in ('ffmpeg', 'ffprobe', 'magick'):
+        path = getattr(args, key) or user_setting.get(key) or shutil.which(key)
+        if path and (os.path.isfile(path) or shutil.which(path)):
+            user_setting.override(key, path)
+            tool_dict[key] = path
+    return tool_dict
+
+
+def build_fixtures(root, profile, tool_dict):
+    print(f'生成测试文件: {root}', file=sys.stderr)
+    maya_folder = os.path.join(root, 'maya')
+    maya_files, ref_list = fixtures.make_maya_files(maya_folder,
+                                                    count=profile['maya_count'],
+                                                    ref_count=profile['ref_count'],
+                                                    node_count=profile['node_count'],
+                                                    asset_folder=os.path.join(root, 'assets'))
+    large_ma_files, _ = fixtures.make_maya_files(os.path.join(root, 'maya_large'),
+                                                 count=1,
+                                                 ref_count=profile['ref_count'],
+                                                 node_count=profile['large_ma_nodes'],
+                                                 asset_folder=os.path.join(root, 'assets'))
+    mb_files, _ = fixtures.make_maya_binary_files(os.path.join(root, 'maya_binary'),
+                                                  count=max(1, profile['maya_count'] // 4),
+                                                  ref_count=profile['ref_count'],
+                                                  node_count=profile['node_count'],
+                                                  asset_folder=os.path.join(root, 'assets'))
+    seq_folder = os.path.join(root, 'seq')
+    seq_folders = fixtures.make_image_sequences(seq_folder,
+                                                count=profile['seq_count'],
+                                                length=profile['seq_length'],
+                                                gap_every=10,
+                                                size=(960, 540))
+    first_frames = [os.path.join(folder, sorted(os.listdir(folder))[0]) for folder in seq_folders]
+
+    movies = []
+    if 'ffmpeg' in tool_dict:
+        movies = fixtures.make_movies(os.path.join(root, 'movie'), count=profile['movies'],
+                                      ffmpeg=tool_dict['ffmpeg'])
+
+    return {'root': root,
+            'maya_folder': maya_folder,
+            'maya_files': maya_files,
+            'ref_list': ref_list,
+            'mb_files': mb_files,
+            'large_ma_file': large_ma_files[0],
+            'seq_folder': seq_folder,
+            'first_frames': first_frames,
+            'movies': movies}
+
+
+def run_cases(ctx, tool_dict, repeat, name_filter=None):
+    results = {}
+    for item in CASE_LIST:
+        name = item['name']
+        if name_filter and name not in name_filter:
+            continue
+        missing = [tool for tool in item['tools'] if tool not in tool_dict]
+        if missing:
+            print(f'[跳过] {name}, 缺少依赖软件: {", ".join(missing)}', file=sys.stderr)
+            continue
+
+        setup, run, items = item['func'](ctx)
+        time_list = []
+        for _ in range(repeat):
+            if setup:
+                setup()
+            start_time = time.perf_counter()
+            run()
+            time_list.append(time.perf_counter() - start_time)
+
+        results[name] = {'median': statistics.median(time_list),
+                         'min': min(time_list),
+                         'items': items,
+                         'repeat': repeat}
+        print(f'{name:<28}{results[name]["median"]:>10.4f}秒  ({items}项)', file=sys.stderr)
+    return results
+
+
+def compare_results(results, baseline, threshold, min_delta=0.01):
+    """
+    和基准结果对比, 中位数耗时超过 基准*(1+threshold) 视为性能退化, 返回退化的测试项列表
+    耗时增加不到 min_delta 秒的视为误差, 避免很快的测试项因为波动被判定为退化
+    """
+    regression_list = []
+    for name, result in results.items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base['median']:
+            continue
+        ratio = result['median'] / base['median']
+        flag = ''
+        if ratio > 1 + threshold and result['median'] - base['median'] > min_delta:
+            flag = '  <-- 退化'
+            regression_list.append(name)
+        print(f'{name:<28}{base["median"]:>10.4f} -> {result["median"]:>10.4f}秒  x{ratio:.2f}{flag}',
+              file=sys.stderr)
+    return regression_list
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.run', description='PMTM 基准测试')
+    parser.add_argument('--profile', choices=list(PROFILE_DICT), default='small', help='测试数据规模, 默认 small')
+    parser.add_argument('--repeat', type=int, default=3, help='每项重复次数, 取中位数, 默认 3')
+    parser.add_argument('-w', '--workers', type=int, default=engine.DEFAULT_MAX_WORKERS, help='并发数量')
+    parser.add_argument('-o', '--output', help='结果保存路径(json)')
+    parser.add_argument('--baseline', help='用于对比的基准结果(json)')
+    parser.add_argument('--threshold', type=float, default=0.2, help='允许的耗时增长比例, 默认 0.2')
+    parser.add_argument('--min-delta', type=float, default=0.01, help='耗时增加小于该秒数时视为误差, 默认 0.01')
+    parser.add_argument('--case', action='append', help='只执行指定的测试项, 可以多次指定')
+    parser.add_argument('--keep', action='store_true', help='保留生成的测试文件')
+    parser.add_argument('--ffmpeg', help='ffmpeg 路径')
+    parser.add_argument('--ffprobe', help='ffprobe 路径')
+    parser.add_argument('--magick', help='magick 路径')
+    args = parser.parse_args(argv)
+
+    profile = PROFILE_DICT[args.profile]
+    tool_dict = resolve_tools(args)
+    root = tempfile.mkdtemp(prefix='pmtm_bench_')
+
+    try:
+        ctx = build_fixtures(root, profile, tool_dict)
+        ctx.update({'profile': profile, 'workers': args.workers})
+        results = run_cases(ctx, tool_dict, repeat=args.repeat, name_filter=args.case)
+    finally:
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+    data = {'created': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'profile': args.profile,
+            'workers': args.workers,
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'results': results}
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        print(f'结果已保存: {args.output}', file=sys.stderr)
+    else:
+        print(json.dumps(data, ensure_ascii=False, indent=2))
+
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        if baseline.get('profile') != args.profile:
+            print(f'[警告] 基准结果的规模为 {baseline.get("profile")}, 与本次 {args.profile} 不同', file=sys.stderr)
+        regression_list = compare_results(results, baseline, args.threshold, args.min_delta)
+        if regression_list:
+            print(f'性能退化: {", ".join(regression_list)}', file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
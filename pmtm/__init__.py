@@ -1,11 +1,25 @@
 import sys
-from PySide2 import QtWidgets
-
-from pmtm.main_windows import MainWindow
+import time
 
 
 def run():
+    """
+    启动界面, 界面相关的模块在这里导入, 命令行模式不需要加载
+    """
+    start_time = time.perf_counter()
+    from PySide2 import QtWidgets
+
+    from pmtm.main_windows import MainWindow
+    from pmtm.core import logger, user_setting
+    from pmtm.engine import start_prune_thumbnail_cache
+    import_time = time.perf_counter() - start_time
+
+    start_time = time.perf_counter()
     app = QtWidgets.QApplication(sys.argv)
     main_window = MainWindow()
     main_window.show()
+    # 界面显示后在后台校验依赖软件, 清理缩略图缓存
+    user_setting.warm_tool_cache()
+    start_prune_thumbnail_cache()
+    logger.info(f'[启动耗时] 导入: {import_time:.3f}秒, 创建窗口: {time.perf_counter() - start_time:.3f}秒')
     sys.exit(app.exec_())
@@ -0,0 +1,6 @@
+import sys
+
+from pmtm.cli import main
+
+
+sys.exit(main())
@@ -0,0 +1,295 @@
+"""
+命令行模式, 不启动界面批量执行各个工具
+示例: python -m pmtm scan-movies D:/shots --include -r result.csv
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+
+from pmtm.core import logger, user_setting, MetricsSession, profile_capture, describe_inputs
+from pmtm.helper import scan_files, FileStatCache
+from pmtm.export_utils import export_report
+from pmtm.maya_utils import MAYA_EXT_LIST
+from pmtm import engine
+
+
+MOVIE_COLUMNS = ['file_name', 'frame_count', 'fps', 'resolution', 'codec', 'colorspace', 'file_size', 'file_path']
+MAYA_REF_COLUMNS = ['maya_file', 'reference', 'status']
+MAYA_FRAME_COLUMNS = ['file_name', 'start_frame', 'end_frame', 'min_frame', 'max_frame', 'file_path']
+CONVERT_COLUMNS = ['file_name', 'start_frame', 'end_frame', 'frame_count', 'resolution', 'file_path', 'status']
+ANNOTATE_COLUMNS = ['output_file']
+THUMBNAIL_COLUMNS = ['file_path', 'thumbnail']
+AUDIO_COLUMNS = ['file_path', 'output_file', 'status']
+
+GRAVITY_LIST = ['NorthWest', 'North', 'NorthEast', 'West', 'Center', 'East', 'SouthWest', 'South', 'SouthEast']
+
+
+def collect_files(path_list, is_include, ext_list):
+    """
+    收集命令行传入的文件和目录下的文件
+    """
+    files_list = []
+    for path in path_list:
+        if os.path.isdir(path):
+            files_list.extend(scan_files(scan_folder=path, is_include=is_include, ext_list=ext_list))
+        else:
+            files_list.append(path)
+    return files_list
+
+
+def write_rows(rows, columns, output_path=None, fmt='json'):
+    """
+    输出结果, 指定输出文件时按文件后缀导出, 否则按 fmt 输出到标准输出
+    """
+    if output_path:
+        header_list = [{'label': key, 'key': key} for key in columns]
+        export_report(output_path=output_path, header_list=header_list, data_list=rows)
+        logger.info(f'导出完成，文件路径: {output_path}')
+        return
+
+    if fmt == 'csv':
+        writer = csv.DictWriter(sys.stdout, fieldnames=columns, extrasaction='ignore')
+        writer.writeheader()
+        writer.writerows(rows)
+    else:
+        rows = [{key: row.get(key, '') for key in columns} for row in rows]
+        json.dump(rows, sys.stdout, ensure_ascii=False, indent=2, default=str)
+        sys.stdout.write('\n')
+
+
+def print_msg(msg):
+    """
+    进度信息输出到标准错误, 不影响标准输出中的结果
+    """
+    print(msg, file=sys.stderr)
+
+
+# -----------------------子命令--------------------------------
+def cmd_scan_movies(args):
+    files_list = collect_files(args.paths, args.include, engine.MOVIE_EXT_LIST)
+    rows = []
+    for file_path, data in zip(files_list, engine.scan_movies(files_list, with_thumbnail=False,
+                                                                max_workers=args.workers)):
+        if data is None:
+            print_msg(f'不支持的文件: {file_path}')
+            continue
+        rows.append(data)
+    return rows, MOVIE_COLUMNS
+
+
+def cmd_thumbnails(args):
+    files_list = collect_files(args.paths, args.include, engine.MOVIE_EXT_LIST)
+    os.makedirs(args.output, exist_ok=True)
+    thumbnail_list = engine.extract_movie_thumbnails(files_list,
+                                                     output_folder=args.output,
+                                                     poster_percent=args.poster_percent,
+                                                     filmstrip_count=args.filmstrip,
+                                                     max_workers=args.workers)
+    rows = []
+    for current, (file_path, thumbnail) in enumerate(zip(files_list, thumbnail_list), start=1):
+        if thumbnail:
+            print_msg(f'({current}/{len(files_list)}) {thumbnail}')
+        else:
+            print_msg(f'({current}/{len(files_list)}) 提取缩略图失败: {file_path}')
+        rows.append({'file_path': file_path, 'thumbnail': thumbnail})
+    return rows, THUMBNAIL_COLUMNS
+
+
+def cmd_export_audio(args):
+    files_list = collect_files(args.paths, args.include, engine.MOVIE_EXT_LIST)
+    os.makedirs(args.output, exist_ok=True)
+    rows = []
+    results = engine.export_audio_files(files_list, args.output, max_workers=args.workers)
+    for current, (file_path, output_file, status) in enumerate(results, start=1):
+        print_msg(f'({current}/{len(files_list)}) {status}: {file_path}')
+        rows.append({'file_path': file_path, 'output_file': output_file, 'status': status})
+    return rows, AUDIO_COLUMNS
+
+
+def cmd_scan_maya_refs(args):
+    files_list = collect_files(args.paths, args.include, MAYA_EXT_LIST)
+    maya_files = {}
+    for file_path, ref_list in engine.scan_maya_references(files_list, max_workers=args.workers):
+        if ref_list is None:
+            print_msg(f'读取文件失败(编码错误或无法解析) {file_path}')
+        maya_files[file_path] = ref_list or []
+
+    ref_status = {}
+    if args.check:
+        ref_status = FileStatCache().check(set(ref for ref_list in maya_files.values() for ref in ref_list))
+
+    rows = [{'maya_file': file_path, 'reference': ref_path, 'status': ref_status.get(ref_path, '')}
+            for file_path, ref_list in maya_files.items()
+            for ref_path in ref_list]
+    return rows, MAYA_REF_COLUMNS
+
+
+def cmd_scan_maya_frames(args):
+    files_list = collect_files(args.paths, args.include, MAYA_EXT_LIST)
+    rows = list(engine.scan_maya_frames(files_list, max_workers=args.workers))
+    return rows, MAYA_FRAME_COLUMNS
+
+
+def cmd_convert(args):
+    input_ext = args.input_ext.lower().lstrip('.')
+    output_ext = args.output_ext.lower().lstrip('.')
+    convert_method = engine.get_convert_method(input_ext, output_ext)
+    if not convert_method:
+        raise ValueError(f'不支持的转换格式: {input_ext} -> {output_ext}')
+
+    output_settings = {'convert_method': convert_method,
+                       'output_ext': output_ext,
+                       'fps': args.fps,
+                       'start_frame': args.start_frame}
+    os.makedirs(args.output_folder, exist_ok=True)
+
+    seq_files = engine.scan_sequences(scan_folder=args.scan_folder,
+                                      is_include=args.include,
+                                      ext_tuple=(f'.{input_ext}',))
+    data_list = [data for data in engine.scan_sequences_data(seq_files, max_workers=args.workers) if data]
+
+    def _convert(data):
+        try:
+            engine.convert_file(data=data, output_settings=output_settings, output_folder=args.output_folder)
+            data['status'] = 'ok'
+        except Exception as e:
+            logger.error(f'转换失败: {data["file_path"]}, {e}')
+            data['status'] = 'error'
+        return data
+
+    rows = []
+    for current, data in enumerate(engine.map_parallel(_convert, data_list, max_workers=args.workers), start=1):
+        print_msg(f'({current}/{len(data_list)}) {data["status"]}: {data["file_path"]}')
+        rows.append(data)
+    return rows, CONVERT_COLUMNS
+
+
+def cmd_annotate(args):
+    files_list = engine.collect_annotate_files(args.paths, args.include, only_get_first=False)
+    data_list = []
+    for file_path in files_list:
+        ext = os.path.splitext(file_path)[1]
+        # 视频需要提取画面, 图片直接使用原图
+        if ext in engine.VIDEO_SUPPORTED_EXT:
+            data = engine.get_annotate_data(file_path, color=args.color)
+        else:
+            data = {'file_name': os.path.basename(file_path), 'file_path': file_path, 'color': args.color}
+        if not data:
+            continue
+        data['text'] = args.text if args.text is not None else os.path.splitext(data['file_name'])[0]
+        data_list.append(data)
+
+    if args.collage:
+        engine.annotate_collage_image(data_list=data_list,
+                                      output_path=args.output,
+                                      gravity=args.gravity,
+                                      text_size=args.size,
+                                      text_transparency=args.transparency,
+                                      gamma=args.gamma)
+        output_files = [args.output]
+    else:
+        os.makedirs(args.output, exist_ok=True)
+        output_files = engine.annotate_each_image(data_list=data_list,
+                                                  output_folder=args.output,
+                                                  ext=args.ext,
+                                                  gravity=args.gravity,
+                                                  text_size=args.size,
+                                                  text_transparency=args.transparency,
+                                                  gamma=args.gamma,
+                                                  max_workers=args.workers,
+                                                  log_callback=print_msg)
+    return [{'output_file': f} for f in output_files], ANNOTATE_COLUMNS
+
+
+# -----------------------参数解析--------------------------------
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('-w', '--workers', type=int, default=engine.DEFAULT_MAX_WORKERS,
+                        help=f'并发数量, 默认 {engine.DEFAULT_MAX_WORKERS}')
+    common.add_argument('-f', '--format', choices=['json', 'csv'], default='json',
+                        help='输出到标准输出时的格式, 默认 json')
+    common.add_argument('-r', '--report', help='结果导出到文件, 格式由后缀决定(.csv/.jsonl/.xlsx/.parquet)')
+    common.add_argument('--ffmpeg', help='ffmpeg 路径, 不填使用软件中的设置')
+    common.add_argument('--ffprobe', help='ffprobe 路径, 不填使用软件中的设置')
+    common.add_argument('--magick', help='magick 路径, 不填使用软件中的设置')
+    common.add_argument('-i', '--include', action='store_true', help='包含子目录')
+
+    parser = argparse.ArgumentParser(prog='python -m pmtm', description='PMTM 命令行模式, 不带子命令时启动界面')
+    subparsers = parser.add_subparsers(dest='command')
+
+    sub = subparsers.add_parser('scan-movies', parents=[common], help='获取视频信息')
+    sub.add_argument('paths', nargs='+', help='视频文件或目录')
+    sub.set_defaults(func=cmd_scan_movies)
+
+    sub = subparsers.add_parser('thumbnails', parents=[common], help='批量提取视频缩略图')
+    sub.add_argument('paths', nargs='+', help='视频文件或目录')
+    sub.add_argument('-o', '--output', required=True, help='输出目录')
+    sub.add_argument('--poster-percent', type=float, default=0, help='取画面的位置, 视频时长的百分比, 默认 0(第一帧)')
+    sub.add_argument('--filmstrip', type=int, default=1, help='大于1时均匀取多个画面拼成胶片条, 默认 1')
+    sub.set_defaults(func=cmd_thumbnails)
+
+    sub = subparsers.add_parser('export-audio', parents=[common], help='批量导出视频的音频为wav')
+    sub.add_argument('paths', nargs='+', help='视频文件或目录')
+    sub.add_argument('-o', '--output', required=True, help='输出目录')
+    sub.set_defaults(func=cmd_export_audio)
+
+    sub = subparsers.add_parser('scan-maya-refs', parents=[common], help='获取maya文件的引用')
+    sub.add_argument('paths', nargs='+', help='maya文件或目录')
+    sub.add_argument('--check', action='store_true', help='校验引用文件是否存在')
+    sub.set_defaults(func=cmd_scan_maya_refs)
+
+    sub = subparsers.add_parser('scan-maya-frames', parents=[common], help='获取maya文件的帧数范围')
+    sub.add_argument('paths', nargs='+', help='maya文件或目录')
+    sub.set_defaults(func=cmd_scan_maya_frames)
+
+    sub = subparsers.add_parser('convert', parents=[common], help='序列帧和视频格式转换')
+    sub.add_argument('scan_folder', help='扫描目录')
+    sub.add_argument('output_folder', help='输出目录')
+    sub.add_argument('--input-ext', required=True, help='输入格式, 例如 exr')
+    sub.add_argument('--output-ext', required=True, help='输出格式, 例如 mov')
+    sub.add_argument('--fps', default='25', help='输出视频的帧数率, 默认 25')
+    sub.add_argument('--start-frame', type=int, default=1001, help='输出序列的起始帧, 默认 1001')
+    sub.set_defaults(func=cmd_convert)
+
+    sub = subparsers.add_parser('annotate', parents=[common], help='图片添加文字')
+    sub.add_argument('paths', nargs='+', help='图片, 视频文件或目录')
+    sub.add_argument('-o', '--output', required=True, help='输出目录, 使用 --collage 时为输出图片路径')
+    sub.add_argument('--text', help='添加的文字, 不填使用文件名')
+    sub.add_argument('--color', default='#00aa00', help='文字颜色, 默认 #00aa00')
+    sub.add_argument('--gravity', choices=GRAVITY_LIST, default='South', help='文字位置, 默认 South')
+    sub.add_argument('--size', type=int, default=6, help='文字大小, 默认 6')
+    sub.add_argument('--transparency', type=int, default=100, help='文字不透明度百分比, 默认 100')
+    sub.add_argument('--gamma', type=float, default=1.0, help='gamma值, 默认 1.0')
+    sub.add_argument('--ext', default='.jpg', help='分别输出时的图片格式, 默认 .jpg')
+    sub.add_argument('--collage', action='store_true', help='拼成整张图输出')
+    sub.set_defaults(func=cmd_annotate)
+
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if not args.command:
+        import pmtm
+        pmtm.run()
+        return 0
+
+    for key in ('ffmpeg', 'ffprobe', 'magick'):
+        if getattr(args, key):
+            user_setting.override(key, getattr(args, key))
+
+    session = MetricsSession(args.command)
+    try:
+        with profile_capture(args.command, inputs=describe_inputs(args)):
+            rows, columns = args.func(args)
+        write_rows(rows, columns, output_path=args.report, fmt=args.format)
+        print_msg(session.finish(rows=len(rows)))
+    except Exception as e:
+        logger.exception(f'命令执行失败: {args.command}')
+        print_msg(f'执行失败: {e}')
+        return 1
+    return 0
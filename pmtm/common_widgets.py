@@ -1,6 +1,10 @@
+import html
+import threading
 import webbrowser
 from functools import partial
+from collections import deque
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
 
 import dayu_widgets as dy
 from PySide2 import QtWidgets, QtCore, QtGui
@@ -8,6 +12,7 @@ from dayu_widgets.qt import MIcon
 
 from pmtm.core import logger
 from pmtm.helper import get_resource_file
+from pmtm.engine import DEFAULT_MAX_WORKERS, PriorityJobQueue
 
 
 class WidgetMixin(object):
@@ -122,6 +127,12 @@ class CommonToolWidget(CommonWidget):
         """
         pass
 
+    def close_tool(self):
+        """
+        Called when the main window closes, stop running background tasks
+        """
+        pass
+
     def open_wiki_url(self, url):
         """
         Open the help documentation page
@@ -135,36 +146,298 @@ class CommonToolWidget(CommonWidget):
 class InfoBoard(QtWidgets.QTextBrowser):
     """
     信息显示组件
+    add_line 可以在任意线程调用, 文字先放入队列, 由定时器批量写入文档, 避免逐行刷新界面
+    文档只保留最近 max_block_count 行, 右键菜单可以按级别过滤
     """
 
-    def __init__(self, parent=None):
+    # 级别从低到高, 过滤时显示不低于所选级别的信息
+    LEVEL_LIST = [('info', '全部'), ('pass', '完成及以上'), ('warning', '警告及以上'), ('error', '仅错误')]
+    COLOR_DICT = {'error': 'red',
+                  'warning': 'yellow',
+                  'pass': 'green'}
+
+    def __init__(self, parent=None, max_block_count=5000, flush_interval=200):
         super(InfoBoard, self).__init__(parent=parent)
         self.setStyleSheet('border: 1px solid rgba(0, 0, 0, 0.1)')
         self.setPlaceholderText('这里会显示一些日志信息..')
+        self.document().setMaximumBlockCount(max_block_count)
+
+        # data
+        self.min_level = 'info'
+        self.pending_lines = deque()
+        self.history_lines = deque(maxlen=max_block_count)
 
-    def add_line(self, text):
+        self.flush_timer = QtCore.QTimer(self)
+        self.flush_timer.setInterval(flush_interval)
+        self.flush_timer.timeout.connect(self.flush)
+        self.flush_timer.start()
+
+    def add_line(self, text, typ=None):
+        """
+        添加一行信息, typ 为空时从文字前缀 [error] [warning] [pass] 获取
+        """
         logger.info(text)
-        if text.startswith('[error]'):
-            typ = 'error'
-            text = text.replace('[error]', '')
-        elif text.startswith('[warning]'):
-            typ = 'warning'
-            text = text.replace('[warning]', '')
-        elif text.startswith('[pass]'):
-            typ = 'pass'
-            text = text.replace('[pass]', '')
-        else:
-            typ = None
+        if typ is None:
+            for prefix in ('error', 'warning', 'pass'):
+                if text.startswith(f'[{prefix}]'):
+                    typ = prefix
+                    text = text.replace(f'[{prefix}]', '')
+                    break
+        self.pending_lines.append((typ or 'info', text))
+
+    def flush(self):
+        """
+        将队列中的信息一次性写入文档
+        """
+        if not self.pending_lines:
+            return
+
+        lines = []
+        while self.pending_lines:
+            line = self.pending_lines.popleft()
+            self.history_lines.append(line)
+            if self.is_level_visible(line[0]):
+                lines.append(line)
+        self.insert_lines(lines)
+
+    def insert_lines(self, lines):
+        if not lines:
+            return
+
+        scroll_bar = self.verticalScrollBar()
+        at_bottom = scroll_bar.value() >= scroll_bar.maximum() - 4
+
+        cursor = QtGui.QTextCursor(self.document())
+        cursor.movePosition(QtGui.QTextCursor.End)
+        cursor.beginEditBlock()
+        for typ, text in lines:
+            if not self.document().isEmpty():
+                cursor.insertBlock()
+            cursor.insertHtml(self.line_html(typ, text))
+        cursor.endEditBlock()
 
-        color = {'error': 'red',
-                 'warning': 'yellow',
-                 'pass': 'green'}.get(typ)
+        if at_bottom:
+            scroll_bar.setValue(scroll_bar.maximum())
 
+    def line_html(self, typ, text):
+        text = html.escape(text)
+        color = self.COLOR_DICT.get(typ)
         if color:
-            text = '<font color="{0}" <{0}>{1}</font>'.format(color, text)
+            return f'<span style="color: {color};">{text}</span>'
+        return f'<span>{text}</span>'
+
+    def is_level_visible(self, typ):
+        levels = [level for level, _ in self.LEVEL_LIST]
+        return levels.index(typ) >= levels.index(self.min_level)
+
+    def set_level(self, level):
+        """
+        设置显示的最低级别, 并按新的级别重新显示保留的信息
+        """
+        self.flush()
+        self.min_level = level
+        self.clear()
+        self.insert_lines([line for line in self.history_lines if self.is_level_visible(line[0])])
+
+    def clear_lines(self):
+        self.pending_lines.clear()
+        self.history_lines.clear()
+        self.clear()
+
+    def contextMenuEvent(self, event):
+        menu = self.createStandardContextMenu()
+        menu.addSeparator()
+        level_menu = menu.addMenu('显示级别')
+        for level, label in self.LEVEL_LIST:
+            action = level_menu.addAction(label)
+            action.setCheckable(True)
+            action.setChecked(level == self.min_level)
+            action.triggered.connect(lambda checked=False, _level=level: self.set_level(_level))
+        menu.addAction('清空', self.clear_lines)
+        menu.exec_(event.globalPos())
+
+
+class ProgressiveTableModel(dy.MTableModel):
+    """
+    分两步填充的表格模型
+    先用 append_rows 批量插入只有基础信息的行, 再用 update_row 按 key 就地补全数据, 只刷新改变的行
+    key 作为行的唯一标识, 排序和移动行时用 layoutChanged 通知表格, 保留选择和滚动位置
+    movable 为True时支持在表格中拖拽调整行的顺序
+    """
 
-        self.append(text)
-        QtWidgets.QApplication.processEvents()
+    def __init__(self, key='file_path', movable=False, parent=None):
+        super(ProgressiveTableModel, self).__init__(parent=parent)
+        self.key = key
+        self.movable = movable
+        self.row_dict = {}  # {key: row}
+
+    def append_rows(self, data_list):
+        """
+        在末尾批量插入行, 只通知插入的部分, 不重置整个表格
+        key 已经在表格中的行会被跳过, 返回插入的行数据列表
+        """
+        new_data_list = []
+        new_key_set = set()
+        for data in data_list:
+            key = str(data[self.key])
+            if key in self.row_dict or key in new_key_set:
+                continue
+            new_data_list.append(data)
+            new_key_set.add(key)
+        data_list = new_data_list
+        if not data_list:
+            return data_list
+        children = self.get_data_list()
+        start = len(children)
+        self.beginInsertRows(QtCore.QModelIndex(), start, start + len(data_list) - 1)
+        for row, data in enumerate(data_list, start=start):
+            self.row_dict[str(data[self.key])] = row
+        children.extend(data_list)
+        self.endInsertRows()
+        return data_list
+
+    def update_row(self, key, data):
+        """
+        补全 key 对应行的数据, 返回行号, 没有这一行时返回None
+        """
+        row = self.row_dict.get(str(key))
+        if row is None:
+            return None
+        self.get_data_list()[row].update(data)
+        self.dataChanged.emit(self.index(row, 0), self.index(row, self.columnCount() - 1))
+        return row
+
+    def refresh_column(self, key):
+        """
+        通知 key 对应的列需要重绘, 只有可见的部分会重绘
+        """
+        keys = [header['key'] for header in self.header_list]
+        if key not in keys or not self.get_data_list():
+            return
+        column = keys.index(key)
+        self.dataChanged.emit(self.index(0, column), self.index(len(self.get_data_list()) - 1, column))
+
+    def remove_key(self, key):
+        """
+        删除 key 对应的行, 返回是否删除
+        """
+        row = self.row_dict.get(str(key))
+        if row is None:
+            return False
+        self.remove(self.get_data_list()[row])
+        return True
+
+    def remove_rows(self, data_list):
+        """
+        批量删除行, 连续的行一起删除, 最后只更新一次行号
+        """
+        rows = sorted({self.row_dict[str(data[self.key])] for data in data_list
+                       if str(data[self.key]) in self.row_dict})
+        if not rows:
+            return
+        children = self.get_data_list()
+        # 从后往前删除, 前面的行号不会改变
+        last = rows[-1]
+        for first, prev in zip(reversed(rows), reversed([None] + rows[:-1])):
+            if prev == first - 1:
+                continue
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del children[first:last + 1]
+            self.endRemoveRows()
+            last = prev
+        self.rebuild_row_dict()
+
+    def sort_rows(self, key, reverse=False):
+        """
+        按 key 函数排序, 不重置表格
+        """
+        self.reorder(sorted(self.get_data_list(), key=key, reverse=reverse))
+
+    def move_rows(self, data_list, destination):
+        """
+        把 data_list 中的行按当前顺序移动到 destination 行之前
+        """
+        rows = sorted({self.row_dict[str(data[self.key])] for data in data_list
+                       if str(data[self.key]) in self.row_dict})
+        if not rows:
+            return
+        # 连续的行直接移动
+        if rows[-1] - rows[0] == len(rows) - 1:
+            self.moveRows(QtCore.QModelIndex(), rows[0], len(rows), QtCore.QModelIndex(), destination)
+            return
+        children = self.get_data_list()
+        row_set = set(rows)
+        moved = [children[row] for row in rows]
+        before = [data for row, data in enumerate(children[:destination]) if row not in row_set]
+        after = [data for row, data in enumerate(children[destination:], start=destination) if row not in row_set]
+        self.reorder(before + moved + after)
+
+    def reorder(self, data_list):
+        """
+        按 data_list 的顺序重新排列已有的行, data_list 必须包含所有的行
+        已选择的行和当前行跟随数据移动
+        """
+        children = self.get_data_list()
+        self.layoutAboutToBeChanged.emit()
+        old_children = list(children)
+        children[:] = data_list
+        self.rebuild_row_dict()
+
+        from_list = self.persistentIndexList()
+        to_list = []
+        for index in from_list:
+            row = self.row_dict[str(old_children[index.row()][self.key])]
+            to_list.append(self.index(row, index.column()))
+        self.changePersistentIndexList(from_list, to_list)
+        self.layoutChanged.emit()
+
+    def moveRows(self, source_parent, source_row, count, destination_parent, destination_child):
+        children = self.get_data_list()
+        if count <= 0 or source_row < 0 or source_row + count > len(children) \
+                or not 0 <= destination_child <= len(children):
+            return False
+        # 移动到自身范围内时位置不变
+        if source_row <= destination_child <= source_row + count:
+            return False
+        if not self.beginMoveRows(source_parent, source_row, source_row + count - 1,
+                                  destination_parent, destination_child):
+            return False
+        moved = children[source_row:source_row + count]
+        del children[source_row:source_row + count]
+        if destination_child > source_row:
+            destination_child -= count
+        children[destination_child:destination_child] = moved
+        self.rebuild_row_dict()
+        self.endMoveRows()
+        return True
+
+    def flags(self, index):
+        result = super(ProgressiveTableModel, self).flags(index)
+        if self.movable:
+            # 行可以拖动, 只能放在行与行之间
+            result |= QtCore.Qt.ItemIsDragEnabled if index.isValid() else QtCore.Qt.ItemIsDropEnabled
+        return result
+
+    def supportedDropActions(self):
+        return QtCore.Qt.CopyAction | QtCore.Qt.MoveAction
+
+    def rebuild_row_dict(self):
+        self.row_dict = {str(data[self.key]): row for row, data in enumerate(self.get_data_list())}
+
+    def append(self, data_dict):
+        super(ProgressiveTableModel, self).append(data_dict)
+        self.row_dict[str(data_dict[self.key])] = len(self.get_data_list()) - 1
+
+    def remove(self, data_dict):
+        self.remove_rows([data_dict])
+
+    def set_data_list(self, data_list):
+        super(ProgressiveTableModel, self).set_data_list(data_list)
+        self.rebuild_row_dict()
+
+    def clear(self):
+        super(ProgressiveTableModel, self).clear()
+        self.row_dict = {}
 
 
 class DropTabelView(dy.MTableView):
@@ -173,11 +446,77 @@ class DropTabelView(dy.MTableView):
     """
 
     fileDropped = QtCore.Signal(list)  # 文件拖拽完成信号
+    visibleRowsChanged = QtCore.Signal(int, int)  # 滚动或改变大小后可见的行范围
+    rowsMoved = QtCore.Signal(list, int)  # 表格内拖拽的行数据, 放置位置在源模型中的行号
 
     def __init__(self, size=None, show_row_count=False, parent=None):
         super().__init__(size=size, show_row_count=show_row_count, parent=parent)
         self.setAcceptDrops(True)  # 启用拖拽功能
 
+        # 滚动停下后再发送可见行, 避免滚动时频繁发送
+        self.visible_timer = QtCore.QTimer(self)
+        self.visible_timer.setSingleShot(True)
+        self.visible_timer.setInterval(100)
+        self.visible_timer.timeout.connect(self.emit_visible_rows)
+        self.verticalScrollBar().valueChanged.connect(lambda *args: self.visible_timer.start())
+
+    def setModel(self, model):
+        super(DropTabelView, self).setModel(model)
+        for sig in (model.rowsInserted, model.rowsRemoved, model.modelReset, model.layoutChanged):
+            sig.connect(lambda *args: self.visible_timer.start())
+
+    def set_row_height(self, height):
+        """
+        固定行高, 有缩略图的表格不需要逐行计算行高
+        """
+        header = self.verticalHeader()
+        header.setSectionResizeMode(QtWidgets.QHeaderView.Fixed)
+        header.setDefaultSectionSize(height)
+
+    def enable_row_move(self):
+        """
+        允许在表格内拖拽选中的行调整顺序, 模型需要支持拖拽(ProgressiveTableModel movable=True)
+        """
+        self.setDragEnabled(True)
+        self.setDragDropMode(QtWidgets.QAbstractItemView.DragDrop)
+        self.setDragDropOverwriteMode(False)
+        self.setDropIndicatorShown(True)
+
+    def data_in_rows(self, first, last):
+        """
+        返回表格中 first 到 last 行的数据, 使用排序模型时返回对应的源数据
+        """
+        model = self.model()
+        data_list = []
+        for row in range(first, last + 1):
+            index = model.index(row, 0)
+            if isinstance(model, QtCore.QSortFilterProxyModel):
+                index = model.mapToSource(index)
+            if index.isValid():
+                data_list.append(index.internalPointer())
+        return data_list
+
+    def visible_rows(self):
+        """
+        返回当前可见的行范围 (first, last), 没有数据时返回None
+        """
+        first = self.rowAt(0)
+        if first < 0:
+            return None
+        last = self.rowAt(self.viewport().height() - 1)
+        if last < 0:
+            last = self.model().rowCount() - 1
+        return first, last
+
+    def emit_visible_rows(self):
+        rows = self.visible_rows()
+        if rows:
+            self.visibleRowsChanged.emit(*rows)
+
+    def resizeEvent(self, event):
+        super(DropTabelView, self).resizeEvent(event)
+        self.visible_timer.start()
+
     def _handle_url_mime_data(self, event):
         if event.mimeData().hasUrls:
             event.setDropAction(QtCore.Qt.CopyAction)
@@ -186,18 +525,126 @@ class DropTabelView(dy.MTableView):
         event.ignore()
         return False
 
+    def source_row_at(self, row):
+        """
+        返回表格第 row 行在源模型中的行号, 超出范围时返回源模型的行数
+        """
+        model = self.model()
+        if isinstance(model, QtCore.QSortFilterProxyModel):
+            if row < model.rowCount():
+                return model.mapToSource(model.index(row, 0)).row()
+            return model.sourceModel().rowCount()
+        return min(row, model.rowCount())
+
+    def _handle_row_move(self, event):
+        """
+        表格内拖拽行, 发送移动信号, 数据由模型移动
+        """
+        index = self.indexAt(event.pos())
+        position = self.dropIndicatorPosition()
+        if not index.isValid() or position == QtWidgets.QAbstractItemView.OnViewport:
+            row = self.model().rowCount()
+        elif position == QtWidgets.QAbstractItemView.BelowItem:
+            row = index.row() + 1
+        else:
+            row = index.row()
+
+        selected_rows = sorted(selected.row() for selected in self.selectionModel().selectedRows())
+        data_list = [data for row_index in selected_rows for data in self.data_in_rows(row_index, row_index)]
+        if data_list:
+            self.rowsMoved.emit(data_list, self.source_row_at(row))
+
+        # 不使用 MoveAction, 否则拖拽结束后表格会删除选中的行
+        event.setDropAction(QtCore.Qt.CopyAction)
+        event.accept()
+
     def dragEnterEvent(self, event):
+        if event.source() is self:
+            super(DropTabelView, self).dragEnterEvent(event)
+            return
         self._handle_url_mime_data(event)
 
     def dragMoveEvent(self, event):
+        if event.source() is self:
+            super(DropTabelView, self).dragMoveEvent(event)
+            return
         self._handle_url_mime_data(event)
 
     def dropEvent(self, event):
+        if event.source() is self:
+            self._handle_row_move(event)
+            return
         if self._handle_url_mime_data(event):
             links = [str(url.toLocalFile()) for url in event.mimeData().urls()]
             self.fileDropped.emit(links)
 
 
+class ThumbnailLoader(QtCore.QObject):
+    """
+    按需生成缩略图, 只执行最近一次请求的任务, 滚动后不再可见的行会被丢弃
+    func(key) 在后台线程中调用, 返回缩略图路径
+    生成失败的key在之后的请求中重试, 最多 max_retries 次
+    """
+
+    thumbnail_ready = QtCore.Signal(object, str)
+
+    def __init__(self, func, max_workers=DEFAULT_MAX_WORKERS, max_retries=3, parent=None):
+        super(ThumbnailLoader, self).__init__(parent=parent)
+        self.func = func
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+
+        # data
+        self.job_queue = PriorityJobQueue()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.started_keys = set()
+        self.failed_count = {}  # {key: 失败次数}
+        self.running = 0
+
+    def request(self, keys):
+        """
+        请求生成缩略图, 替换之前还没有开始的请求, 已经开始或成功的key会被忽略
+        """
+        with self.lock:
+            keys = [key for key in keys if key not in self.started_keys]
+            self.job_queue.replace(keys)
+            count = min(self.max_workers - self.running, len(keys))
+            self.running += count
+        for _ in range(count):
+            self.executor.submit(self.work)
+
+    def work(self):
+        while True:
+            with self.lock:
+                key = self.job_queue.pop()
+                if key is None:
+                    self.running -= 1
+                    return
+                self.started_keys.add(key)
+            try:
+                image_path = self.func(key)
+            except Exception as e:
+                logger.error(f'生成缩略图失败: {key}, {e}')
+                image_path = ''
+
+            if image_path:
+                self.thumbnail_ready.emit(key, image_path)
+                continue
+            # 文件可能还在写入, 或者依赖软件临时出错, 下次请求时重试
+            with self.lock:
+                count = self.failed_count.get(key, 0) + 1
+                self.failed_count[key] = count
+                if count < self.max_retries:
+                    self.started_keys.discard(key)
+
+    def clear(self):
+        with self.lock:
+            self.job_queue.clear()
+            self.started_keys.clear()
+            self.failed_count.clear()
+
+
 class DropTreeView(dy.MTreeView):
 
     """
@@ -312,6 +759,64 @@ def question_box(text, parent=None):
     return True
 
 
+class ProgressDialog(QtWidgets.QDialog):
+    """
+    任务进度对话框
+    """
+
+    def __init__(self, title, parent=None):
+        super(ProgressDialog, self).__init__(parent=parent)
+
+        # data
+        self.detail = ''  # 任务结束时显示在结果下方的说明
+
+        # widgets
+        self.title = dy.MLabel(title).h2().secondary().strong()
+        self.tips_label = dy.MLabel('')
+        self.progress = dy.MProgressBar()
+        self.close_bt = dy.MPushButton('程序正在运行').small()
+
+        # init ui
+        self.layout = QtWidgets.QVBoxLayout()
+        for widget in (self.title, self.tips_label, self.progress, self.close_bt):
+            self.layout.addWidget(widget)
+        self.setLayout(self.layout)
+        self.setFixedWidth(300)
+        self.setWindowTitle('进度显示')
+
+    def show_progress(self, progress_data_list):
+        """
+        progress_data_list: [文件名, 当前数量, 总数], 总数为0时显示为忙碌状态
+        """
+        file_name, current, total = progress_data_list
+        if total:
+            self.progress.setRange(0, 100)
+            self.progress.setValue(int(current / total * 100))
+            self.tips_label.setText(f'正在导出: {current}/{total} {file_name}')
+        else:
+            self.progress.setRange(0, 0)
+            self.tips_label.setText(f'正在导出: {file_name}')
+
+    def set_detail(self, text):
+        """
+        设置任务结束时显示的说明, 例如各种处理结果的数量, 需要在 show_success 之前调用
+        """
+        self.detail = text
+
+    def show_success(self, is_success=True):
+        self.progress.setRange(0, 100)
+        if is_success:
+            self.progress.setValue(100)
+            self.close_bt.setText('任务完成，关闭')
+            text = '导出完成!'
+        else:
+            self.progress.set_dayu_status(dy.MProgressBar.ErrorStatus)
+            self.close_bt.setText('关闭')
+            text = '导出失败，请查看日志!'
+        self.tips_label.setText(f'{text}\n{self.detail}' if self.detail else text)
+        self.close_bt.clicked.connect(self.close)
+
+
 class PhotoLabel(QtWidgets.QDialog):
     """
     显示一张图片的label
@@ -1,8 +1,20 @@
 import os
+import json
+import time
+import queue
+import atexit
+import shutil
+import pstats
+import cProfile
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import threading
+import functools
+import contextvars
+import tracemalloc
+import subprocess as sp
+from contextlib import contextmanager
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
-from PySide2 import QtCore
 from pmtm import constant as const
 
 
@@ -12,39 +24,513 @@ def get_log_file_path():
     return os.path.join(log_folder, f'pmtm_tool.log')
 
 
+def get_metrics_log_path():
+    return os.path.join(os.path.dirname(get_log_file_path()), 'pmtm_metrics.jsonl')
+
+
+def get_profile_folder():
+    profile_folder = os.path.join(os.path.dirname(get_log_file_path()), 'profile')
+    os.makedirs(profile_folder, exist_ok=True)
+    return profile_folder
+
+
+# 日志文件按大小切分, 保留最近的几个文件
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+# 单条日志的最大长度, 超出部分截断, 避免超长命令和数据拖慢写入
+LOG_MAX_MESSAGE_LENGTH = 4000
+# 各模块的日志级别, 例如 PMTM_LOG_LEVELS="media=INFO,maya=WARNING", root 为全局级别
+LOG_LEVELS_ENV = 'PMTM_LOG_LEVELS'
+
+
+class TruncateQueueHandler(QueueHandler):
+    """
+    在调用线程中只格式化消息文字, 截断超长的调试信息(警告和错误保持完整), 写文件由后台线程完成
+    """
+
+    def prepare(self, record):
+        record = super(TruncateQueueHandler, self).prepare(record)
+        if record.levelno < logging.WARNING and len(record.msg) > LOG_MAX_MESSAGE_LENGTH:
+            record.msg = f'{record.msg[:LOG_MAX_MESSAGE_LENGTH]}...(共{len(record.msg)}字符)'
+        return record
+
+
+def get_log_levels():
+    """
+    从环境变量获取各模块的日志级别
+    """
+    level_dict = {}
+    for item in os.environ.get(LOG_LEVELS_ENV, '').split(','):
+        name, _, level = item.partition('=')
+        level = logging.getLevelName(level.strip().upper())
+        if name.strip() and isinstance(level, int):
+            level_dict[name.strip()] = level
+    return level_dict
+
+
 def get_logger():
     """
     获取日志记录器
+    日志先放入队列, 由后台线程写入文件, 工作线程不需要等待磁盘
     """
     _logger = logging.getLogger()
-    _logger.setLevel(logging.DEBUG)
-    
-    file_handler = TimedRotatingFileHandler(filename=get_log_file_path(),
-                                            when='D',
-                                            interval=1,
-                                            encoding='utf-8')
-    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s'))
+    _logger.setLevel(get_log_levels().get('root', logging.DEBUG))
+    if any(isinstance(handler, TruncateQueueHandler) for handler in _logger.handlers):
+        return _logger
+
+    file_handler = RotatingFileHandler(filename=get_log_file_path(),
+                                       maxBytes=LOG_MAX_BYTES,
+                                       backupCount=LOG_BACKUP_COUNT,
+                                       encoding='utf-8')
+    file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(threadName)s - '
+                                                '%(filename)s:%(lineno)d - %(message)s'))
     file_handler.setLevel(logging.DEBUG)
-    _logger.addHandler(file_handler)
 
+    log_queue = queue.SimpleQueue()
+    listener = QueueListener(log_queue, file_handler, respect_handler_level=True)
+    listener.start()
+    # 退出时写完队列中剩余的日志
+    atexit.register(listener.stop)
+
+    _logger.addHandler(TruncateQueueHandler(log_queue))
+    return _logger
+
+
+def get_subsystem_logger(name):
+    """
+    获取模块的日志记录器, 日志会传递到全局记录器, 级别可以通过环境变量单独设置
+    """
+    _logger = logging.getLogger(f'pmtm.{name}')
+    level = get_log_levels().get(name)
+    if level is not None:
+        _logger.setLevel(level)
     return _logger
 
 
+def convert_value(value, typ, default=None):
+    """
+    转换设置的值的类型, QSettings保存为ini时读取出来的都是字符串
+    """
+    if typ is bool:
+        if isinstance(value, str):
+            return value.strip().lower() in ('true', '1', 'yes')
+        return bool(value)
+    try:
+        return typ(value)
+    except (TypeError, ValueError):
+        return default
+
+
+def probe_tool(path):
+    """
+    校验依赖软件是否可以执行, 并获取版本信息
+    返回 {'path': 路径, 'valid': 是否可用, 'version': 版本信息}, 不可用时 path 为原始设置
+    """
+    info = {'path': path, 'valid': False, 'version': ''}
+    if not path:
+        return info
+
+    resolved = path if os.path.isfile(path) else shutil.which(path)
+    if not resolved or not os.access(resolved, os.X_OK):
+        return info
+    try:
+        process = sp.run([resolved, '-version'], stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE, timeout=10)
+    except (OSError, sp.TimeoutExpired):
+        return info
+
+    lines = process.stdout.decode(errors='ignore').strip().splitlines()
+    info.update(path=resolved, valid=process.returncode == 0, version=lines[0] if lines else '')
+    return info
+
+
+def load_setting_store():
+    """
+    获取保存用户设置的QSettings, 没有安装PySide2时返回None
+    """
+    try:
+        import PySide2
+    except ImportError:
+        logger.info('没有找到PySide2, 不读取保存的用户设置')
+        return None
+    from pmtm.qt_utils import QtSettingStore
+    return QtSettingStore(const.SETTING_FLAG)
+
+
 class UserSetting(object):
     """
     用户设置
+    第一次读取时把保存的设置全部加载到内存, 之后的读写都在内存中进行, 修改过的值在 sync 时写回
+    设置保存在QSettings中, 只在第一次读取时导入Qt, 没有PySide2时(命令行)只使用默认值和命令行参数
+    可以在工作线程中读取, 值改变时调用 add_listener 添加的函数
     """
 
-    @staticmethod
-    def get(key, default=None):
-        setting = QtCore.QSettings(const.SETTING_FLAG)
-        return setting.value(key, default)
+    # 依赖软件, 校验结果会缓存, 设置改变时重新校验
+    TOOL_LIST = ('ffmpeg', 'ffprobe', 'magick')
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._tool_lock = threading.Lock()
+        # 每个依赖软件单独校验, 校验时不占用 _tool_lock, 同一个软件只校验一次
+        self._probe_locks = {}
+        self._values = None
+        self._dirty_keys = set()
+        self._tool_cache = {}
+        self._listeners = []
+        self.store = None
+        # 仅在当前进程生效的设置, 优先于保存的设置, 命令行参数使用
+        self.overrides = {}
+
+    def _ensure_loaded(self):
+        if self._values is not None:
+            return
+        self.store = load_setting_store()
+        self._values = self.store.load() if self.store else {}
+
+    def add_listener(self, func):
+        """
+        设置改变时调用 func(key, value)
+        """
+        self._listeners.append(func)
+
+    def get(self, key, default=None, typ=None):
+        """
+        获取设置, typ 不为空时转换为对应的类型(int, float, bool, str), 转换失败返回 default
+        """
+        with self._lock:
+            if key in self.overrides:
+                value = self.overrides[key]
+            else:
+                self._ensure_loaded()
+                value = self._values.get(key, default)
+        if typ is None or value is None:
+            return value
+        return convert_value(value, typ, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._ensure_loaded()
+            if key in self._values and self._values[key] == value:
+                return
+            self._values[key] = value
+            self._dirty_keys.add(key)
+        self._clear_tool_cache(key)
+        for func in list(self._listeners):
+            func(key, value)
+
+    def override(self, key, value):
+        with self._lock:
+            self.overrides[key] = value
+        self._clear_tool_cache(key)
+
+    def sync(self):
+        """
+        把修改过的设置写回QSettings, 关闭窗口和退出程序时调用
+        """
+        with self._lock:
+            if not self._dirty_keys or self.store is None:
+                return
+            self.store.save({key: self._values[key] for key in self._dirty_keys})
+            self._dirty_keys.clear()
+
+    def _clear_tool_cache(self, key):
+        if key in self.TOOL_LIST:
+            with self._tool_lock:
+                self._tool_cache.pop(key, None)
+
+    def tool_info(self, name):
+        """
+        获取依赖软件的校验结果, 第一次使用时执行校验, 之后使用缓存
+        校验需要启动子进程, 不在锁内执行, 只有同一个软件的调用会等待校验完成
+        """
+        with self._tool_lock:
+            info = self._tool_cache.get(name)
+            probe_lock = self._probe_locks.setdefault(name, threading.Lock())
+        if info is not None:
+            return info
+
+        with probe_lock:
+            with self._tool_lock:
+                info = self._tool_cache.get(name)
+            if info is not None:
+                return info
+
+            path = self.get(name)
+            info = probe_tool(path)
+            if info['valid']:
+                logger.info(f'依赖软件 {name}: {info["path"]}, {info["version"]}')
+            else:
+                logger.warning(f'依赖软件 {name} 不可用: {info["path"]}')
+            # 校验期间设置被修改时不缓存旧路径的结果
+            if self.get(name) == path:
+                with self._tool_lock:
+                    self._tool_cache[name] = info
+            return info
+
+    def warm_tool_cache(self):
+        """
+        在后台线程中校验所有依赖软件, 启动时调用, 界面中第一次检查依赖软件时不需要等待
+        """
+        def _warm():
+            for name in self.TOOL_LIST:
+                self.tool_info(name)
+
+        thread = threading.Thread(target=_warm, name='WarmToolCache', daemon=True)
+        thread.start()
+        return thread
 
-    @staticmethod
-    def set(key, value):
-        setting = QtCore.QSettings(const.SETTING_FLAG)
-        setting.setValue(key, value)
+    def tool_path(self, name):
+        """
+        获取依赖软件的路径, 校验失败时返回设置中的原始路径, 由执行的命令报错
+        """
+        return self.tool_info(name)['path']
+
+
+# 当前线程中正在统计的任务, 线程池中的函数用 bind_metrics_session 继承提交时的任务
+_current_session = contextvars.ContextVar('metrics_session', default=None)
+
+
+def bind_metrics_session(func):
+    """
+    返回在当前统计任务中执行 func 的函数, 提交到线程池前调用, 线程池中产生的指标计入当前任务
+    """
+    session = _current_session.get()
+    if session is None:
+        return func
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _current_session.set(session)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _current_session.reset(token)
+    return wrapper
+
+
+class Metrics(object):
+    """
+    运行指标统计, 线程安全
+    counters: 计数, 例如读取的字节数, 缓存命中次数, 输出的行数
+    timers: 计时, 记录次数和总耗时, 例如子进程调用
+    全局的 metrics 同时把指标计入当前线程正在统计的任务(包括外层的任务)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters = {}
+        self.timers = {}
+
+    def add(self, name, value=1):
+        self._add(name, value)
+        session = _current_session.get()
+        while session is not None:
+            session.metrics._add(name, value)
+            session = session.parent
+
+    def add_time(self, name, seconds):
+        self._add_time(name, seconds)
+        session = _current_session.get()
+        while session is not None:
+            session.metrics._add_time(name, seconds)
+            session = session.parent
+
+    def _add(self, name, value):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def _add_time(self, name, seconds):
+        with self._lock:
+            count, total = self.timers.get(name, (0, 0.0))
+            self.timers[name] = (count + 1, total + seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - start_time)
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.counters), dict(self.timers)
+
+
+class MetricsSession(object):
+    """
+    统计一个任务执行期间的指标, 只统计创建任务的线程和它提交到线程池(bind_metrics_session)的工作
+    在任务的线程中创建, 在同一个线程中调用 finish, 同时运行的其他任务不会计入
+    """
+
+    # 汇总显示的指标, (名称前缀, 显示名称)
+    TIMER_LABELS = (('subprocess.', '子进程'), ('file_read', '读取文件'), ('file_stat', '获取文件状态'),
+                    ('ui_layout', '界面刷新'))
+    COUNTER_LABELS = (('bytes_read', '读取'), ('cache_hit', '缓存命中'), ('rows_emitted', '输出'))
+
+    def __init__(self, task_name):
+        self.task_name = task_name
+        self.start_time = time.perf_counter()
+        self.metrics = Metrics()
+        self.parent = _current_session.get()
+        self._token = _current_session.set(self)
+
+    def summary(self):
+        counters, timers = self.metrics.snapshot()
+        return {'task': self.task_name,
+                'duration': round(time.perf_counter() - self.start_time, 4),
+                'counters': counters,
+                'timers': {key: {'count': count, 'seconds': round(total, 4)}
+                           for key, (count, total) in timers.items()}}
+
+    def format_summary(self, data):
+        text_list = [f'[统计] {self.task_name} 耗时 {data["duration"]:.2f}秒']
+        for prefix, label in self.TIMER_LABELS:
+            items = [value for key, value in data['timers'].items() if key.startswith(prefix)]
+            if items:
+                count = sum(i['count'] for i in items)
+                seconds = sum(i['seconds'] for i in items)
+                text_list.append(f'{label} {count}次 {seconds:.2f}秒')
+        for key, label in self.COUNTER_LABELS:
+            if key not in data['counters']:
+                continue
+            value = data['counters'][key]
+            if key == 'bytes_read':
+                text_list.append(f'{label} {value / 1024 / 1024:.1f}MB')
+            else:
+                text_list.append(f'{label} {value}')
+        return ' | '.join(text_list)
+
+    def finish(self, **extra):
+        """
+        结束统计, 写入指标日志, 返回汇总文字
+        extra: 额外记录的数据, 例如处理的文件数量
+        """
+        if self._token is not None:
+            _current_session.reset(self._token)
+            self._token = None
+        data = self.summary()
+        data.update(extra)
+        data['time'] = time.strftime('%Y-%m-%d %H:%M:%S')
+        try:
+            with open(get_metrics_log_path(), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(data, ensure_ascii=False, default=str) + '\n')
+        except OSError:
+            logger.exception('写入指标日志失败')
+
+        text = self.format_summary(data)
+        logger.info(text)
+        return text
+
+
+# 设置为非0时开启诊断模式, 也可以在设置面板中开启
+PROFILE_ENV = 'PMTM_PROFILE'
+PROFILE_SETTING_KEY = 'profile_capture'
+
+# 多个任务同时记录时共用tracemalloc, 最后一个结束的任务停止记录
+_profile_lock = threading.Lock()
+_profile_count = 0
+_profile_started_tracing = False
+# 文件名中的序号, 同一秒内开始的任务不会覆盖彼此的文件
+_profile_serial = 0
+
+
+def is_profile_enabled():
+    if os.environ.get(PROFILE_ENV, '0') not in ('', '0'):
+        return True
+    return user_setting.get(PROFILE_SETTING_KEY, False, typ=bool)
+
+
+def describe_inputs(obj):
+    """
+    记录任务的输入参数, 列表和字典只记录数量, 用于复现问题时准备同样规模的数据
+    """
+    inputs = {}
+    for key, value in vars(obj).items():
+        if key.startswith('_'):
+            continue
+        if isinstance(value, (str, int, float, bool)) or value is None:
+            inputs[key] = value
+        elif isinstance(value, (list, tuple, set, dict)):
+            inputs[key] = {'type': type(value).__name__, 'size': len(value)}
+    return inputs
+
+
+@contextmanager
+def profile_capture(name, inputs=None):
+    """
+    诊断模式下, 用cProfile和tracemalloc记录代码块的执行情况, 文件保存在日志目录的 profile 文件夹下:
+    .prof: cProfile数据, 可以用 snakeviz 或 pstats 查看
+    .mem: tracemalloc快照, 用 tracemalloc.Snapshot.load 读取
+    .txt: 耗时和内存占用最多的位置
+    .json: 输入参数, 耗时, 内存峰值
+    cProfile只记录当前线程, 线程池中执行的部分只体现在等待时间中
+    多个任务同时记录时, 内存数据包含所有任务的分配
+    """
+    global _profile_count, _profile_started_tracing, _profile_serial
+    if not is_profile_enabled():
+        yield
+        return
+
+    now = time.time()
+    with _profile_lock:
+        _profile_serial += 1
+        file_name = '{}_{:03d}_{}_{}_{}'.format(time.strftime('%Y%m%d_%H%M%S', time.localtime(now)),
+                                             int(now * 1000) % 1000, os.getpid(), _profile_serial, name)
+        base_path = os.path.join(get_profile_folder(), file_name)
+        if _profile_count == 0:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(25)
+                _profile_started_tracing = True
+            tracemalloc.reset_peak()
+        _profile_count += 1
+
+    profiler = cProfile.Profile()
+    start_time = time.perf_counter()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        duration = time.perf_counter() - start_time
+        with _profile_lock:
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            _profile_count -= 1
+            if _profile_count == 0 and _profile_started_tracing:
+                tracemalloc.stop()
+                _profile_started_tracing = False
+
+        try:
+            profiler.dump_stats(f'{base_path}.prof')
+            snapshot.dump(f'{base_path}.mem')
+            with open(f'{base_path}.txt', 'w', encoding='utf-8') as f:
+                pstats.Stats(profiler, stream=f).sort_stats('cumulative').print_stats(50)
+                f.write('\n内存占用最多的位置:\n')
+                for stat in snapshot.statistics('lineno')[:30]:
+                    f.write(f'{stat}\n')
+            with open(f'{base_path}.json', 'w', encoding='utf-8') as f:
+                json.dump({'name': name,
+                           'duration': round(duration, 4),
+                           'memory_peak': peak,
+                           'inputs': inputs or {}}, f, ensure_ascii=False, indent=2, default=str)
+            logger.info(f'[诊断模式] 已保存性能分析数据: {base_path}')
+        except OSError:
+            logger.exception('保存性能分析数据失败')
+
+
+def profile_task(func):
+    """
+    装饰任务的run方法, 诊断模式下记录性能分析数据和任务的输入参数
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with profile_capture(type(self).__name__, inputs=describe_inputs(self)):
+            return func(self, *args, **kwargs)
+    return wrapper
 
 
 user_setting = UserSetting()
-logger = get_logger()
\ No newline at end of file
+metrics = Metrics()
+logger = get_logger()
+# 在日志线程停止之前写回设置
+atexit.register(user_setting.sync)
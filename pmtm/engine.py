@@ -0,0 +1,867 @@
+"""
+不依赖界面的任务逻辑, 界面中的任务类和命令行共用
+"""
+import os
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+from functools import partial, lru_cache
+from collections import OrderedDict, Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageDraw, ImageFont, ImageColor
+from dayu_path import DayuPath
+
+from pmtm.core import metrics, get_subsystem_logger, bind_metrics_session
+from pmtm.helper import gamma_lut, get_resource_file
+from pmtm.maya_utils import read_maya_references, read_maya_time_range
+from pmtm.media_utils import (get_video_frame_count, extract_thumbnail_from_mov, extract_thumbnail_from_image,
+                              extract_preview_from_image,
+                              extract_frame_from_mov, extract_filmstrip_from_mov, get_video_duration,
+                              extract_audio_from_mov, probe_audio_stream,
+                              get_image_resolution, get_video_rate, get_video_codex, get_video_resolution,
+                              get_video_colorspace, convert_seq_to_video, convert_video_to_seq, convert_seq_to_seq,
+                              convert_video_to_video, run_add_text_to_image, run_add_text_to_collage_image)
+
+
+logger = get_subsystem_logger('engine')
+
+DEFAULT_MAX_WORKERS = 4
+
+MOVIE_EXT_LIST = ['.mov', '.MOV', '.mp4', '.MP4']
+SUPPORT_FRAME_LIST = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'exr', 'dpx', 'tga']
+SUPPORT_VIDEO_LIST = ['mov', 'mp4']
+IMAGE_SUPPORTED_EXT = ['.png', '.jpg', '.jpeg', '.tiff', '.exr', '.JPG', '.JPEG', '.TIFF', '.EXR', '.PNG']
+VIDEO_SUPPORTED_EXT = ['.mp4', '.mov', '.MP4', '.MOV']
+
+# 导出的wav格式, 源音频已经是这个格式时直接复制音频流
+AUDIO_CODEC = 'pcm_s16le'
+AUDIO_SAMPLE_RATE = 44100
+AUDIO_CHANNELS = 2
+
+# 表格分两步填充时, 基础信息行每批发送的数量和最长间隔(秒)
+SKELETON_BATCH_SIZE = 200
+SKELETON_BATCH_INTERVAL = 0.2
+
+# 表格中按需生成的缩略图缓存目录, 文件没有改变时直接使用
+THUMBNAIL_CACHE_FOLDER = os.path.join(os.path.expanduser('~'), '.pmtm', 'cache', 'thumbnails')
+# 缩略图缓存的大小上限(字节)和保留天数, 启动时在后台清理
+THUMBNAIL_CACHE_MAX_SIZE = 1024 * 1024 * 1024
+THUMBNAIL_CACHE_MAX_DAYS = 30
+
+# 添加文字预览图的最大尺寸, 和magick -annotate 使用的文字偏移
+PREVIEW_SIZE = (960, 540)
+ANNOTATE_OFFSET = 10
+
+
+def map_parallel(func, items, max_workers=1):
+    """
+    并发执行func, 按输入顺序逐个返回结果。max_workers 为1时在当前线程顺序执行
+    """
+    if max_workers <= 1:
+        for item in items:
+            yield func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        yield from executor.map(bind_metrics_session(func), items)
+
+
+class PriorityJobQueue(object):
+    """
+    任务队列, 默认按加入的顺序取出, prioritize 可以让部分任务(例如表格中可见的行)先执行
+    可以在任意线程调用
+    """
+
+    def __init__(self, keys=()):
+        self._lock = threading.Lock()
+        self._pending = OrderedDict.fromkeys(keys)
+        self._priority = deque()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, keys):
+        with self._lock:
+            for key in keys:
+                self._pending[key] = None
+
+    def replace(self, keys):
+        """
+        替换所有没有取出的任务, 之前加入的任务被丢弃
+        """
+        with self._lock:
+            self._pending = OrderedDict.fromkeys(keys)
+            self._priority.clear()
+
+    def prioritize(self, keys):
+        """
+        替换优先执行的任务, 已经取出的任务会被忽略
+        """
+        with self._lock:
+            self._priority = deque(key for key in keys if key in self._pending)
+
+    def pop(self):
+        """
+        取出下一个任务, 没有任务时返回None
+        """
+        with self._lock:
+            while self._priority:
+                key = self._priority.popleft()
+                if key in self._pending:
+                    del self._pending[key]
+                    return key
+            if self._pending:
+                return self._pending.popitem(last=False)[0]
+            return None
+
+    def clear(self):
+        with self._lock:
+            self._pending.clear()
+            self._priority.clear()
+
+
+def map_prioritized(func, job_queue, max_workers=1):
+    """
+    并发执行func, 按 job_queue 的优先级取任务, 按完成的顺序逐个返回 (key, result)
+    func 出错时记录日志, result 为None
+    """
+    def _call(key):
+        try:
+            return key, func(key)
+        except Exception as e:
+            logger.error(f'任务失败: {key}, {e}')
+            return key, None
+
+    if max_workers <= 1:
+        key = job_queue.pop()
+        while key is not None:
+            yield _call(key)
+            key = job_queue.pop()
+        return
+
+    # 每个线程取完任务后放入一个None, 所有线程结束后停止
+    results = queue.Queue()
+
+    def _worker():
+        key = job_queue.pop()
+        while key is not None:
+            results.put(_call(key))
+            key = job_queue.pop()
+        results.put(None)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for _ in range(max_workers):
+            executor.submit(bind_metrics_session(_worker))
+        try:
+            finished = 0
+            while finished < max_workers:
+                item = results.get()
+                if item is None:
+                    finished += 1
+                    continue
+                yield item
+        finally:
+            # 提前停止时丢弃没有执行的任务, 线程执行完当前任务后退出
+            job_queue.clear()
+
+
+def iter_batches(items, batch_size=SKELETON_BATCH_SIZE, interval=SKELETON_BATCH_INTERVAL):
+    """
+    将items分批返回, 每批最多batch_size个, 距离上一批超过interval秒时提前返回, 让界面尽快显示第一批数据
+    """
+    batch = []
+    last_time = time.monotonic()
+    for item in items:
+        batch.append(item)
+        if len(batch) >= batch_size or time.monotonic() - last_time >= interval:
+            yield batch
+            batch = []
+            last_time = time.monotonic()
+    if batch:
+        yield batch
+
+
+def make_thumbnail_path():
+    return os.path.join(tempfile.mkdtemp(), 'thumbnail.jpg')
+
+
+def get_thumbnail_cache_path(file_path, gamma=1.0, kind='thumbnail'):
+    """
+    缩略图缓存路径, 由文件路径、大小、修改时间和gamma决定, 文件改变后会重新生成
+    kind 区分同一个文件不同用途的缓存, 例如缩略图和预览图
+    """
+    st = os.stat(file_path)
+    key = f'{kind}|{os.path.abspath(file_path)}|{st.st_size}|{st.st_mtime_ns}|{gamma}'
+    return os.path.join(THUMBNAIL_CACHE_FOLDER, f'{hashlib.sha1(key.encode("utf-8")).hexdigest()}.jpg')
+
+
+def make_file_thumbnail(file_path, gamma=1.0):
+    """
+    生成图片、视频或序列帧(取第一帧)的缩略图, 返回缩略图路径, 生成失败返回空字符串
+    已经生成过的直接返回缓存, gamma 只对图片有效
+    """
+    frames = getattr(file_path, 'frames', None)
+    source = file_path.restore_pattern(frames[0]) if frames else str(file_path)
+    cache_path = get_thumbnail_cache_path(source, gamma)
+    if os.path.isfile(cache_path):
+        metrics.add('cache_hit')
+        touch_cache_file(cache_path)
+        return cache_path
+
+    # 先输出到临时文件再改名, 避免其他线程读到没有写完的缓存, 失败时删除临时文件
+    os.makedirs(THUMBNAIL_CACHE_FOLDER, exist_ok=True)
+    temp_path = f'{os.path.splitext(cache_path)[0]}.{threading.get_ident()}.jpg'
+    try:
+        if os.path.splitext(source)[1][1:].lower() in SUPPORT_VIDEO_LIST:
+            extract_thumbnail_from_mov(source, temp_path)
+        else:
+            extract_thumbnail_from_image(source, temp_path, gamma=gamma)
+        if not os.path.isfile(temp_path):
+            return ''
+        os.replace(temp_path, cache_path)
+    finally:
+        if os.path.isfile(temp_path):
+            os.remove(temp_path)
+    return cache_path
+
+
+def touch_cache_file(cache_path):
+    """
+    使用缓存时更新文件的修改时间, 清理缓存时修改时间作为最后使用的时间
+    """
+    try:
+        os.utime(cache_path, None)
+    except OSError:
+        pass
+
+
+def prune_thumbnail_cache(folder=THUMBNAIL_CACHE_FOLDER, max_size=THUMBNAIL_CACHE_MAX_SIZE,
+                          max_days=THUMBNAIL_CACHE_MAX_DAYS):
+    """
+    清理缩略图缓存, 删除超过保留天数没有使用的文件, 总大小仍超过上限时从最久没有使用的文件开始删除
+    返回删除的文件数量
+    """
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return 0
+
+    file_list = []
+    for entry in entries:
+        try:
+            if entry.is_file():
+                st = entry.stat()
+                file_list.append((st.st_mtime, st.st_size, entry.path))
+        except OSError:
+            continue
+    file_list.sort()
+
+    expire_time = time.time() - max_days * 24 * 3600
+    total_size = sum(size for _, size, _ in file_list)
+    removed = 0
+    for mtime, size, path in file_list:
+        if mtime >= expire_time and total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except OSError:
+            continue
+        total_size -= size
+        removed += 1
+
+    if removed:
+        logger.info(f'清理缩略图缓存: 删除{removed}个文件, 剩余{total_size / 1024 / 1024:.1f}MB')
+    return removed
+
+
+def start_prune_thumbnail_cache():
+    """
+    在后台线程中清理缩略图缓存, 启动时调用
+    """
+    thread = threading.Thread(target=prune_thumbnail_cache, name='PruneThumbnailCache', daemon=True)
+    thread.start()
+    return thread
+
+
+def fill_thumbnails(data_list, gamma=1.0, max_workers=1):
+    """
+    为还没有缩略图的行生成缩略图, 写入行数据的 image
+    在后台线程中调用时, 传入行数据的副本, 不要传入表格模型中的数据
+    """
+    missing_list = [data for data in data_list if not data.get('image')]
+
+    def _make(data):
+        try:
+            data['image'] = make_file_thumbnail(data['file_path'], gamma=gamma)
+        except Exception as e:
+            logger.error(f'生成缩略图失败: {data["file_path"]}, {e}')
+    for _ in map_parallel(_make, missing_list, max_workers=max_workers):
+        pass
+    return data_list
+
+
+def get_thumbnail_size(image_path):
+    """
+    读取缩略图的尺寸, 只读取文件头, 读取失败返回空字符串
+    """
+    try:
+        with Image.open(image_path) as img:
+            return img.size
+    except OSError:
+        return '', ''
+
+
+def make_output_files(files_list, output_folder, ext):
+    """
+    批量输出时每个文件的输出路径 output_folder/文件名.ext
+    文件名相同的文件加上序号, 避免输出到同一个文件
+    """
+    name_list = [os.path.splitext(os.path.basename(file_path))[0] for file_path in files_list]
+    name_count = Counter(name_list)
+    return [os.path.join(output_folder, f'{name}_{index}{ext}' if name_count[name] > 1 else f'{name}{ext}')
+            for index, name in enumerate(name_list, start=1)]
+
+
+# -----------------------视频缩略图--------------------------------
+def extract_movie_thumbnail(file_path, output_image_file, poster_percent=0, filmstrip_count=1):
+    """
+    提取视频的缩略图, 返回缩略图路径, 没有生成缩略图时返回空字符串
+    poster_percent: 取画面的位置, 为视频时长的百分比, 0为第一帧
+    filmstrip_count: 大于1时在视频中均匀取多个画面, 横向拼成胶片条
+    取第一帧时不需要获取视频时长
+    """
+    # 删除之前生成的文件, 这次失败时不会返回旧的缩略图
+    if os.path.isfile(output_image_file):
+        os.remove(output_image_file)
+
+    if filmstrip_count > 1:
+        duration = get_video_duration(file_path)
+        seconds_list = [duration * (index + 0.5) / filmstrip_count for index in range(filmstrip_count)]
+        extract_filmstrip_from_mov(file_path, output_image_file, seconds_list)
+    elif poster_percent > 0:
+        seconds = get_video_duration(file_path) * min(poster_percent, 99) / 100.0
+        extract_thumbnail_from_mov(file_path, output_image_file, seconds=seconds)
+    else:
+        extract_thumbnail_from_mov(file_path, output_image_file)
+
+    if not os.path.isfile(output_image_file):
+        logger.error(f'提取缩略图失败: {file_path}')
+        return ''
+    return output_image_file
+
+
+def extract_movie_thumbnails(files_list, output_folder=None, poster_percent=0, filmstrip_count=1, max_workers=1):
+    """
+    批量提取视频缩略图, 按输入顺序返回缩略图路径
+    output_folder 为空时输出到临时目录, 否则输出为 output_folder/文件名.jpg, 同名的文件加上序号
+    失败的文件返回空字符串
+    """
+    if output_folder:
+        output_list = make_output_files(files_list, output_folder, '.jpg')
+    else:
+        output_list = [None] * len(files_list)
+
+    def _extract(item):
+        file_path, output_image_file = item
+        return extract_movie_thumbnail(file_path, output_image_file or make_thumbnail_path(),
+                                       poster_percent, filmstrip_count)
+    return map_parallel(_extract, zip(files_list, output_list), max_workers=max_workers)
+
+
+# -----------------------视频信息--------------------------------
+def get_movie_skeleton(file_path, file_size=''):
+    """
+    不读取视频, 只根据文件路径生成表格行的基础信息, 其他信息之后由 get_movie_data 补全
+    """
+    return {'file_name': os.path.splitext(os.path.basename(file_path))[0],
+            'file_size': file_size,
+            'image': '',
+            'file_path': file_path,
+            'thumbnail': ''
+            }
+
+
+def get_movie_data(file_path, with_thumbnail=True, poster_percent=0, filmstrip_count=1):
+    """
+    获取视频文件的信息, 不支持的文件返回None
+    """
+    file_name = os.path.basename(file_path)
+    real_name, ext = os.path.splitext(file_name)
+
+    if ext not in MOVIE_EXT_LIST:
+        return None
+
+    # 输出一个缩略图
+    thumbnail_path, image_w, image_h = '', '', ''
+    if with_thumbnail:
+        thumbnail_path = extract_movie_thumbnail(file_path, make_thumbnail_path(), poster_percent, filmstrip_count)
+        image_w, image_h = get_thumbnail_size(thumbnail_path)
+
+    # if_add_header_list
+    data = {'file_name': real_name,
+            'frame_count': get_video_frame_count(file_path),
+            'fps': get_video_rate(file_path),
+            'resolution': get_video_resolution(file_path),
+            'codec': get_video_codex(file_path),
+            'colorspace': get_video_colorspace(file_path),
+            'file_size': os.path.getsize(file_path),
+            'image': thumbnail_path,
+            'image_w': image_w,
+            'image_h': image_h,
+            'file_path': file_path,
+            'thumbnail': ''
+            }
+    return data
+
+
+def scan_movies(files_list, with_thumbnail=True, max_workers=1, poster_percent=0, filmstrip_count=1):
+    """
+    获取视频列表的信息, 按输入顺序返回, 不支持的文件返回None
+    """
+    func = partial(get_movie_data, with_thumbnail=with_thumbnail,
+                   poster_percent=poster_percent, filmstrip_count=filmstrip_count)
+    return map_parallel(func, files_list, max_workers=max_workers)
+
+
+# -----------------------导出音频--------------------------------
+def export_audio(file_path, output_audio_file):
+    """
+    导出视频的音频为wav, 返回处理方式
+    copy: 直接复制音频流, transcode: 转码, skip: 没有音轨, 跳过
+    ffprobe 或 ffmpeg 执行失败时抛出 RuntimeError
+    """
+    stream = probe_audio_stream(file_path)
+    if not stream:
+        return 'skip'
+
+    copy_stream = (stream.get('codec_name') == AUDIO_CODEC and
+                   str(stream.get('sample_rate')) == str(AUDIO_SAMPLE_RATE) and
+                   stream.get('channels') == AUDIO_CHANNELS)
+    extract_audio_from_mov(mov_file=file_path, output_audio_file=output_audio_file, copy_stream=copy_stream)
+    return 'copy' if copy_stream else 'transcode'
+
+
+def export_audio_files(files_list, output_folder, max_workers=1):
+    """
+    批量导出视频的音频, 输出为 output_folder/文件名.wav, 同名的文件加上序号
+    按输入顺序返回 (file_path, output_audio_file, status), 失败时 status 为 error
+    """
+    output_list = make_output_files(files_list, output_folder, '.wav')
+
+    def _export(item):
+        file_path, output_audio_file = item
+        try:
+            status = export_audio(file_path, output_audio_file)
+        except Exception as e:
+            logger.error(f'导出音频失败: {file_path}, {e}')
+            status = 'error'
+        return file_path, output_audio_file, status
+    return map_parallel(_export, zip(files_list, output_list), max_workers=max_workers)
+
+
+# -----------------------Maya文件--------------------------------
+def scan_maya_references(files_list, max_workers=1):
+    """
+    获取maya文件列表的引用文件, 按输入顺序返回 (file_path, ref_list), 读取失败时 ref_list 为None
+    """
+    def _read(file_path):
+        return file_path, read_maya_references(file_path)
+    return map_parallel(_read, files_list, max_workers=max_workers)
+
+
+def scan_maya_frames(files_list, max_workers=1):
+    """
+    获取maya文件列表的时间范围, 按输入顺序返回
+    """
+    return map_parallel(read_maya_time_range, files_list, max_workers=max_workers)
+
+
+# -----------------------格式转换--------------------------------
+def scan_sequences(scan_folder, is_include, ext_tuple, function_filter=None):
+    """
+    扫描目录下的序列帧和视频
+    """
+    return DayuPath(scan_folder).scan(recursive=is_include,
+                                      ext_filters=ext_tuple,
+                                      function_filter=function_filter)
+
+
+def get_sequence_skeleton(seq_file):
+    """
+    只根据扫描结果生成表格行的基础信息, 序列帧的帧范围在扫描时已经得到, 其他信息之后由 get_sequence_data 补全
+    不支持的格式返回None
+    """
+    ext = seq_file.ext[1:].lower()
+    if ext not in SUPPORT_FRAME_LIST + SUPPORT_VIDEO_LIST:
+        return None
+
+    data = {'thumbnail': '',
+            'file_name': seq_file.stem.stem,
+            'file_path': seq_file,
+            'image': '',
+            'dayu_path': seq_file}
+    if ext in SUPPORT_FRAME_LIST:
+        data.update({'start_frame': seq_file.frames[0],
+                     'end_frame': seq_file.frames[-1],
+                     'frame_count': len(seq_file.frames)})
+    return data
+
+
+def get_sequence_data(seq_file, with_thumbnail=True):
+    """
+    获取序列帧或视频的信息, 不支持的格式返回None
+    """
+    ext = seq_file.ext[1:].lower()  # 去掉点号 .jpg -> jpg
+    thumbnail_path = make_thumbnail_path() if with_thumbnail else ''
+    file_name = seq_file.stem.stem
+
+    if ext in SUPPORT_FRAME_LIST:
+        first_file = seq_file.restore_pattern(seq_file.frames[0])
+        if with_thumbnail:
+            extract_thumbnail_from_image(first_file, thumbnail_path)
+        image_w, image_h = get_image_resolution(first_file)
+        reslolution = f'{image_w}x{image_h}'
+        start_frame = seq_file.frames[0]
+        end_frame = seq_file.frames[-1]
+        frame_count = len(seq_file.frames)
+    elif ext in SUPPORT_VIDEO_LIST:
+        if with_thumbnail:
+            extract_thumbnail_from_mov(seq_file, thumbnail_path)
+        reslolution = get_video_resolution(seq_file)
+        start_frame = 1
+        end_frame = get_video_frame_count(seq_file)
+        frame_count = end_frame
+    else:
+        return None
+
+    data = {'thumbnail': '',
+            'file_name': file_name,
+            'start_frame': start_frame,
+            'end_frame': end_frame,
+            'frame_count': frame_count,
+            'resolution': reslolution,
+            'file_path': seq_file,
+            'image': thumbnail_path,
+            'dayu_path': seq_file}
+    return data
+
+
+def scan_sequences_data(seq_files, with_thumbnail=True, max_workers=1):
+    """
+    获取序列帧和视频列表的信息, 按输入顺序返回, 不支持的格式返回None
+    """
+    func = partial(get_sequence_data, with_thumbnail=with_thumbnail)
+    return map_parallel(func, seq_files, max_workers=max_workers)
+
+
+def get_convert_method(input_ext, output_ext):
+    """
+    根据输入和输出格式获取转换方法, 不支持返回None
+    """
+    if input_ext in SUPPORT_FRAME_LIST and output_ext in SUPPORT_VIDEO_LIST:
+        return 'img_to_video'
+    elif input_ext in SUPPORT_VIDEO_LIST and output_ext in SUPPORT_FRAME_LIST:
+        return 'video_to_img'
+    elif input_ext in SUPPORT_FRAME_LIST and output_ext in SUPPORT_FRAME_LIST:
+        return 'img_to_img'
+    elif input_ext in SUPPORT_VIDEO_LIST and output_ext in SUPPORT_VIDEO_LIST:
+        return 'video_to_video'
+    return None
+
+
+def convert_file(data, output_settings, output_folder):
+    """
+    根据不同的转换方法，执行不同的函数
+    output_settings: {'convert_method': '', 'output_ext': '', 'fps': '', 'start_frame': 1}
+    """
+    convert_method = output_settings['convert_method']
+    output_ext = output_settings['output_ext']
+
+    # 获取输出文件路径
+    output_file = os.path.join(output_folder, f'{data["file_name"]}.{output_ext}')
+
+    if convert_method == 'img_to_video':
+        convert_seq_to_video(seq_file=data['dayu_path'],
+                             output_video_file=output_file,
+                             start_frame=data['dayu_path'].frames[0],
+                             fps=output_settings.get('fps', 25)
+                             )
+    elif convert_method == 'video_to_img':
+        seq_output_path = get_seq_output_path(data, output_settings, output_folder)
+        convert_video_to_seq(video_file=data['dayu_path'],
+                             output_seq_file=seq_output_path,
+                             start_frame=output_settings.get('start_frame', 1)
+                             )
+    elif convert_method == 'img_to_img':
+        seq_output_path = get_seq_output_path(data, output_settings, output_folder)
+        convert_seq_to_seq(source_seq_file=data['dayu_path'],
+                           output_seq_file=seq_output_path,
+                           source_start_frame=data['dayu_path'].frames[0],
+                           output_start_frame=output_settings.get('start_frame', 1)
+                           )
+    elif convert_method == 'video_to_video':
+        convert_video_to_video(source_video_file=data['dayu_path'],
+                               output_video_file=output_file)
+
+
+def get_seq_output_path(data, output_settings, output_folder):
+    """
+    获取序列帧的输出路径格式
+    """
+    start_frame = output_settings['start_frame']
+    output_ext = output_settings['output_ext']
+    frame_count = data['frame_count']
+
+    num_len = len(str(start_frame+frame_count))
+    if num_len <= 4:
+        output_path = os.path.join(output_folder, data['file_name'], f'{data["file_name"]}.%04d.{output_ext}')
+    else:
+        num_len = str(num_len).zfill(2)
+        output_path = os.path.join(output_folder, data['file_name'], f'{data["file_name"]}.%{num_len}d.{output_ext}')
+
+    dir_path = os.path.dirname(output_path)
+    os.makedirs(dir_path, exist_ok=True)
+    logger.debug(f'创建序列输出路径: {dir_path}')
+
+    return output_path
+
+
+# -----------------------图片添加文字--------------------------------
+def collect_annotate_files(path_list, is_include, only_get_first):
+    """
+    从所有路径中，获取所有支持格式的文件路径
+    """
+    files_list = []
+
+    for path in path_list:
+        if os.path.isfile(path):
+            if os.path.splitext(path)[1] in IMAGE_SUPPORTED_EXT + VIDEO_SUPPORTED_EXT:
+                files_list.append(path)
+            else:
+                logger.error(f'不支持的文件类型: {path}')
+        elif os.path.isdir(path):
+            # 扫描图片
+            for seq_file in DayuPath(path).scan(recursive=is_include, ext_filters=tuple(IMAGE_SUPPORTED_EXT)):
+                if only_get_first:
+                    files_list.append(seq_file.restore_pattern(seq_file.frames[0]))
+                else:
+                    files_list.extend(seq_file.restore_pattern(seq_file.frames))
+            # 扫描视频
+            for root, dirs, files in os.walk(path):
+                for f in files:
+                    file_path = os.path.join(root, f)
+                    if os.path.splitext(file_path)[1] in VIDEO_SUPPORTED_EXT:
+                        files_list.append(file_path)
+
+    return files_list
+
+
+def get_annotate_data(file_path, color, gamma=1.0, with_thumbnail=True):
+    """
+    获取添加文字使用的文件数据并提取缩略图, 不支持的文件返回None
+    视频提取原尺寸的画面(frame), 输出图片时在这个画面上添加文字
+    with_thumbnail 为False时不提取, 缩略图之后按需生成, 视频画面在输出时提取
+    """
+    ext = os.path.splitext(file_path)[1]
+    thumb_path, frame_path = '', ''
+
+    if ext in IMAGE_SUPPORTED_EXT:
+        if with_thumbnail:
+            thumb_path = make_thumbnail_path()
+            extract_thumbnail_from_image(image_file=file_path,
+                                         output_image_file=thumb_path,
+                                         gamma=gamma)
+    elif ext in VIDEO_SUPPORTED_EXT:
+        if with_thumbnail:
+            thumb_path = frame_path = extract_annotate_frame(file_path)
+    else:
+        logger.error(f'不支持的文件类型: {file_path}')
+        return None
+
+    return {'thumbnail': '',
+            'file_name': os.path.basename(file_path),
+            'file_path': file_path,
+            'image': thumb_path,
+            'frame': frame_path,
+            'text': '',
+            'color': color}
+
+
+def extract_annotate_frame(file_path):
+    frame_path = make_thumbnail_path()
+    extract_frame_from_mov(mov_file=file_path,
+                           output_image_file=frame_path)
+    return frame_path
+
+
+def parse_color(color):
+    """
+    将颜色名称或 #RRGGBB 转换为 (r, g, b), 无法解析时和QColor一样返回黑色
+    """
+    try:
+        return ImageColor.getrgb(color)[:3]
+    except (ValueError, AttributeError):
+        return 0, 0, 0
+
+
+def color_to_rgba(color, text_transparency=100):
+    """
+    将颜色转换为magick使用的rgba字符串, text_transparency 为百分比
+    """
+    red, green, blue = parse_color(color)
+    return f'rgba({red}, {green}, {blue}, {text_transparency/100.0})'
+
+
+def get_annotate_source(data):
+    """
+    获取添加文字使用的图片, 图片使用原图, 视频使用提取出的画面
+    """
+    ext = os.path.splitext(data['file_path'])[1]
+    if ext in IMAGE_SUPPORTED_EXT:
+        return data['file_path']
+    elif ext in VIDEO_SUPPORTED_EXT:
+        if not data.get('frame') or not os.path.isfile(data['frame']):
+            data['frame'] = extract_annotate_frame(data['file_path'])
+        return data['frame']
+    return None
+
+
+def load_annotate_preview(data):
+    """
+    读取添加文字预览使用的缩小图片, 返回 (图片, 缩小比例)
+    pillow 不能读取的格式(exr, dpx等)先用magick缩小并缓存, 读取失败返回None
+    """
+    image_file = get_annotate_source(data)
+    if not image_file:
+        return None
+
+    try:
+        with Image.open(image_file) as img:
+            width = img.width
+            img.draft('RGB', PREVIEW_SIZE)
+            preview = img.convert('RGB')
+    except OSError:
+        width = int(get_image_resolution(image_file)[0])
+        preview_path = get_thumbnail_cache_path(image_file, kind='preview')
+        if os.path.isfile(preview_path):
+            touch_cache_file(preview_path)
+        else:
+            os.makedirs(THUMBNAIL_CACHE_FOLDER, exist_ok=True)
+            extract_preview_from_image(image_file, preview_path, *PREVIEW_SIZE)
+        with Image.open(preview_path) as img:
+            preview = img.convert('RGB')
+
+    preview.thumbnail(PREVIEW_SIZE)
+    return preview, preview.width / float(width)
+
+
+@lru_cache(maxsize=16)
+def load_annotate_font(size):
+    try:
+        return ImageFont.truetype(get_resource_file('msyh.ttf'), size)
+    except OSError:
+        return ImageFont.load_default(size)
+
+
+def render_annotate_preview(preview, scale, text, color, gravity, text_size, text_transparency, gamma):
+    """
+    在缩小的图片上按 run_add_text_to_image 相同的布局绘制文字, 返回新的图片
+    magick 的文字大小和偏移为像素, 按缩小比例换算, gamma 和magick相同, 在添加文字后应用到整张图片
+    """
+    font = load_annotate_font(max(1, round(text_size * 10 * scale)))
+    offset = round(ANNOTATE_OFFSET * scale)
+    ascent, descent = font.getmetrics()
+    text_w = ImageDraw.Draw(preview).textlength(text, font=font)
+    text_h = ascent + descent
+
+    if gravity.endswith('West'):
+        x = 0
+    elif gravity.endswith('East'):
+        x = preview.width - text_w
+    else:
+        x = (preview.width - text_w) / 2
+    if gravity.startswith('North'):
+        y = offset
+    elif gravity.startswith('South'):
+        y = preview.height - text_h - offset
+    else:
+        y = (preview.height - text_h) / 2 + offset
+
+    fill = parse_color(color) + (round(255 * text_transparency / 100.0),)
+    layer = Image.new('RGBA', preview.size, (0, 0, 0, 0))
+    ImageDraw.Draw(layer).text((x, y), text, font=font, fill=fill)
+    result = Image.alpha_composite(preview.convert('RGBA'), layer).convert('RGB')
+    if gamma != 1.0:
+        result = result.point(gamma_lut(gamma) * 3)
+    return result
+
+
+def annotate_each_image(data_list, output_folder, ext, gravity, text_size, text_transparency, gamma,
+                        max_workers=1, log_callback=None):
+    """
+    分别输出单张添加文字的图片, 返回输出的文件列表
+    """
+    total = len(data_list)
+    jobs = []
+    for data in data_list:
+        image_file = get_annotate_source(data)
+        if not image_file:
+            continue
+        file_name = os.path.splitext(data['file_name'])[0]
+        jobs.append({'image_file': image_file,
+                     'output_image_file': os.path.join(output_folder, f'{file_name}{ext}'),
+                     'text': data['text'],
+                     'color': color_to_rgba(data['color'], text_transparency)})
+
+    def _run(job):
+        run_add_text_to_image(size=text_size*10, gravity=gravity, gamma=gamma, **job)
+        return job['output_image_file']
+
+    output_files = []
+    for current, output_image_file in enumerate(map_parallel(_run, jobs, max_workers=max_workers), start=1):
+        output_files.append(output_image_file)
+        if log_callback:
+            log_callback(f'({current}/{total}) 导出文件: {output_image_file}')
+    return output_files
+
+
+def annotate_collage_image(data_list, output_path, gravity, text_size, text_transparency, gamma):
+    """
+    为每张图片添加文字, 然后拼成整张图
+    """
+    collage_list = []
+    for data in data_list:
+        image_file = get_annotate_source(data)
+        if not image_file:
+            continue
+        collage_list.append({
+            'text': data['text'],
+            'color': color_to_rgba(data['color'], text_transparency),
+            'file_path': image_file
+        })
+
+    # 计算水平和垂直数量，用于拼图
+    vertical_count, horizontal_count = calc_vh_value(total_count=len(collage_list))
+
+    run_add_text_to_collage_image(
+        output_image_file=output_path,
+        data_list=collage_list,
+        horizontal_count=horizontal_count,
+        vertical_count=vertical_count,
+        gravity=gravity,
+        size=text_size*10,
+        gamma=gamma
+    )
+
+
+def calc_vh_value(total_count):
+    horizontal_count = int(total_count ** 0.5)
+    if horizontal_count * horizontal_count < total_count:
+        horizontal_count += 1
+    vertical_count = horizontal_count
+
+    return horizontal_count, vertical_count
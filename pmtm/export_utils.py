@@ -0,0 +1,308 @@
+import io
+import os
+import csv
+import json
+import hashlib
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+
+import openpyxl
+from PIL import Image as PILImage
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.drawing.image import Image
+from openpyxl.styles import Font, Alignment, NamedStyle
+from openpyxl.utils import get_column_letter
+from pmtm.core import metrics, get_subsystem_logger
+
+try:
+    import pyarrow
+    import pyarrow.parquet as pq
+except ImportError:
+    pyarrow = None
+    pq = None
+
+
+logger = get_subsystem_logger('export')
+
+THUMBNAIL_SIZE = (192, 108)
+XLSX_TEXT_STYLE = 'pmtm_text'
+XLSX_COLUMN_WIDTH = 190.0 / 8.2121 + 0.63
+XLSX_THUMBNAIL_ROW_HEIGHT = THUMBNAIL_SIZE[1] / 1.333333
+THUMBNAIL_JPEG_QUALITY = 80
+PARQUET_BATCH_SIZE = 5000
+
+# xlsx中图片和绘图关系文件所在的目录
+XLSX_MEDIA_FOLDER = 'xl/media/'
+XLSX_DRAWING_RELS_FOLDER = 'xl/drawings/_rels/'
+
+# 支持导出的格式, 文件对话框中使用的过滤器
+EXPORT_FILTER_DICT = {
+    '.xlsx': 'XLSX Files(*.xlsx)',
+    '.csv': 'CSV Files(*.csv)',
+    '.jsonl': 'JSON Lines(*.jsonl)',
+}
+if pq is not None:
+    EXPORT_FILTER_DICT['.parquet'] = 'Parquet Files(*.parquet)'
+
+
+def make_text_style():
+    """
+    表格文字的共享样式, 所有单元格引用同一个样式
+    """
+    style = NamedStyle(name=XLSX_TEXT_STYLE)
+    style.font = Font(name='Heiti SC Light', size=12)
+    style.alignment = Alignment(horizontal='center', vertical='center')
+    return style
+
+
+def file_digest(file_path):
+    """
+    计算文件内容的哈希值
+    """
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def encode_thumbnail(image_path, size=THUMBNAIL_SIZE, quality=THUMBNAIL_JPEG_QUALITY):
+    """
+    将图片缩放到单元格大小并编码为jpeg, 返回jpeg数据
+    """
+    with PILImage.open(image_path) as img:
+        img.draft('RGB', size)
+        img = img.convert('RGB')
+        img.thumbnail(size, PILImage.LANCZOS)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=quality, optimize=True)
+    return buffer.getvalue()
+
+
+def encode_thumbnails(image_list, size=THUMBNAIL_SIZE, max_workers=8):
+    """
+    并发编码缩略图, 内容相同的图片只编码一次
+    返回字典 {image_path: jpeg数据}, 读取失败的图片不在结果中
+    """
+    image_set = set(i for i in image_list if i)
+
+    def _digest(image_path):
+        try:
+            return image_path, file_digest(image_path)
+        except OSError:
+            return image_path, None
+
+    def _encode(image_path):
+        try:
+            return encode_thumbnail(image_path, size=size)
+        except (OSError, ValueError):
+            return None
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        digest_dict = {path: digest for path, digest in executor.map(_digest, image_set) if digest}
+
+        # 每个哈希值只取一张图片编码
+        source_dict = {}
+        for path, digest in digest_dict.items():
+            source_dict.setdefault(digest, path)
+        metrics.add('cache_hit', len(digest_dict) - len(source_dict))
+        encoded_dict = dict(zip(source_dict.keys(), executor.map(_encode, source_dict.values())))
+
+    return {path: encoded_dict[digest] for path, digest in digest_dict.items() if encoded_dict[digest]}
+
+
+def get_export_filter(ext_list=None):
+    """
+    获取文件对话框的过滤器字符串, ext_list 为空时返回所有支持的格式
+    """
+    ext_list = ext_list or EXPORT_FILTER_DICT.keys()
+    return ';;'.join(EXPORT_FILTER_DICT[ext] for ext in ext_list if ext in EXPORT_FILTER_DICT)
+
+
+def export_report(output_path, header_list, data_list, thumbnail_key='thumbnail', progress_callback=None, **kwargs):
+    """
+    根据输出文件的后缀, 选择对应的格式导出
+    progress_callback: 每写入一行调用一次, 参数为已写入的行数
+    """
+    ext = os.path.splitext(output_path)[1].lower()
+    export_func = {'.xlsx': export_xlsx,
+                   '.csv': export_csv,
+                   '.jsonl': export_jsonl,
+                   '.parquet': export_parquet}.get(ext)
+    if export_func is None:
+        raise ValueError(f'不支持的导出格式: {ext}')
+    return export_func(output_path=output_path,
+                       header_list=header_list,
+                       data_list=_count_rows(data_list),
+                       thumbnail_key=thumbnail_key,
+                       progress_callback=progress_callback,
+                       **kwargs)
+
+
+def export_csv(output_path, header_list, data_list, thumbnail_key='thumbnail', progress_callback=None):
+    """
+    逐行导出csv表格, 表头使用header的label
+    """
+    header_list = [header for header in header_list if header['key'] != thumbnail_key]
+
+    # 使用带BOM的utf-8, 确保Excel打开时中文不乱码
+    with open(output_path, 'w', newline='', encoding='utf-8-sig') as f:
+        csv_write = csv.writer(f)
+        csv_write.writerow([header['label'] for header in header_list])
+        for count, data in enumerate(data_list, start=1):
+            csv_write.writerow([data.get(header['key'], '') for header in header_list])
+            _call_progress(progress_callback, count)
+
+
+def export_jsonl(output_path, header_list, data_list, thumbnail_key='thumbnail', progress_callback=None):
+    """
+    逐行导出JSON Lines, 每行一个json对象, 字段名使用header的key
+    """
+    keys = [header['key'] for header in header_list if header['key'] != thumbnail_key]
+
+    with open(output_path, 'w', encoding='utf-8') as f:
+        for count, data in enumerate(data_list, start=1):
+            f.write(json.dumps({key: data.get(key, '') for key in keys}, ensure_ascii=False, default=str))
+            f.write('\n')
+            _call_progress(progress_callback, count)
+
+
+def export_parquet(output_path, header_list, data_list, thumbnail_key='thumbnail', progress_callback=None,
+                   batch_size=PARQUET_BATCH_SIZE):
+    """
+    按批次导出parquet列式文件, 每批数据写为一个row group, 字段名使用header的key
+    需要安装pyarrow
+    """
+    if pq is None:
+        raise ImportError('导出parquet需要安装pyarrow')
+
+    keys = [header['key'] for header in header_list if header['key'] != thumbnail_key]
+    schema = pyarrow.schema([(key, pyarrow.string()) for key in keys])
+    columns = {key: [] for key in keys}
+    count = 0
+
+    def _flush(writer):
+        writer.write_table(pyarrow.table(columns, schema=schema))
+        for key in keys:
+            columns[key].clear()
+
+    with pq.ParquetWriter(output_path, schema) as writer:
+        for count, data in enumerate(data_list, start=1):
+            for key in keys:
+                value = data.get(key)
+                columns[key].append(None if value is None else str(value))
+            if count % batch_size == 0:
+                _flush(writer)
+            _call_progress(progress_callback, count)
+        if count % batch_size or not count:
+            _flush(writer)
+
+
+def export_xlsx(output_path, header_list, data_list, thumbnail_key='thumbnail', progress_callback=None,
+                encoded_images=None):
+    """
+    以只写模式导出xlsx表格, 逐行写入, 内存占用不随行数增长
+    header_list: [{'label': '文件名', 'key': 'file_name'}, ...]
+    data_list: 可迭代的行数据, 每行为一个字典
+    thumbnail_key: 该列插入缩略图, 图片路径取自行数据的 'image'
+    encoded_images: encode_thumbnails 的结果, 有则直接嵌入已编码的缩略图, 否则嵌入原图
+    """
+    wb = openpyxl.Workbook(write_only=True)
+    wb.add_named_style(make_text_style())
+    sheet = wb.create_sheet()
+
+    keys = [header['key'] for header in header_list]
+    thumbnail_column = keys.index(thumbnail_key) if thumbnail_key in keys else None
+    columns = [get_column_letter(num) for num in range(1, len(keys) + 1)]
+
+    # 只写模式下, 列宽需要在写入数据之前设置
+    for column in columns:
+        sheet.column_dimensions[column].width = XLSX_COLUMN_WIDTH
+
+    sheet.append([_text_cell(sheet, header['label']) for header in header_list])
+
+    for row, data in enumerate(data_list, start=2):
+        if thumbnail_column is not None:
+            sheet.row_dimensions[row].height = XLSX_THUMBNAIL_ROW_HEIGHT
+
+        cells = []
+        for _index, key in enumerate(keys):
+            if _index == thumbnail_column:
+                cells.append(None)
+                img = _thumbnail_image(data.get('image'), encoded_images)
+                if img:
+                    sheet.add_image(img, f'{columns[_index]}{row}')
+            else:
+                cells.append(_text_cell(sheet, str(data.get(key, ''))))
+        sheet.append(cells)
+        _call_progress(progress_callback, row - 1)
+
+    wb.save(output_path)
+    if thumbnail_column is not None:
+        dedupe_xlsx_media(output_path)
+
+
+def dedupe_xlsx_media(xlsx_path):
+    """
+    openpyxl 为每个图片对象单独保存一个图片文件, 内容相同的图片也会重复保存
+    保存后重写压缩包, 内容相同的图片只保留一份, 绘图关系都指向保留的图片, 返回删除的图片数量
+    """
+    with zipfile.ZipFile(xlsx_path) as zin:
+        digest_dict = {}
+        rename_dict = {}  # {重复的图片: 保留的图片}
+        for info in zin.infolist():
+            if info.filename.startswith(XLSX_MEDIA_FOLDER):
+                digest = hashlib.sha1(zin.read(info)).hexdigest()
+                kept = digest_dict.setdefault(digest, info.filename)
+                if kept != info.filename:
+                    rename_dict[info.filename] = kept
+        if not rename_dict:
+            return 0
+
+        temp_path = f'{xlsx_path}.tmp'
+        with zipfile.ZipFile(temp_path, 'w', zipfile.ZIP_DEFLATED) as zout:
+            for info in zin.infolist():
+                if info.filename in rename_dict:
+                    continue
+                data = zin.read(info)
+                if info.filename.startswith(XLSX_DRAWING_RELS_FOLDER):
+                    text = data.decode('utf-8')
+                    for old, new in rename_dict.items():
+                        text = text.replace(f'"/{old}"', f'"/{new}"')
+                    data = text.encode('utf-8')
+                zout.writestr(info, data)
+    os.replace(temp_path, xlsx_path)
+
+    metrics.add('cache_hit', len(rename_dict))
+    logger.debug(f'{xlsx_path} 合并了{len(rename_dict)}张重复的图片')
+    return len(rename_dict)
+
+
+def _count_rows(data_list):
+    for data in data_list:
+        metrics.add('rows_emitted')
+        yield data
+
+
+def _call_progress(progress_callback, count):
+    if progress_callback:
+        progress_callback(count)
+
+
+def _text_cell(sheet, value):
+    cell = WriteOnlyCell(sheet, value=value)
+    cell.style = XLSX_TEXT_STYLE
+    return cell
+
+
+def _thumbnail_image(image_path, encoded_images):
+    if not image_path:
+        return None
+    if encoded_images is not None:
+        if image_path not in encoded_images:
+            return None
+        # 每张图片需要独立的数据流, openpyxl 保存后会关闭它
+        return Image(io.BytesIO(encoded_images[image_path]))
+    img = Image(image_path)
+    img.width, img.height = THUMBNAIL_SIZE
+    return img
@@ -1,29 +1,29 @@
 import os
 import time
-import json
-import tempfile
 import copy
 import traceback
 from functools import partial
 
 import dayu_widgets as dy
 from dayu_widgets.drawer import MDrawer
-from dayu_path import DayuPath
 from PySide2 import QtWidgets, QtCore, QtGui
 
-from pmtm.helper import g_pixmap, check_depend_tool_exist, open_file, open_folder
-from pmtm.core import logger, user_setting
-from pmtm.common_widgets import CommonToolWidget, MenuPushButton, CommonDialog, DropTabelView, InfoBoard, CommonWidget
-from pmtm.media_utils import extract_thumbnail_from_image, run_add_text_to_image, run_add_text_to_collage_image, extract_thumbnail_from_mov
+from pmtm.helper import check_depend_tool_exist, open_file, open_folder, stat_files_by_dir, THUMBNAIL_HEIGHT
+from pmtm.qt_utils import g_pixmap, pil_to_pixmap
+from pmtm.history_store import HistoryStore
+from pmtm.core import logger, user_setting, metrics, MetricsSession, profile_task
+from pmtm.common_widgets import (CommonToolWidget, MenuPushButton, CommonDialog, DropTabelView, InfoBoard, CommonWidget,
+                                 ProgressiveTableModel, ThumbnailLoader)
+from pmtm.engine import (IMAGE_SUPPORTED_EXT, DEFAULT_MAX_WORKERS, THUMBNAIL_CACHE_FOLDER, iter_batches,
+                         collect_annotate_files, fill_thumbnails,
+                         get_annotate_data, make_file_thumbnail, load_annotate_preview, render_annotate_preview,
+                         annotate_each_image, annotate_collage_image)
 
 
 def _color(x, y):
     return QtGui.QColor(y.get('color'))
 
 
-IMAGE_SUPPORTED_EXT = ['.png', '.jpg', '.jpeg', '.tiff', '.exr', '.JPG', '.JPEG', '.TIFF', '.EXR', '.PNG']
-VIDEO_SUPPORTED_EXT = ['.mp4', '.mov', '.MP4', '.MOV']
-
 HEADER_LIST = [
             {'label': '缩略图', 'key': 'thumbnail', 'icon': g_pixmap},
             {'label': '文件名', 'key': 'file_name', 'align': 'center'},
@@ -48,6 +48,11 @@ DEFAULT_GRAVITY = '下中'
 DEFAULT_COLOR = '#00aa00'
 DEFAULT_SIZE = 6
 
+# 修改gamma后延迟刷新缩略图的时间(毫秒)
+GAMMA_PREVIEW_DELAY = 150
+# 修改文字设置后延迟刷新预览的时间(毫秒)
+ANNOTATE_PREVIEW_DELAY = 100
+
 
 class AddTextToImageUI(CommonToolWidget):
 
@@ -55,12 +60,22 @@ class AddTextToImageUI(CommonToolWidget):
         super().__init__(**kwargs)
 
         # data
-        self.model = dy.MTableModel()
+        self.model = ProgressiveTableModel(key='file_path', movable=True)
         self.sort_model = dy.MSortFilterModel()
+        self.thumbnail_loader = ThumbnailLoader(make_file_thumbnail, parent=self)
+        self.display_gamma = 1.0
+        self.gamma_timer = QtCore.QTimer(self)
+        self.preview_timer = QtCore.QTimer(self)
+        self.preview_source = None  # (file_path, 缩小的图片, 缩小比例)
+        self.preview_task = None
+        self.history_task = None
+        self._history_store = None
 
         # widgets
         self.table_view = DropTabelView(show_row_count=True, parent=self)
+        self.preview_label = QtWidgets.QLabel(parent=self)
         self.info_board = InfoBoard(parent=self)
+        self.table_splitter = QtWidgets.QSplitter(orientation=QtCore.Qt.Horizontal, parent=self)
         self.splitter = QtWidgets.QSplitter(orientation=QtCore.Qt.Vertical, parent=self)
         self.clear_bt = dy.MPushButton('清空所有').small()
         self.is_include_ck = dy.MCheckBox('包含子目录')
@@ -81,7 +96,9 @@ class AddTextToImageUI(CommonToolWidget):
         self.setup()
 
     def init_ui(self):
-        self.splitter.addWidget(self.table_view)
+        self.table_splitter.addWidget(self.table_view)
+        self.table_splitter.addWidget(self.preview_label)
+        self.splitter.addWidget(self.table_splitter)
         self.splitter.addWidget(self.info_board)
 
         self.add_widgets_h_line(dy.MLabel('扫描选项'), self.is_include_ck, self.only_get_first_ck, self.sort_by_file_name_ck,
@@ -98,6 +115,15 @@ class AddTextToImageUI(CommonToolWidget):
         # 设置分割器比例
         self.splitter.setStretchFactor(0, 8)
         self.splitter.setStretchFactor(1, 2)
+        self.table_splitter.setStretchFactor(0, 6)
+        self.table_splitter.setStretchFactor(1, 4)
+
+        # 设置预览
+        self.preview_label.setAlignment(QtCore.Qt.AlignCenter)
+        self.preview_label.setMinimumSize(320, 180)
+        self.preview_label.setText('选择一行预览文字效果')
+        self.preview_timer.setSingleShot(True)
+        self.preview_timer.setInterval(ANNOTATE_PREVIEW_DELAY)
 
         # 设置导出选项
         self.export_type_rb.set_button_list(['分别输出', '拼成整张'])
@@ -112,7 +138,10 @@ class AddTextToImageUI(CommonToolWidget):
         self.text_transparency_box.setSuffix('%')
         self.gamma_box.setRange(0.1, 10)
         self.gamma_box.setSingleStep(0.1)
-        self.gamma_box.setValue(float(user_setting.get('add_text_to_image_gamma', 1.0)))
+        self.gamma_box.setValue(user_setting.get('add_text_to_image_gamma', 1.0, typ=float))
+        self.display_gamma = self.gamma_box.value()
+        self.gamma_timer.setSingleShot(True)
+        self.gamma_timer.setInterval(GAMMA_PREVIEW_DELAY)
         self.history_line.setPlaceholderText('在此输入历史记录名称')
 
         # 设置宽度
@@ -130,12 +159,16 @@ class AddTextToImageUI(CommonToolWidget):
                   self.sort_by_file_name_ck, self.open_after_export_ck):
             w.setChecked(True)
 
-        # 设置表格
-        self.model.set_header_list(HEADER_LIST)
+        # 设置表格, 缩略图显示时应用当前的gamma
+        header_list = [dict(header, icon=self.thumbnail_pixmap) if header['key'] == 'thumbnail' else header
+                       for header in HEADER_LIST]
+        self.model.set_header_list(header_list)
         self.sort_model.setSourceModel(self.model)
         self.table_view.setModel(self.sort_model)
-        self.sort_model.set_header_list(HEADER_LIST)
+        self.sort_model.set_header_list(header_list)
+        self.table_view.set_row_height(THUMBNAIL_HEIGHT + 4)
         self.table_view.enable_context_menu(enable=True)
+        self.table_view.enable_row_move()
 
     def connect_command(self):
         self.table_view.fileDropped.connect(partial(self.drop_to_table_function))
@@ -144,7 +177,16 @@ class AddTextToImageUI(CommonToolWidget):
         self.table_view.sig_context_menu.connect(self.slot_context_menu)
         self.history_bt.clicked.connect(self.history_bt_clicked)
         self.gamma_box.valueChanged.connect(self.gamma_box_value_changed)
+        self.gamma_timer.timeout.connect(self.apply_display_gamma)
+        self.preview_timer.timeout.connect(self.update_preview)
+        self.table_view.selectionModel().currentRowChanged.connect(lambda *args: self.preview_timer.start())
+        self.gravity_rb.sig_checked_changed.connect(lambda *args: self.preview_timer.start())
+        for w in (self.text_size_box, self.text_transparency_box, self.gamma_box):
+            w.valueChanged.connect(lambda *args: self.preview_timer.start())
         self.save_history_ck.stateChanged.connect(self.save_history_ck_state_changed)
+        self.table_view.visibleRowsChanged.connect(self.visible_rows_changed)
+        self.table_view.rowsMoved.connect(self.table_rows_moved)
+        self.thumbnail_loader.thumbnail_ready.connect(self.update_thumbnail)
     
     def run_bt_clicked(self):
         logger.debug(f'开始任务按钮点击')
@@ -188,22 +230,31 @@ class AddTextToImageUI(CommonToolWidget):
                       'order': data['order'],
                       'thumbnail': data['thumbnail'],
                       'file_name': data['file_name'],
-                      'image': data['image']
+                      'image': data['image'],
+                      'frame': data.get('frame', '')
                       } 
                       for data in data_list]
-        logger.debug(f'数据列表: {data_list}')
+        logger.debug('数据列表: %s', data_list)
 
-        # 保存历史记录
+        # 保存历史记录, 在后台线程中补全没有生成的缩略图后和数据一起保存
         if self.save_history_ck.isChecked():
-            history_folder = self.get_history_folder()
             if self.history_line.text():
-                file_name = self.history_line.text()
+                name = self.history_line.text()
             else:
-                file_name = f'{time.strftime("%Y-%m-%d_%H-%M-%S")}'
-            history_file = os.path.join(history_folder, file_name)
-            with open(f'{history_file}.json', 'w') as f:
-                json.dump(data_list, f)
-            logger.debug(f'保存历史记录: {history_file}.json')
+                name = f'{time.strftime("%Y-%m-%d_%H-%M-%S")}'
+            settings = {'gravity': self.current_gravity,
+                        'text_size': self.text_size_box.value(),
+                        'text_transparency': self.text_transparency_box.value(),
+                        'gamma': self.gamma_box.value(),
+                        'ext': self.save_ext_cb.currentText(),
+                        'export_type': self.export_type_rb.get_dayu_checked()}
+            self.history_task = SaveHistoryTask(history_folder=self.history_store.folder,
+                                                name=name,
+                                                data_list=[dict(data) for data in data_list],
+                                                settings=settings,
+                                                parent=self)
+            self.history_task.log_sig.connect(self.info_board.add_line)
+            self.history_task.start()
 
         # 开始任务
         self.set_ui_status(freezed=True)
@@ -226,14 +277,14 @@ class AddTextToImageUI(CommonToolWidget):
         清空表格
         """
         self.model.clear()
+        self.thumbnail_loader.clear()
         self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
     
     def drop_to_table_function(self, path_list):
         """
         获取拖拽到表格的路径列表，进行处理
         """
-        logger.debug(f'拖拽到表格的路径列表: {path_list}')
+        logger.debug('拖拽到表格的路径列表: %s', path_list)
         if not check_depend_tool_exist():
             dy.MToast(text='请设置依赖软件路径',
                       duration=3.0,
@@ -246,36 +297,60 @@ class AddTextToImageUI(CommonToolWidget):
                              is_include=self.is_include_ck.isChecked(),
                              only_get_first=self.only_get_first_ck.isChecked(),
                              sort_by_file_name=self.sort_by_file_name_ck.isChecked(),
-                             gamma=self.gamma_box.value(),
                              parent=self)
-        task.data_sig.connect(self.add_data_to_table)
+        task.rows_sig.connect(self.add_rows_to_table)
         task.finished.connect(self.set_ui_status)
+        task.finished.connect(self.table_view.resizeColumnsToContents)
         task.start()
     
-    def add_data_to_table(self, data):
+    def add_rows_to_table(self, data_list):
         """
-        将数据添加到表格中
+        将一批数据添加到表格中, 缩略图在行可见时生成
         """
         # 检查文件是否存在
-        exists_path_list = [x['file_path'] for x in self.model.get_data_list()]
-        if data['file_path'] in exists_path_list:
+        new_data_list = []
+        new_path_set = set()
+        for data in data_list:
+            if data['file_path'] in self.model.row_dict or data['file_path'] in new_path_set:
+                continue
+            new_data_list.append(data)
+            new_path_set.add(data['file_path'])
+        if len(new_data_list) < len(data_list):
             dy.MToast(text='文件已存在',
                       duration=3.0,
                       dayu_type='error',
                       parent=self).show()
+        if not new_data_list:
             return
 
-        # 如果勾选按文件名排序，则进行排序
-        if self.sort_by_file_name_ck.isChecked():
-            self.model.append(data)
-            self.sort_by_file_name()
-        else:
-            data.update({'order': self.model.rowCount() + 1})
-            self.model.append(data)
+        with metrics.timer('ui_layout'):
+            exists_data_list = self.model.get_data_list()
+            name_list = [data['file_name'] for data in exists_data_list[-1:] + new_data_list]
+            is_first = not exists_data_list
+            for order, data in enumerate(new_data_list, start=len(exists_data_list) + 1):
+                data['order'] = order
+            self.model.append_rows(new_data_list)
 
-        # 调整表格大小
-        self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
+            # 如果勾选按文件名排序，加入后顺序不对时才重新排序, 任务中已经按文件名排序, 分批添加时不需要每次排序
+            if self.sort_by_file_name_ck.isChecked() and any(a > b for a, b in zip(name_list, name_list[1:])):
+                self.sort_by_file_name()
+
+            # 调整表格大小
+            if is_first:
+                self.table_view.resizeColumnsToContents()
+
+    def thumbnail_pixmap(self, name, data):
+        return g_pixmap(name, data, gamma=self.display_gamma)
+
+    def update_thumbnail(self, file_path, image_path):
+        self.model.update_row(file_path, {'image': image_path})
+
+    def visible_rows_changed(self, first, last):
+        """
+        只为可见的行生成缩略图
+        """
+        data_list = self.table_view.data_in_rows(first, last)
+        self.thumbnail_loader.request([data['file_path'] for data in data_list if not data.get('image')])
 
     def slot_context_menu(self, data):
         """
@@ -309,59 +384,49 @@ class AddTextToImageUI(CommonToolWidget):
                 data['text'] = dialog.current_text
                 data['color'] = dialog.current_color
                 self.table_view.resizeColumnsToContents()
-                self.table_view.resizeRowsToContents()
+            self.preview_timer.start()
 
     def remove_item(self, selections):
         """
-        从表格中删除选中项
+        从表格中删除选中项, 删除后剩下的行顺序不变, 不需要重新排序
         """
-        for sel in selections:
-            self.model.remove(sel)
-
-        if self.sort_by_file_name_ck.isChecked():
-            self.sort_by_file_name()
+        self.model.remove_rows(selections)
+        self.update_order()
 
         self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
     
     def sort_by_selection(self, selections):
         """
-        按选择顺序排序
+        按选择顺序排序, 没有选择的行保持原来的顺序排在后面
         """
-        data_list = self.model.get_data_list()
-        self.model.clear()
-        start_sort_num = len(selections)
-
-        for data in data_list:
-            if data in selections:
-                data.update({'order': selections.index(data) + 1})
-            else:
-                start_sort_num += 1
-                data.update({'order': start_sort_num})
-
-        data_list = sorted(data_list, key=lambda x: x['order'])
-        for data in data_list:
-            self.model.append(data)
-
-        self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
+        selection_order = {data['file_path']: index for index, data in enumerate(selections)}
+        self.table_view.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.model.sort_rows(key=lambda x: selection_order.get(x['file_path'], len(selection_order)))
+        self.update_order()
     
     def sort_by_file_name(self):
         """
         按文件名排序
         """
-        data_list = self.model.get_data_list()
-        self.model.clear()
+        self.table_view.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.model.sort_rows(key=lambda x: x['file_name'])
+        self.update_order()
 
-        data_list = sorted(data_list, key=lambda x: x['file_name'])
-        sort_num = 1
-        for data in data_list:
-            data.update({'order': sort_num})
-            self.model.append(data)
-            sort_num +=1
+    def table_rows_moved(self, data_list, row):
+        """
+        在表格中拖拽调整顺序
+        """
+        self.table_view.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.model.move_rows(data_list, row)
+        self.update_order()
 
-        self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
+    def update_order(self):
+        """
+        按表格中的顺序更新拼图排序, 只刷新排序这一列
+        """
+        for order, data in enumerate(self.model.get_data_list(), start=1):
+            data['order'] = order
+        self.model.refresh_column('order')
     
     def set_ui_status(self, freezed=False):
         """
@@ -372,45 +437,62 @@ class AddTextToImageUI(CommonToolWidget):
                   self.open_after_export_ck, self.gamma_box):
             w.setEnabled(not freezed)
     
-    def import_data_from_file(self, file_path):
+    def close_tool(self):
         """
-        从历史记录中导入数据
+        关闭窗口时等待历史记录保存完成
         """
-        if not os.path.exists(file_path):
-            dy.MToast(text='文件不存在',
-                      duration=3.0,
-                      dayu_type='error',
-                      parent=self).show()
-            return
+        if self.history_task and self.history_task.isRunning():
+            self.history_task.wait()
 
+    def import_history(self, session_id):
+        """
+        从历史记录中导入数据和任务设置, 缩略图从记录中恢复
+        按保存时的顺序一次添加到表格, 不重新排序
+        """
         self.clear_bt_clicked()
-        with open(file_path, 'r') as f:
-            data_list = json.load(f)
-        
-        data_list = sorted(data_list, key=lambda x: x['order'])
+        self.apply_history_settings(self.history_store.get_settings(session_id))
+        data_list = self.history_store.load_rows(session_id)
+
+        # 同一目录的文件只列出一次目录, 检查文件是否存在
+        stat_dict = stat_files_by_dir([data['file_path'] for data in data_list])
+        exists_data_list = []
         for data in data_list:
-            if not os.path.exists(data['file_path']):
+            if data['file_path'] not in stat_dict:
                 self.info_board.add_line(f'文件不存在: {data["file_path"]}')
                 continue
-            if not os.path.exists(data['image']):
-                self.info_board.add_line(f'缩略图丢失，提取缩略图: {data["file_path"]}')
-                tmp_dir = tempfile.mkdtemp()
-                thumb_path = os.path.join(tmp_dir, 'thumbnail.jpg')
-                extract_thumbnail_from_image(image_file=data['file_path'],
-                                             output_image_file=thumb_path,
-                                             gamma=self.gamma_box.value())
-                data['image'] = thumb_path
+            exists_data_list.append(data)
 
-            self.add_data_to_table(data)
+        for order, data in enumerate(exists_data_list, start=1):
+            data['order'] = order
+        self.table_view.horizontalHeader().setSortIndicator(-1, QtCore.Qt.AscendingOrder)
+        self.model.append_rows(exists_data_list)
+        self.table_view.resizeColumnsToContents()
+
+    def apply_history_settings(self, settings):
+        """
+        将历史记录中保存的任务设置应用到界面, 旧的json历史记录没有设置
+        """
+        gravity_list = list(GRAVITY_DICT.values())
+        if settings.get('gravity') in gravity_list:
+            self.gravity_rb.set_dayu_checked(gravity_list.index(settings['gravity']))
+        if 'text_size' in settings:
+            self.text_size_box.setValue(settings['text_size'])
+        if 'text_transparency' in settings:
+            self.text_transparency_box.setValue(settings['text_transparency'])
+        if 'gamma' in settings:
+            self.gamma_box.setValue(settings['gamma'])
+        if settings.get('ext') in IMAGE_SUPPORTED_EXT[:5]:
+            self.save_ext_cb.setCurrentText(settings['ext'])
+        if 'export_type' in settings:
+            self.export_type_rb.set_dayu_checked(settings['export_type'])
 
     def history_bt_clicked(self):
         """
         历史记录按钮点击
         """
-        history_folder = self.get_history_folder()
-        history_widget = HistoryWidget(history_folder=history_folder,
+        history_widget = HistoryWidget(history_store=self.history_store,
                                        parent=self)
-        history_widget.file_path_sig.connect(self.import_data_from_file)
+        history_widget.session_sig.connect(self.import_history)
 
         drawer = MDrawer('历史记录', parent=self).right()
         drawer.set_widget(history_widget)
@@ -426,6 +508,17 @@ class AddTextToImageUI(CommonToolWidget):
         if not os.path.exists(history_path):
             os.makedirs(history_path)
         return history_path
+
+    @property
+    def history_store(self):
+        """
+        历史记录数据库, 第一次使用时打开, 并导入旧的json历史记录
+        """
+        if self._history_store is None:
+            self._history_store = HistoryStore(folder=self.get_history_folder(),
+                                               thumbnail_folder=THUMBNAIL_CACHE_FOLDER)
+            self._history_store.migrate_legacy_files()
+        return self._history_store
     
     @property
     def current_gravity(self):
@@ -436,11 +529,71 @@ class AddTextToImageUI(CommonToolWidget):
         key = list(GRAVITY_DICT.keys())[_index]
         return GRAVITY_DICT[key]
 
+    def current_data(self):
+        """
+        获取当前行的数据, 没有当前行时返回None
+        """
+        index = self.table_view.currentIndex()
+        if not index.isValid():
+            return None
+        data_list = self.table_view.data_in_rows(index.row(), index.row())
+        return data_list[0] if data_list else None
+
+    def update_preview(self):
+        """
+        在进程内绘制当前行的文字预览, 布局和导出的图片相同
+        缩小的图片在后台读取后缓存, 修改文字设置时只重新绘制文字
+        """
+        data = self.current_data()
+        if not data:
+            return
+
+        if not self.preview_source or self.preview_source[0] != data['file_path']:
+            self.load_preview_source(data)
+            return
+
+        _, preview, scale = self.preview_source
+        with metrics.timer('ui_layout'):
+            image = render_annotate_preview(preview, scale,
+                                            text=data['text'],
+                                            color=data['color'],
+                                            gravity=self.current_gravity,
+                                            text_size=self.text_size_box.value(),
+                                            text_transparency=self.text_transparency_box.value(),
+                                            gamma=self.gamma_box.value())
+            pixmap = pil_to_pixmap(image).scaled(self.preview_label.size(), QtCore.Qt.KeepAspectRatio,
+                                                 QtCore.Qt.SmoothTransformation)
+        self.preview_label.setPixmap(pixmap)
+
+    def load_preview_source(self, data):
+        if self.preview_task and self.preview_task.isRunning():
+            # 读取完成后会按当前行重新预览
+            return
+        self.preview_label.setText('正在读取图片..')
+        self.preview_task = PreviewSourceTask(data=data, parent=self)
+        self.preview_task.result_sig.connect(self.preview_source_loaded)
+        self.preview_task.start()
+
+    def preview_source_loaded(self, file_path, result):
+        if result is None:
+            self.preview_label.setText('无法预览')
+            return
+        self.preview_source = (file_path, result[0], result[1])
+        self.preview_timer.start()
+
     def gamma_box_value_changed(self, value):
         """
         每次改变记录伽马值
         """
         user_setting.set('add_text_to_image_gamma', value)
+        self.gamma_timer.start()
+
+    def apply_display_gamma(self):
+        """
+        缩略图按新的gamma重绘, 只调整显示, 不重新生成缩略图
+        """
+        self.display_gamma = self.gamma_box.value()
+        self.model.refresh_column('thumbnail')
 
     def save_history_ck_state_changed(self, state):
         if state == QtCore.Qt.Checked:
@@ -524,14 +677,13 @@ class EditTextDialog(CommonDialog):
 
 class HistoryWidget(CommonWidget):
 
-    file_path_sig = QtCore.Signal(str)
+    session_sig = QtCore.Signal(int)
 
-    def __init__(self, history_folder, parent=None):
+    def __init__(self, history_store, parent=None):
         super().__init__(parent=parent)
 
         # data
-        self.history_folder = history_folder
-        self.history_files = {}
+        self.history_store = history_store
 
         # widgets
         self.list_widget = QtWidgets.QListWidget(parent=self)
@@ -543,135 +695,139 @@ class HistoryWidget(CommonWidget):
         self.connect_command()
     
     def init_ui(self):
-        self.add_widgets_v_line(dy.MLabel('双击选择一项记录导入').h4().secondary(),
+        self.add_widgets_v_line(dy.MLabel('双击选择一项记录导入, 右键删除').h4().secondary(),
                                 self.open_folder_bt, self.list_widget)
         self.setLayout(self.main_layout)
+        self.list_widget.setContextMenuPolicy(QtCore.Qt.CustomContextMenu)
     
     def connect_command(self):
         self.list_widget.itemDoubleClicked.connect(self.list_widget_item_double_clicked)
+        self.list_widget.customContextMenuRequested.connect(self.list_widget_context_menu)
         self.open_folder_bt.clicked.connect(self.open_folder_bt_clicked)
     
     def list_widget_item_double_clicked(self, item):
-        self.file_path_sig.emit(self.history_files[item.text()])
+        self.session_sig.emit(item.data(QtCore.Qt.UserRole))
+
+    def list_widget_context_menu(self, pos):
+        item = self.list_widget.itemAt(pos)
+        if item is None:
+            return
+        menu = dy.MMenu(parent=self.list_widget)
+        menu.addAction('删除记录', partial(self.delete_item, item))
+        menu.exec_(QtGui.QCursor.pos())
+
+    def delete_item(self, item):
+        """
+        从数据库中删除记录
+        """
+        self.history_store.delete(item.data(QtCore.Qt.UserRole))
+        self.list_widget.takeItem(self.list_widget.row(item))
 
     def set_data(self):
-        # 过滤出所有json文件
-        history_files_list = [os.path.join(self.history_folder, file) for file in os.listdir(self.history_folder) if file.endswith('.json')]
-        # 按修改时间排序
-        history_files_list = sorted(history_files_list, key=lambda x: os.path.getmtime(x), reverse=True)
-        # 添加到列表中
-        for history_file in history_files_list:
-            name = os.path.splitext(os.path.basename(history_file))[0]
-            self.list_widget.addItem(name)
-            self.history_files[name] = history_file
+        # 记录已经按时间倒序排列, 只读取记录表
+        for session in self.history_store.list_sessions():
+            item = QtWidgets.QListWidgetItem(session['name'])
+            item.setData(QtCore.Qt.UserRole, session['id'])
+            item.setToolTip(f'{time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(session["created"]))}  '
+                            f'{session["row_count"]}个文件')
+            self.list_widget.addItem(item)
     
     def open_folder_bt_clicked(self):
-        open_folder(self.history_folder)
+        open_folder(self.history_store.folder)
+
+
+class SaveHistoryTask(QtCore.QThread):
+    """
+    保存历史记录任务类, 先为没有缩略图的行生成缩略图, 再和行数据一起写入数据库
+    sqlite连接不能在线程间共用, 任务中使用单独的连接
+    """
+
+    log_sig = QtCore.Signal(str)
+
+    def __init__(self, history_folder, name, data_list, settings, parent=None):
+        super().__init__(parent=parent)
+
+        self.history_folder = history_folder
+        self.name = name
+        self.data_list = data_list
+        self.settings = settings
+
+    def run(self):
+        try:
+            fill_thumbnails(self.data_list, max_workers=DEFAULT_MAX_WORKERS)
+            history_store = HistoryStore(folder=self.history_folder, thumbnail_folder=THUMBNAIL_CACHE_FOLDER)
+            try:
+                history_store.save(name=self.name, data_list=self.data_list, settings=self.settings)
+            finally:
+                history_store.close()
+        except Exception as e:
+            logger.error(f'保存历史记录失败: {e}')
+            logger.error(traceback.format_exc())
+            self.log_sig.emit(f'[error]保存历史记录失败，请查看日志。')
+            return
+        self.log_sig.emit(f'已保存历史记录: {self.name}')
 
 
 class DropImageTask(QtCore.QThread):
     """
     拖拽图片到表格中，获取图片信息任务类
+    只收集文件并分批发送, 不生成缩略图, 缩略图由界面中的 ThumbnailLoader 按需生成
     """
 
-    data_sig = QtCore.Signal(dict)
+    rows_sig = QtCore.Signal(list)
 
-    def __init__(self, path_list, is_include, only_get_first, sort_by_file_name=False, gamma=1.0, parent=None):
+    def __init__(self, path_list, is_include, only_get_first, sort_by_file_name=False, parent=None):
         super().__init__(parent=parent)
 
         self.path_list = path_list
         self.is_include = is_include
         self.only_get_first = only_get_first
         self.sort_by_file_name = sort_by_file_name
-        self.gamma = gamma
 
+    @profile_task
     def run(self):
+        session = MetricsSession('导入图片')
         try:
             # 获取所有文件
-            files_list = self.get_all_file_path(self.path_list)
+            files_list = collect_annotate_files(self.path_list, self.is_include, self.only_get_first)
 
             # 如果勾选按文件名排序，则进行排序
             if self.sort_by_file_name:
                 files_list = sorted(files_list, key=lambda x: os.path.basename(x))
 
-            # 获取文件信息
-            for file_path in files_list:
-                logger.debug(f'获取文件信息: {file_path}')
-                self.get_data_from_file(file_path)
+            # 获取文件信息, 分批添加到表格
+            for batch in iter_batches(files_list):
+                data_list = [get_annotate_data(file_path, color=DEFAULT_COLOR, with_thumbnail=False)
+                             for file_path in batch]
+                data_list = [data for data in data_list if data]
+                self.rows_sig.emit(data_list)
+                metrics.add('rows_emitted', len(data_list))
         except Exception as e:
             logger.error(f'获取文件信息失败: {e}')
             logger.error(traceback.format_exc())
+        session.finish()
 
-    def get_all_file_path(self, path_list):
-        """
-        从所有拖拽路径中，获取所有支持格式的文件路径
-        """
-        files_list = []
-
-        for path in path_list:
-            if os.path.isfile(path):
-                if os.path.splitext(path)[1] in IMAGE_SUPPORTED_EXT:
-                    files_list.append(path)
-                elif os.path.splitext(path)[1] in VIDEO_SUPPORTED_EXT:
-                    files_list.append(path)
-                else:
-                    logger.error(f'不支持的文件类型: {path}')
-                    continue
-            elif os.path.isdir(path):
-                # 扫描图片
-                root_folder = DayuPath(path)
-                for seq_file in root_folder.scan(recursive=self.is_include, ext_filters=tuple(IMAGE_SUPPORTED_EXT)):
-                    if self.only_get_first:
-                        file_path = seq_file.restore_pattern(seq_file.frames[0])
-                        files_list.append(file_path)
-                    else:
-                        for file_path in seq_file.restore_pattern(seq_file.frames):
-                            files_list.append(file_path)
-                # 扫描视频
-                for root, dirs, files in os.walk(path):
-                    for f in files:
-                        file_path = os.path.join(root, f)
-                        if os.path.splitext(file_path)[1] in VIDEO_SUPPORTED_EXT:
-                            files_list.append(file_path)
-            else:
-                continue
 
-        return files_list
+class PreviewSourceTask(QtCore.QThread):
+    """
+    读取预览使用的缩小图片任务类
+    """
 
+    result_sig = QtCore.Signal(object, object)
 
-    def get_data_from_file(self, file_path):
-        """
-        从文件中获取数据
-        """
-        print('file_path', file_path)
-        ext = os.path.splitext(file_path)[1]
-        if ext not in IMAGE_SUPPORTED_EXT and ext not in VIDEO_SUPPORTED_EXT:
-            logger.error(f'不支持的文件类型: {file_path}')
-            return
+    def __init__(self, data, parent=None):
+        super().__init__(parent=parent)
 
-        tmp_dir = tempfile.mkdtemp()
-        thumb_path = os.path.join(tmp_dir, 'thumbnail.jpg')
-
-        if ext in IMAGE_SUPPORTED_EXT:
-            extract_thumbnail_from_image(image_file=file_path,
-                                         output_image_file=thumb_path,
-                                         gamma=self.gamma)
-        elif ext in VIDEO_SUPPORTED_EXT:
-            extract_thumbnail_from_mov(mov_file=file_path,
-                                       output_image_file=thumb_path
-                                       )
-        else:
-            return
-        
-        data = {
-            'thumbnail': '',
-            'file_name': os.path.basename(file_path),
-            'file_path': file_path,
-            'image': thumb_path,
-            'text': '',
-            'color': DEFAULT_COLOR
-        }
-        self.data_sig.emit(data)
+        self.data = data
+
+    def run(self):
+        try:
+            result = load_annotate_preview(self.data)
+        except Exception as e:
+            logger.error(f'读取预览图片失败: {e}')
+            logger.error(traceback.format_exc())
+            result = None
+        self.result_sig.emit(self.data['file_path'], result)
 
 
 class AddTextTask(QtCore.QThread):
@@ -694,47 +850,30 @@ class AddTextTask(QtCore.QThread):
         self.text_transparency = text_transparency
         self.gamma = gamma
 
+    @profile_task
     def run(self):
+        session = MetricsSession('添加文字')
         try:
             if self.export_type_num == 0:
                 # 导出方式：分别输出单张
-                self.export_each_image(output_folder=self.output_path)
+                annotate_each_image(data_list=self.data_list,
+                                    output_folder=self.output_path,
+                                    ext=self.ext,
+                                    gravity=self.gravity,
+                                    text_size=self.text_size,
+                                    text_transparency=self.text_transparency,
+                                    gamma=self.gamma,
+                                    max_workers=DEFAULT_MAX_WORKERS,
+                                    log_callback=self.log_sig.emit)
             elif self.export_type_num == 1:
                 # 导出方式：输出整张。（为每张添加文字，然后拼成整张图）
-                now_time = time.time()
-                data_list = []
-
-                for data in self.data_list:
-                    color = QtGui.QColor(data['color'])
-                    rgb = f'rgba({color.red()}, {color.green()}, {color.blue()}, {self.text_transparency/100.0})'
-                    ext = os.path.splitext(data['file_path'])[1]
-                    if ext in IMAGE_SUPPORTED_EXT:
-                        image_file = data['file_path']
-                    elif ext in VIDEO_SUPPORTED_EXT:
-                        image_file = data['image']
-                    else:
-                        continue
-                    data_list.append({
-                        'text': data['text'],
-                        'color': rgb,
-                        'file_path': image_file
-                    })
-
-                # 计算水平和垂直数量，用于拼图
-                vertical_count, horizontal_count = self.calc_vh_value(total_count=len(data_list))
                 self.log_sig.emit(f'正在添加文字及拼图，请稍后...')
-
-                # 执行主要函数
-                run_add_text_to_collage_image(
-                    output_image_file=self.output_path,
-                    data_list=data_list,
-                    horizontal_count=horizontal_count,
-                    vertical_count=vertical_count,
-                    gravity=self.gravity,
-                    size=self.text_size*10,
-                    gamma=self.gamma
-                )
-                self.log_sig.emit(f'添加文字及拼图完成，耗时: {time.time() - now_time:.2f}秒')
+                annotate_collage_image(data_list=self.data_list,
+                                       output_path=self.output_path,
+                                       gravity=self.gravity,
+                                       text_size=self.text_size,
+                                       text_transparency=self.text_transparency,
+                                       gamma=self.gamma)
             else:
                 return
 
@@ -745,6 +884,8 @@ class AddTextTask(QtCore.QThread):
             logger.error(traceback.format_exc())
             self.log_sig.emit(f'[error]导出失败，请查看日志。')
 
+        self.log_sig.emit(session.finish(files=len(self.data_list)))
+
         if self.open_after_export:
             if os.path.isfile(self.output_path):
                 open_file(self.output_path)
@@ -752,46 +893,3 @@ class AddTextTask(QtCore.QThread):
                 open_folder(self.output_path)
             else:
                 return
-    
-    def export_each_image(self, output_folder):
-        """
-        分别输出单张图片
-        """
-        output_files = []
-        current = 0
-        total = len(self.data_list)
-
-        for data in self.data_list:
-            file_name = os.path.splitext(data['file_name'])[0]
-            output_image_file = os.path.join(output_folder, f'{file_name}{self.ext}')
-            output_files.append(output_image_file)
-            color = QtGui.QColor(data['color'])
-            rgb = f'rgba({color.red()}, {color.green()}, {color.blue()}, {self.text_transparency/100.0})'
-            ext = os.path.splitext(data['file_path'])[1]
-            if ext in IMAGE_SUPPORTED_EXT:
-                image_file = data['file_path']
-            elif ext in VIDEO_SUPPORTED_EXT:
-                image_file = data['image']
-            else:
-                continue
-            run_add_text_to_image(image_file=image_file,
-                                  output_image_file=output_image_file,
-                                  text=data['text'],
-                                  color=rgb,
-                                  size=self.text_size*10,
-                                  gravity=self.gravity,
-                                  gamma=self.gamma
-                                  )
-
-            current += 1
-            self.log_sig.emit(f'({current}/{total}) 导出文件: {output_image_file}')
-        return output_files
-    
-    @staticmethod
-    def calc_vh_value(total_count):
-        horizontal_count = int(total_count ** 0.5)
-        if horizontal_count * horizontal_count < total_count:
-            horizontal_count += 1
-        vertical_count = horizontal_count
-
-        return horizontal_count, vertical_count
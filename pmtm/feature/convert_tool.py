@@ -1,19 +1,18 @@
 import os
 import traceback
-import tempfile
 from functools import partial
 
 import dayu_widgets as dy
-from dayu_path import DayuPath
 from PySide2 import QtWidgets, QtCore, QtGui
 
-from pmtm.helper import g_pixmap, check_depend_tool_exist
-from pmtm.core import logger, user_setting
-from pmtm.common_widgets import CommonToolWidget, DropTabelView, MenuPushButton, question_box, message_box
-from pmtm.media_utils import (get_image_resolution, get_video_resolution, get_video_frame_count,
-                              extract_thumbnail_from_image, extract_thumbnail_from_mov,
-                              convert_seq_to_video, convert_video_to_seq, convert_seq_to_seq,
-                              convert_video_to_video)
+from pmtm.helper import check_depend_tool_exist, THUMBNAIL_HEIGHT
+from pmtm.qt_utils import g_pixmap
+from pmtm.core import logger, user_setting, metrics, MetricsSession, profile_task
+from pmtm.common_widgets import (CommonToolWidget, DropTabelView, MenuPushButton, ProgressiveTableModel,
+                                 ThumbnailLoader, question_box, message_box)
+from pmtm.engine import (SUPPORT_FRAME_LIST, SUPPORT_VIDEO_LIST, DEFAULT_MAX_WORKERS, PriorityJobQueue,
+                         map_prioritized, iter_batches, scan_sequences, get_sequence_skeleton, get_sequence_data,
+                         make_file_thumbnail, get_convert_method, convert_file)
 
 
 HEADER_LIST = [
@@ -26,9 +25,6 @@ HEADER_LIST = [
             {'label': '文件路径', 'key': 'file_path'}
         ]
 
-SUPPORT_FRAME_LIST = ['png', 'jpg', 'jpeg', 'tif', 'tiff', 'exr', 'dpx', 'tga']
-SUPPORT_VIDEO_LIST = ['mov', 'mp4']
-
 
 class ConvertToolUI(CommonToolWidget):
 
@@ -36,7 +32,9 @@ class ConvertToolUI(CommonToolWidget):
         super().__init__(**kwargs)
 
         # data
-        self.model = dy.MTableModel()
+        self.model = ProgressiveTableModel(key='file_path')
+        self.thumbnail_loader = ThumbnailLoader(make_file_thumbnail, parent=self)
+        self.task = None
 
         # widgets
         self.scan_path_line = dy.MLineEdit().folder().small()
@@ -90,12 +88,15 @@ class ConvertToolUI(CommonToolWidget):
 
         self.model.set_header_list(HEADER_LIST)
         self.table_view.setModel(self.model)
+        self.table_view.set_row_height(THUMBNAIL_HEIGHT + 4)
         self.table_view.enable_context_menu(enable=True)
 
     def connect_command(self):
         self.scan_bt.clicked.connect(self.scan_bt_clicked)
         self.run_convert_bt.clicked.connect(self.run_convert_bt_clicked)
         self.table_view.sig_context_menu.connect(self.slot_context_menu)
+        self.table_view.visibleRowsChanged.connect(self.visible_rows_changed)
+        self.thumbnail_loader.thumbnail_ready.connect(self.update_thumbnail)
     
     def scan_bt_clicked(self):
         logger.debug(f'扫描按钮点击')
@@ -106,6 +107,7 @@ class ConvertToolUI(CommonToolWidget):
 
         # 清空数据
         self.model.clear()
+        self.thumbnail_loader.clear()
         self.progress_bar.setValue(0)
 
         # 收集扫描参数
@@ -128,9 +130,12 @@ class ConvertToolUI(CommonToolWidget):
                                   ext_tuple=ext_tuple,
                                   function_filter=function_filter,
                                   parent=self)
-        self.task.data_sig.connect(self.add_data_to_table)
+        self.task.rows_sig.connect(self.add_rows_to_table)
+        self.task.data_sig.connect(self.update_table_data)
+        self.task.failed_sig.connect(self.model.remove_key)
         self.task.is_success_sig.connect(partial(self.task_finished, igrone_success=True))
         self.task.finished.connect(self.set_ui_status)
+        self.task.finished.connect(self.table_view.resizeColumnsToContents)
         self.task.start()
 
     def run_convert_bt_clicked(self):
@@ -146,15 +151,8 @@ class ConvertToolUI(CommonToolWidget):
             return
 
         # 收集转换参数
-        if self.input_ext in SUPPORT_FRAME_LIST and self.output_ext in SUPPORT_VIDEO_LIST:
-            convert_method = 'img_to_video'
-        elif self.input_ext in SUPPORT_VIDEO_LIST and self.output_ext in SUPPORT_FRAME_LIST:
-            convert_method = 'video_to_img'
-        elif self.input_ext in SUPPORT_FRAME_LIST and self.output_ext in SUPPORT_FRAME_LIST:
-            convert_method = 'img_to_img'
-        elif self.input_ext in SUPPORT_VIDEO_LIST and self.output_ext in SUPPORT_VIDEO_LIST:
-            convert_method = 'video_to_video'
-        else:
+        convert_method = get_convert_method(self.input_ext, self.output_ext)
+        if not convert_method:
             return
         
         output_settings = {
@@ -175,12 +173,30 @@ class ConvertToolUI(CommonToolWidget):
         task.finished.connect(self.set_ui_status)
         task.start()
 
-    def add_data_to_table(self, data):
-        logger.debug(f'添加数据: {data}')
-        self.model.append(data)
+    def add_rows_to_table(self, data_list):
+        logger.debug('添加%s行', len(data_list))
+        with metrics.timer('ui_layout'):
+            is_first = not self.model.get_data_list()
+            self.model.append_rows(data_list)
+            if is_first:
+                self.table_view.resizeColumnsToContents()
 
-        self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
+    def update_table_data(self, data):
+        logger.debug('更新数据: %s', data)
+        with metrics.timer('ui_layout'):
+            self.model.update_row(data['file_path'], data)
+
+    def update_thumbnail(self, seq_file, image_path):
+        self.model.update_row(seq_file, {'image': image_path})
+
+    def visible_rows_changed(self, first, last):
+        """
+        可见的行优先获取文件信息, 并且只为可见的行生成缩略图
+        """
+        data_list = self.table_view.data_in_rows(first, last)
+        if self.task and self.task.isRunning():
+            self.task.prioritize([data['file_path'] for data in data_list])
+        self.thumbnail_loader.request([data['file_path'] for data in data_list if not data.get('image')])
     
     def slot_context_menu(self, data):
         if not data.selection:
@@ -195,11 +211,12 @@ class ConvertToolUI(CommonToolWidget):
         menu.exec_(QtGui.QCursor.pos())
     
     def remove_item(self, selections):
-        for sel in selections:
-            self.model.remove(sel)
+        """
+        从表格中删除选中项, 连续的行一起删除
+        """
+        self.model.remove_rows(selections)
 
         self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
     
     def task_finished(self, is_success, igrone_success=False):
         text = '任务完成' if is_success else '任务失败，请检查日志！'
@@ -269,62 +286,57 @@ class ConvertToolUI(CommonToolWidget):
 class ScanTask(QtCore.QThread):
     """
     扫描任务类
+    rows_sig 在扫描时分批发送只有基础信息的行, data_sig 逐个发送补全后的数据, 可见的行优先
+    缩略图不在这里生成, 由界面中的 ThumbnailLoader 按需生成
     """
 
-    data_sig = QtCore.Signal(dict)
+    rows_sig = QtCore.Signal(list)
+    data_sig = QtCore.Signal(object)
+    failed_sig = QtCore.Signal(object)
     is_success_sig = QtCore.Signal(bool)
 
     def __init__(self, scan_folder, is_include, ext_tuple, function_filter, parent=None):
         super().__init__(parent=parent)
 
-        self.scan_folder = DayuPath(scan_folder)
+        self.scan_folder = scan_folder
         self.is_include = is_include
         self.ext_tuple = ext_tuple
         self.function_filter = function_filter
+        self.job_queue = PriorityJobQueue()
 
+    def prioritize(self, seq_files):
+        self.job_queue.prioritize(seq_files)
+
+    @profile_task
     def run(self):
+        session = MetricsSession('扫描序列')
         try:
             logger.debug(f'开始扫描任务')
-            
-            for seq_file in self.scan_folder.scan(recursive=self.is_include,
-                                                  ext_filters=self.ext_tuple,
-                                                  function_filter=self.function_filter):
-                
-                logger.debug(f'扫描到文件: {seq_file}')
-                ext = seq_file.ext[1:].lower()  # 去掉点号 .jpg -> jpg
-                temp_dir = tempfile.mkdtemp()
-                thumbnail_path = os.path.join(temp_dir, 'thumbnail.jpg')
-                file_name = seq_file.stem.stem
-
-                if ext in SUPPORT_FRAME_LIST:
-                    first_file = seq_file.restore_pattern(seq_file.frames[0])
-                    extract_thumbnail_from_image(first_file, thumbnail_path)
-                    image_w, image_h = get_image_resolution(first_file)
-                    reslolution = f'{image_w}x{image_h}'
-                    start_frame = seq_file.frames[0]
-                    end_frame = seq_file.frames[-1]
-                    frame_count = len(seq_file.frames)
-                elif ext in SUPPORT_VIDEO_LIST:
-                    extract_thumbnail_from_mov(seq_file, thumbnail_path)
-                    reslolution = get_video_resolution(seq_file)
-                    start_frame = 1
-                    end_frame = get_video_frame_count(seq_file)
-                    frame_count = end_frame
-                else:
-                    continue
-
-                data = {'thumbnail': '',
-                        'file_name': file_name,
-                        'start_frame': start_frame,
-                        'end_frame': end_frame,
-                        'frame_count': frame_count,
-                        'resolution': reslolution,
-                        'file_path': seq_file,
-                        'image': thumbnail_path,
-                        'dayu_path': seq_file}
 
+            seq_files = scan_sequences(scan_folder=self.scan_folder,
+                                       is_include=self.is_include,
+                                       ext_tuple=self.ext_tuple,
+                                       function_filter=self.function_filter)
+
+            # 第一步: 边扫描边分批添加基础信息的行
+            seq_list = []
+            skeletons = ((seq_file, get_sequence_skeleton(seq_file)) for seq_file in seq_files)
+            for batch in iter_batches((seq_file, data) for seq_file, data in skeletons if data):
+                seq_list.extend(seq_file for seq_file, _ in batch)
+                self.rows_sig.emit([data for _, data in batch])
+
+            # 第二步: 并发获取文件信息, 按完成的顺序更新表格
+            self.job_queue.add(seq_list)
+            func = partial(get_sequence_data, with_thumbnail=False)
+            for seq_file, data in map_prioritized(func, self.job_queue, max_workers=DEFAULT_MAX_WORKERS):
+                if data is None:
+                    self.failed_sig.emit(seq_file)
+                    continue
+                # 不覆盖表格中已经生成的缩略图
+                data.pop('image')
                 self.data_sig.emit(data)
-                logger.debug(f'添加数据: {data}')
+                metrics.add('rows_emitted')
+                logger.debug('更新数据: %s', data)
 
             self.is_success_sig.emit(True)
 
@@ -333,6 +345,8 @@ class ScanTask(QtCore.QThread):
             logger.error(f'{traceback.format_exc()}')
             self.is_success_sig.emit(False)
             return
+        finally:
+            session.finish()
 
 
 class ConvertTask(QtCore.QThread):
@@ -350,51 +364,24 @@ class ConvertTask(QtCore.QThread):
         self.output_settings = output_settings
         self.output_folder = output_folder
 
+    @profile_task
     def run(self):
+        session = MetricsSession('格式转换')
         try:
             # 获取进度条步长
             current_progress = 0
             each_progress = 100 / len(self.data_list)
 
-            # 获取转换方法和输出格式
-            convert_method = self.output_settings['convert_method']
-            output_ext = self.output_settings['output_ext']
-
             # 开始转换
             for data in self.data_list:
                 # 更新进度条
                 current_progress += each_progress
                 self.progress_sig.emit(current_progress)
 
-                # 获取输出文件路径
-                output_file = os.path.join(self.output_folder, f'{data["file_name"]}.{output_ext}')
-
-                # 根据不同的转换方法，执行不同的函数
-                if convert_method == 'img_to_video':
-                    convert_seq_to_video(seq_file=data['dayu_path'],
-                                        output_video_file=output_file,
-                                        start_frame=data['dayu_path'].frames[0],
-                                        fps=self.output_settings.get('fps', 25)
-                                        )
-                elif convert_method == 'video_to_img':
-                    seq_output_path = self.get_seq_output_path(data=data)                
-                    convert_video_to_seq(video_file=data['dayu_path'],
-                                        output_seq_file=seq_output_path,
-                                        start_frame=self.output_settings.get('start_frame', 1)
-                                        )
-                elif convert_method == 'img_to_img':
-                    seq_output_path = self.get_seq_output_path(data=data)
-                    convert_seq_to_seq(source_seq_file=data['dayu_path'],
-                                       output_seq_file=seq_output_path,
-                                       source_start_frame=data['dayu_path'].frames[0],
-                                       output_start_frame=self.output_settings.get('start_frame', 1)
-                                       )
-                elif convert_method == 'video_to_video':
-                    convert_video_to_video(source_video_file=data['dayu_path'],
-                                           output_video_file=output_file)
-                else:
-                    continue
-            
+                convert_file(data=data,
+                             output_settings=self.output_settings,
+                             output_folder=self.output_folder)
+
             self.is_success_sig.emit(True)
 
         except Exception as e:
@@ -402,25 +389,5 @@ class ConvertTask(QtCore.QThread):
             logger.error(f'{traceback.format_exc()}')
             self.is_success_sig.emit(False)
             return
-
-    def get_seq_output_path(self, data):
-        """
-        获取序列帧的输出路径格式
-        """
-        start_frame = self.output_settings['start_frame']
-        output_ext = self.output_settings['output_ext']
-        frame_count = data['frame_count']
-
-        num_len = len(str(start_frame+frame_count))
-        if num_len <= 4:
-            output_path = os.path.join(self.output_folder, data['file_name'], f'{data["file_name"]}.%04d.{output_ext}')
-        else:
-            num_len = str(num_len).zfill(2)
-            output_path = os.path.join(self.output_folder, data['file_name'], f'{data["file_name"]}.%{num_len}d.{output_ext}')
-        
-        dir_path = os.path.dirname(output_path)
-        if not os.path.isdir(dir_path):
-            os.makedirs(dir_path)
-            logger.debug(f'创建序列输出路径: {dir_path}')
-
-        return output_path
+        finally:
+            session.finish(files=len(self.data_list))
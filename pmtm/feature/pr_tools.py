@@ -1,14 +1,27 @@
 import os
+import time
 import traceback
+from collections import Counter
+
 import pymiere
 
 import dayu_widgets as dy
-from PySide2 import QtWidgets
+from PySide2 import QtWidgets, QtCore
 
-from pmtm.core import logger
+from pmtm.core import logger, MetricsSession, profile_task
 from pmtm.common_widgets import CommonToolWidget, InfoBoard
 
 
+# encodeSequence 的导出范围, 1 为入点到出点
+ENCODE_IN_TO_OUT = 1
+# 检查输出文件的间隔(毫秒)
+EXPORT_POLL_INTERVAL = 2000
+# 文件大小连续这么多次检查都不变, 并且可以打开写入时, 视为导出完成, Media Encoder 同时编码多个任务时会暂停写入
+EXPORT_STABLE_POLLS = 5
+# 超过这个时间(秒)没有新的文件完成时停止等待
+EXPORT_IDLE_TIMEOUT = 30 * 60
+
+
 class PRToolsUI(CommonToolWidget):
 
     def __init__(self, **kwargs):
@@ -22,16 +35,12 @@ class PRToolsUI(CommonToolWidget):
         self.presets_cb = QtWidgets.QComboBox()
         self.output_ext_cb = QtWidgets.QComboBox()
         self.info_broad = InfoBoard(parent=self)
-
-        try:
-            self.preset_dir = os.path.join(pymiere.objects.app.path, 'Settings', 'IngestPresets', 'Transcode')
-            self.info_broad.add_line(f'从 {self.preset_dir} 获取到导出预设')
-        except Exception as e:
-            self.info_broad.add_line('[error]无法获取预设文件列表，请先打开Premiere Pro软件，再打开这个工具。')
-            logger.error(e)
-            self.preset_dir = ''
+        self.preset_dir = ''
+        self.preset_task = None
+        self.export_task = None
 
         self.setup()
+        self.load_presets()
 
     def init_ui(self):
         self.add_widgets_h_line(dy.MLabel('起始镜号'), self.rename_start_input,
@@ -49,11 +58,25 @@ class PRToolsUI(CommonToolWidget):
         self.export_dir_input.setMinimumWidth(350)
         self.output_ext_cb.addItems(['mp4','mov'])
 
-        if not self.preset_dir or not os.path.exists(self.preset_dir):
-            self.presets_cb.clear()
+    def load_presets(self):
+        """
+        连接Premiere可能会阻塞, 在后台获取导出预设
+        """
+        self.presets_cb.setEnabled(False)
+        self.preset_task = LoadPresetsTask(parent=self)
+        self.preset_task.result_sig.connect(self.presets_loaded)
+        self.preset_task.start()
+
+    def presets_loaded(self, preset_dir, files):
+        self.preset_dir = preset_dir
+        if preset_dir:
+            self.info_broad.add_line(f'从 {preset_dir} 获取到导出预设')
         else:
-            files = [f for f in os.listdir(self.preset_dir) if f.endswith('.epr')]
-            self.presets_cb.addItems(files)
+            self.info_broad.add_line('[error]无法获取预设文件列表，请先打开Premiere Pro软件，再打开这个工具。')
+
+        self.presets_cb.clear()
+        self.presets_cb.addItems(files)
+        self.presets_cb.setEnabled(True)
 
     def connect_command(self):
         self.rename_bt.clicked.connect(self.run_rename)
@@ -96,33 +119,25 @@ class PRToolsUI(CommonToolWidget):
             self.info_broad.add_line(f'[error]预设文件不存在 {preset_file}')
             return
 
-        project = pymiere.objects.app.project
-        active_sequence = project.activeSequence
-
-        # 保存原始入点和出点
-        original_in = active_sequence.getInPoint()
-        original_out = active_sequence.getOutPoint()
-
-        ext = self.output_ext_cb.currentText()
-
-        for clip in selected_clip:
-            output_file = os.path.join(output_folder, f'{clip.name}.{ext}')
-            print(clip, clip.start, clip.end)
-
-            # 设置入点和出点
-            active_sequence.setInPoint(clip.start)
-            active_sequence.setOutPoint(clip.end)
-            result = active_sequence.exportAsMediaDirect(output_file, preset_file, 1)
-            if result == 'No Error':
-                self.info_broad.add_line(f'导出完成 {output_file}')
-            else:
-                self.info_broad.add_line(f'[error]导出失败 {result}')
-
-        self.info_broad.add_line(f'[pass]所有视频导出完成')
+        # 在后台加入 Media Encoder 队列并等待导出完成, 不阻塞界面
+        self.export_split_bt.setEnabled(False)
+        self.export_task = ExportClipsTask(clip_list=selected_clip,
+                                           output_folder=output_folder,
+                                           preset_file=preset_file,
+                                           ext=self.output_ext_cb.currentText(),
+                                           parent=self)
+        self.export_task.msg_sig.connect(self.info_broad.add_line)
+        self.export_task.finished.connect(lambda: self.export_split_bt.setEnabled(True))
+        self.export_task.start()
 
-        # 恢复原始入点和出点
-        active_sequence.setInPoint(original_in)
-        active_sequence.setOutPoint(original_out)
+    def close_tool(self):
+        """
+        关闭窗口时停止等待导出, 已经加入 Media Encoder 的任务会继续导出
+        """
+        for task in (self.preset_task, self.export_task):
+            if task and task.isRunning():
+                task.requestInterruption()
+                task.wait()
 
     def get_name_list(self, total_num):
         start_name = self.rename_start_input.text()
@@ -150,3 +165,145 @@ class PRToolsUI(CommonToolWidget):
             return []
 
         return selected
+
+
+class LoadPresetsTask(QtCore.QThread):
+    """
+    从Premiere安装目录获取导出预设任务
+    """
+
+    result_sig = QtCore.Signal(str, list)  # 预设目录, 预设文件列表
+
+    def run(self):
+        try:
+            preset_dir = os.path.join(pymiere.objects.app.path, 'Settings', 'IngestPresets', 'Transcode')
+        except Exception as e:
+            logger.error(e)
+            self.result_sig.emit('', [])
+            return
+
+        files = []
+        if os.path.exists(preset_dir):
+            files = [f for f in os.listdir(preset_dir) if f.endswith('.epr')]
+        self.result_sig.emit(preset_dir, files)
+
+
+class ExportClipsTask(QtCore.QThread):
+    """
+    批量导出片段任务
+    把所有片段加入 Media Encoder 的队列后一起开始编码, 然后在后台等待输出文件完成
+    """
+
+    msg_sig = QtCore.Signal(str)
+
+    def __init__(self, clip_list, output_folder, preset_file, ext, parent=None):
+        super(ExportClipsTask, self).__init__(parent=parent)
+        self.clip_list = clip_list
+        self.output_folder = output_folder
+        self.preset_file = preset_file
+        self.ext = ext
+
+    @profile_task
+    def run(self):
+        session = MetricsSession('批量导出片段')
+        try:
+            job_dict = self.queue_clips()
+            if job_dict:
+                self.wait_for_outputs(job_dict)
+        except Exception as e:
+            self.msg_sig.emit(f'[error]导出失败: {e}')
+            logger.error(traceback.format_exc())
+        self.msg_sig.emit(session.finish(files=len(self.clip_list)))
+
+    def queue_clips(self):
+        """
+        逐个设置入点和出点并加入编码队列, 全部加入后恢复一次原始的入点和出点, 再开始编码
+        返回 {输出文件: 加入队列前的文件状态}, 用于区分旧文件和新导出的文件
+        """
+        app = pymiere.objects.app
+        active_sequence = app.project.activeSequence
+        encoder = app.encoder
+        encoder.launchEncoder()
+
+        original_in = active_sequence.getInPoint()
+        original_out = active_sequence.getOutPoint()
+        job_dict = {}
+        # 同名的片段加上序号, 避免输出到同一个文件
+        name_count = Counter(clip.name for clip in self.clip_list)
+        try:
+            for index, clip in enumerate(self.clip_list, start=1):
+                if self.isInterruptionRequested():
+                    break
+                name = f'{clip.name}_{index}' if name_count[clip.name] > 1 else clip.name
+                output_file = os.path.join(self.output_folder, f'{name}.{self.ext}')
+                active_sequence.setInPoint(clip.start)
+                active_sequence.setOutPoint(clip.end)
+                old_stat = self.get_file_stat(output_file)
+                job_id = encoder.encodeSequence(active_sequence, output_file, self.preset_file,
+                                                ENCODE_IN_TO_OUT, True, False)
+                if not job_id or str(job_id) == '0':
+                    self.msg_sig.emit(f'[error]加入导出队列失败 {output_file}')
+                    continue
+                job_dict[output_file] = old_stat
+                self.msg_sig.emit(f'({index}/{len(self.clip_list)}) 加入导出队列 {output_file}')
+        finally:
+            active_sequence.setInPoint(original_in)
+            active_sequence.setOutPoint(original_out)
+
+        if job_dict:
+            encoder.startBatch()
+            self.msg_sig.emit(f'开始导出，共{len(job_dict)}个片段')
+        return job_dict
+
+    def wait_for_outputs(self, job_dict):
+        """
+        定时检查输出文件, 文件是新生成的, 大小连续多次检查不再变化, 并且没有被占用时视为导出完成
+        """
+        pending = dict(job_dict)
+        size_dict = {}  # {输出文件: (文件大小, 连续不变的次数)}
+        last_done_time = time.time()
+        while pending and not self.isInterruptionRequested():
+            self.msleep(EXPORT_POLL_INTERVAL)
+            for output_file, old_stat in list(pending.items()):
+                stat = self.get_file_stat(output_file)
+                if not stat or stat == old_stat or not stat[1]:
+                    continue
+                size, stable_count = size_dict.get(output_file, (None, 0))
+                stable_count = stable_count + 1 if size == stat[1] else 0
+                size_dict[output_file] = (stat[1], stable_count)
+                if stable_count < EXPORT_STABLE_POLLS or not self.is_file_released(output_file):
+                    continue
+                del pending[output_file]
+                last_done_time = time.time()
+                self.msg_sig.emit(f'({len(job_dict) - len(pending)}/{len(job_dict)}) 导出完成 {output_file}')
+
+            if time.time() - last_done_time > EXPORT_IDLE_TIMEOUT:
+                break
+
+        for output_file in pending:
+            self.msg_sig.emit(f'[warning]没有等到导出完成 {output_file}，请在 Media Encoder 中查看')
+        if not pending:
+            self.msg_sig.emit('[pass]所有视频导出完成')
+
+    @staticmethod
+    def is_file_released(file_path):
+        """
+        文件没有被其他程序占用时返回True, Windows中 Media Encoder 写入时无法打开
+        """
+        try:
+            with open(file_path, 'ab'):
+                pass
+        except OSError:
+            return False
+        return True
+
+    @staticmethod
+    def get_file_stat(file_path):
+        """
+        返回 (修改时间, 文件大小), 文件不存在返回None
+        """
+        try:
+            stat = os.stat(file_path)
+        except OSError:
+            return None
+        return stat.st_mtime, stat.st_size
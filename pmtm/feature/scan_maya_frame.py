@@ -1,14 +1,16 @@
-import re
-import csv
 import os
-import traceback
+from functools import partial
 
 import dayu_widgets as dy
 from PySide2 import QtWidgets, QtGui, QtCore
 
-from pmtm.common_widgets import CommonToolWidget, PhotoLabel
+from pmtm.common_widgets import CommonToolWidget, PhotoLabel, ProgressDialog
 from pmtm.helper import scan_files, get_resource_file, open_file
-from pmtm.core import logger
+from pmtm.core import logger, metrics, MetricsSession, profile_task
+from pmtm.qt_utils import ExportReportTask
+from pmtm.export_utils import get_export_filter
+from pmtm.maya_utils import MAYA_EXT_LIST
+from pmtm.engine import DEFAULT_MAX_WORKERS, scan_maya_frames
 
 
 HEADER_LIST = [
@@ -90,39 +92,34 @@ class MayaFrameScanUI(CommonToolWidget):
         if data.get('start_frame') == '':
             self.error_count += 1
 
-        self.model.append(data)
-        self.table_view.header_view._slot_set_resize_mode(True)
+        with metrics.timer('ui_layout'):
+            self.model.append(data)
+            self.table_view.header_view._slot_set_resize_mode(True)
 
     def export_bt_clicked(self):
         # 获取导出路径
-        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export csv', '', 'CSV Files(*.csv)')
+        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export report', '',
+                                                                    get_export_filter(['.csv', '.xlsx', '.jsonl', '.parquet']))
         if not export_file_path:
             return
 
-        # 生成csv数据
-        csv_list = [['文件名', '动画开始帧(ast)', '动画结束帧(aet)',
-                     '播放起始帧(min)', '播放结束帧(max)', '路径']]
-        for data in self.model.get_data_list():
-            csv_list.append([data['file_name'], data['start_frame'], data['end_frame'],
-                             data['min_frame'], data['max_frame'], data['file_path']])
-        
-        # 导出csv
-        with open(export_file_path, 'w') as f:
-            csv_write = csv.writer(f)
-            for row in csv_list:
-                csv_write.writerow(row)
-        logger.info(f'导出完成，文件路径: {export_file_path}')
+        # 开始导出任务
+        dialog = ProgressDialog(title='导出表格', parent=self)
+        task = ExportReportTask(output_path=export_file_path,
+                                header_list=HEADER_LIST,
+                                data_list=list(self.model.get_data_list()),
+                                parent=self)
+        task.progress_sig.connect(dialog.show_progress)
+        task.is_success_sig.connect(dialog.show_success)
+        task.is_success_sig.connect(partial(self.export_finished, export_file_path))
+        task.start()
+        dialog.exec_()
 
+    def export_finished(self, export_file_path, is_success):
         # 任务完成后打开表格
-        if self.after_task_open_ck.isChecked():
+        if is_success and self.after_task_open_ck.isChecked():
             open_file(export_file_path)
 
-        # 提示导出完成
-        dy.MToast(text='导出完成',
-                  dayu_type='success',
-                  duration=3.0,
-                  parent=self).show()
-
     def tips_bt_clicked(self):
         tips = PhotoLabel(get_resource_file('maya_playback_tips.jpg'), parent=self)
         tips.exec_()
@@ -158,69 +155,16 @@ class ScanMayaFrameTask(QtCore.QThread):
         self.scan_folder = scan_folder
         self.is_include = is_include
 
+    @profile_task
     def run(self):
-        # 扫描ma文件
+        # 扫描ma和mb文件
         logger.info(f'开始扫描文件, 扫描路径: {self.scan_folder}')
+        session = MetricsSession('扫描帧数范围')
         files_list = scan_files(scan_folder=self.scan_folder,
                                 is_include=self.is_include,
-                                ext_list=('.ma'))
+                                ext_list=MAYA_EXT_LIST)
 
-        for file_path in files_list:
-            data = self.scan_file_time_range(file_path=file_path)
+        for data in scan_maya_frames(files_list, max_workers=DEFAULT_MAX_WORKERS):
             self.data_sig.emit(data)
-            
-    
-    def scan_file_time_range(self, file_path):
-        """
-        通过正则，获取文件的帧数范围，并返回一个字典
-        字典格式:
-        {
-            'file_path': 文件路径,
-            'start_frame': 动画开始帧(ast),
-            'end_frame': 动画结束帧(aet),
-            'min_frame': 播放起始帧(min),
-            'max_frame': 播放结束帧(max),
-            'file_name': 文件名,
-        }
-        """
-
-        data_dict = {'file_path': file_path,
-                     'start_frame': '',
-                     'end_frame': '',
-                     'min_frame': '',
-                     'max_frame': '',
-                     'file_name': os.path.basename(file_path)}
-        
-        # 尝试不同的编码方式读取文件
-        encodings = ['utf-8', 'latin1', 'cp1252']
-        content = None
-
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.readlines()
-                break
-            except UnicodeDecodeError:
-                logger.error(f'文件{file_path}编码错误, {traceback.format_exc()}')
-                continue
-
-        if content is None:
-            return data_dict
-
-        # 从文件内容中获取帧数范围
-        for line in content:
-            if 'playbackOptions' in line:
-                pattern = r"-(min|max|ast|aet)\s(\d+)"
-
-                # Find all matches and convert them to a dictionary
-                matches = re.findall(pattern, line)
-                result_dict = {key: int(value) for key, value in matches}
-
-                data_dict = {'file_path': file_path,
-                             'start_frame': result_dict['ast'],
-                             'end_frame': result_dict['aet'],
-                             'min_frame': result_dict['min'],
-                             'max_frame': result_dict['max'],
-                             'file_name': os.path.basename(file_path)}
-                break
-        return data_dict
+            metrics.add('rows_emitted')
+        session.finish(files=len(files_list))
@@ -1,14 +1,45 @@
 import os
-import csv
+import re
 import traceback
+from functools import partial
 
 import dayu_widgets as dy
-from PySide2 import QtWidgets, QtCore
-
-from pmtm.common_widgets import CommonToolWidget, CommonDialog, CommonWidget, InfoBoard, message_box, question_box
-from pmtm.core import logger
-from pmtm.helper import scan_files
-
+from PySide2 import QtWidgets, QtCore, QtGui
+
+from pmtm.common_widgets import (CommonToolWidget, CommonDialog, CommonWidget, InfoBoard, ProgressDialog,
+                                 message_box, question_box)
+from pmtm.core import logger, MetricsSession, profile_task
+from pmtm.helper import scan_files, FileStatCache
+from pmtm.qt_utils import ExportReportTask
+from pmtm.export_utils import get_export_filter
+from pmtm.maya_utils import (replace_maya_references, is_read_only, is_maya_binary, ReferenceIndex,
+                             remap_by_prefix, remap_by_regex, remap_by_root, MAYA_EXT_LIST)
+from pmtm.engine import DEFAULT_MAX_WORKERS, scan_maya_references
+
+
+REF_STATUS_DICT = {
+    FileStatCache.OK: {'label': '正常', 'color': None},
+    FileStatCache.MISSING: {'label': '丢失', 'color': '#e74c3c'},
+    FileStatCache.CHANGED: {'label': '已修改', 'color': '#f39c12'},
+}
+
+# maya文件树每次加载的顶层条目数量, 滚动到底部时继续加载
+TREE_FETCH_BATCH = 200
+# 搜索框停止输入多久后(毫秒)再过滤
+TREE_FILTER_DELAY = 200
+
+# 批量替换的规则, (规则, 名称)
+REMAP_RULE_LIST = [
+    ('prefix', '替换路径前缀'),
+    ('regex', '正则替换'),
+    ('root', '在新目录下按文件名查找'),
+]
+
+EXPORT_HEADER_LIST = [
+    {'label': 'Maya file', 'key': 'maya_file'},
+    {'label': 'Reference', 'key': 'reference'},
+    {'label': 'Status', 'key': 'status'},
+]
 
 
 class MayaRefScanUI(CommonToolWidget):
@@ -21,8 +52,12 @@ class MayaRefScanUI(CommonToolWidget):
 
         # data
         self.replace_map_list = []  # 被替换的前后引用文件路径列表 [{'old_path': 'new_path'}, {'old_path': 'new_path'}, ...]
+        self.ref_path_set = set()  # replace_map_list 中的旧路径, 用于去重
+        self.ref_index = None  # replace_map_list 中旧路径的索引, 按文件名匹配时使用
         self.maya_files = {}  # 扫描到的maya文件 {file_path: [ref_path1, ref_path2, ...]}
         self.replace_one_time = False  # 记录是否执行过替换，如果执行过，需再次扫描重置该值。
+        self.ref_status = {}  # 引用文件的校验状态 {ref_path: status}
+        self.stat_cache = FileStatCache()  # 引用文件状态缓存，用于对比两次扫描之间文件是否被修改
 
         # widgets
         self.scan_path_line = dy.MLineEdit().folder().small()
@@ -49,9 +84,6 @@ class MayaRefScanUI(CommonToolWidget):
         self.add_widgets_h_line(self.export_bt, self.replace_bt)
 
     def adjust_ui(self):
-        self.maya_tree_widget.tree.setColumnCount(1)
-        self.maya_tree_widget.tree.setHeaderHidden(True)
-        self.maya_tree_widget.tree.setSelectionMode(QtWidgets.QTreeWidget.ExtendedSelection)
         self.tab.tool_button_group.set_dayu_checked(0)
         self.splitter.setStretchFactor(0, 7)
         self.splitter.setStretchFactor(1, 3)
@@ -63,7 +95,7 @@ class MayaRefScanUI(CommonToolWidget):
         self.ref_list_widget.list.itemDoubleClicked.connect(self.double_click_ref_file)
         self.ref_list_widget.switch_ori_bt.clicked.connect(self.switch_ori_bt_clicked)
         self.ref_list_widget.reset_bt.clicked.connect(self.reset_bt_clicked)
-        self.maya_tree_widget.search_line.textChanged.connect(self.update_maya_tree)
+        self.ref_list_widget.bulk_remap_bt.clicked.connect(self.bulk_remap_bt_clicked)
         self.maya_tree_widget.extend_bt.clicked.connect(self.maya_tree_widget.tree.expandAll)
         self.maya_tree_widget.collapse_bt.clicked.connect(self.maya_tree_widget.tree.collapseAll)
 
@@ -80,9 +112,12 @@ class MayaRefScanUI(CommonToolWidget):
         # 清空所有已有的数据
         self.replace_one_time = False
         self.replace_map_list.clear()
+        self.ref_path_set.clear()
+        self.ref_index = None
         self.maya_files.clear()
+        self.ref_status.clear()
         self.ref_list_widget.list.clear()
-        self.maya_tree_widget.tree.clear()
+        self.maya_tree_widget.model.clear()
 
         # 设置工具状态
         self.set_tool_status(status=False)
@@ -95,53 +130,67 @@ class MayaRefScanUI(CommonToolWidget):
         # 创建任务
         task = ScanReferenceTask(scan_folder=self.scan_path_line.text(),
                                      is_include=self.include_ck.isChecked(),
+                                     stat_cache=self.stat_cache,
                                      parent=self)
         task.msg_sig.connect(self.info_board.add_line)
         task.ref_path_sig.connect(self.scan_ref_path_add)
         task.maya_files_sig.connect(self.maya_files.update)
+        task.ref_status_sig.connect(self.update_ref_status)
         task.finished.connect(self.set_tool_status)
         task.finished.connect(self.update_maya_tree)
         task.start()
     
     def scan_ref_path_add(self, ref_path):
-        exists_path_list = [i.get('old_path') for i in self.replace_map_list]
-        if ref_path in exists_path_list:
+        if ref_path in self.ref_path_set:
             return
+        self.ref_path_set.add(ref_path)
+        self.ref_index = None
         self.replace_map_list.append({'old_path': ref_path, 'new_path': ref_path})
         self.ref_list_widget.list.addItem(ref_path)
 
-    
-    def search_line_text_changed(self):
+    def update_ref_status(self, ref_status):
         """
-        搜索框文本改变时, 更新maya文件树
+        引用文件校验完成后, 标记丢失或被修改的引用文件
         """
-        self.maya_tree_widget.search_line.textChanged.connect(self.update_maya_tree)
+        self.ref_status.update(ref_status)
+        for num, item in enumerate(self.replace_map_list):
+            status = self.ref_status.get(item['old_path'], FileStatCache.OK)
+            self.ref_list_widget.set_item_status(self.ref_list_widget.list.item(num), status)
     
     def export_bt_clicked(self):
         """
-        导出csv表格
+        导出表格
         """
-        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export csv', '', 'CSV Files(*.csv)')
+        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export report', '',
+                                                                    get_export_filter(['.csv', '.xlsx', '.jsonl', '.parquet']))
         if not export_file_path:
             return
-        
-        csv_list = [['Maya file', 'Reference']]
-
-        for ma_file, ref_list in self.maya_files.items():
-            for ref in ref_list:
-                csv_list.append([ma_file, ref])
 
-        with open(export_file_path, 'w', newline='') as f:
-            csv_write = csv.writer(f)
-            for row in csv_list:
-                csv_write.writerow(row)
-        
-        self.info_board.add_line(text=f'导出位置: {export_file_path}')
+        # 复制一份数据, 在后台线程中逐行生成
+        maya_files = {ma_file: list(ref_list) for ma_file, ref_list in self.maya_files.items()}
+        ref_status = dict(self.ref_status)
+
+        def _iter_rows():
+            for ma_file, ref_list in maya_files.items():
+                for ref in ref_list:
+                    status = ref_status.get(ref, FileStatCache.OK)
+                    yield {'maya_file': ma_file, 'reference': ref, 'status': REF_STATUS_DICT[status]['label']}
+
+        dialog = ProgressDialog(title='导出表格', parent=self)
+        task = ExportReportTask(output_path=export_file_path,
+                                header_list=EXPORT_HEADER_LIST,
+                                data_list=_iter_rows,
+                                total=sum(len(ref_list) for ref_list in maya_files.values()),
+                                parent=self)
+        task.progress_sig.connect(dialog.show_progress)
+        task.is_success_sig.connect(dialog.show_success)
+        task.is_success_sig.connect(partial(self.export_finished, export_file_path))
+        task.start()
+        dialog.exec_()
 
-        dy.MToast(text='导出完成',
-                  dayu_type='success',
-                  duration=3.0,
-                  parent=self).show()
+    def export_finished(self, export_file_path, is_success):
+        if is_success:
+            self.info_board.add_line(f'导出位置: {export_file_path}')
     
     def replace_bt_clicked(self):
         if self.replace_one_time:
@@ -158,8 +207,8 @@ class MayaRefScanUI(CommonToolWidget):
 
         # 打印日志
         logger.debug('点击执行替换')
-        logger.debug(f'maya_files: {self.maya_files}')
-        logger.debug(f'replace_map_list: {self.replace_map_list}')
+        logger.debug('maya_files: %s', self.maya_files)
+        logger.debug('replace_map_list: %s', self.replace_map_list)
 
         # 设置工具状态
         self.set_tool_status(status=False)
@@ -208,16 +257,44 @@ class MayaRefScanUI(CommonToolWidget):
                 return
 
             if dialog.match_name_ck.isChecked():
-                for i in range(len(self.replace_map_list)):
-                    if file_name == os.path.basename(self.replace_map_list[i]['old_path']):
-                        self.replace_map_list[i]['new_path'] = new_path
-                        item = self.ref_list_widget.list.item(i)
-                        item.setText(f'*{new_path}')
+                for i in self.get_ref_index().find_by_name(file_name):
+                    self.replace_map_list[i]['new_path'] = new_path
+                    item = self.ref_list_widget.list.item(i)
+                    item.setText(f'*{new_path}')
             else:
                 self.replace_map_list[index_num]['new_path'] = new_path
                 item = self.ref_list_widget.list.item(index_num)
                 item.setText(f'*{new_path}')
     
+    def get_ref_index(self):
+        """
+        获取引用文件旧路径的索引, 扫描到新的引用文件后重新生成
+        """
+        if self.ref_index is None:
+            self.ref_index = ReferenceIndex([item['old_path'] for item in self.replace_map_list])
+        return self.ref_index
+
+    def bulk_remap_bt_clicked(self):
+        """
+        按规则批量替换引用文件路径
+        """
+        if not self.replace_map_list:
+            self.info_board.add_line('没有引用文件，请先扫描')
+            return
+        if self.ref_list_widget.switch_ori_bt.isChecked():
+            self.info_board.add_line('以防止混淆, 请取消勾选"显示原始路径"',
+                                     typ='error')
+            return
+
+        dialog = BulkRemapDialog(ref_index=self.get_ref_index(), parent=self)
+        if not dialog.exec_():
+            return
+
+        for num, new_path in dialog.remap_result.items():
+            self.replace_map_list[num]['new_path'] = new_path
+            self.ref_list_widget.list.item(num).setText(f'*{new_path}')
+        self.info_board.add_line(f'[pass]批量替换完成，共修改{len(dialog.remap_result)}个引用文件路径')
+
     def switch_ori_bt_clicked(self):
         """
         切换显示原始路径和替换路径
@@ -234,24 +311,16 @@ class MayaRefScanUI(CommonToolWidget):
         """
         扫描完成后, 更新maya文件树
         """
-        self.maya_tree_widget.tree.clear()
-        keyword = self.maya_tree_widget.search_line.text()
-        for file_path, ref_paths in self.maya_files.items():
-            file_name = os.path.basename(file_path)
-            if keyword and keyword not in file_name:
-                continue
-            
-            item = QtWidgets.QTreeWidgetItem([file_path])
-            self.maya_tree_widget.tree.addTopLevelItem(item)
-            for ref_path in ref_paths:
-                item.addChild(QtWidgets.QTreeWidgetItem([ref_path]))
+        self.maya_tree_widget.model.set_maya_files(self.maya_files, self.ref_status)
+        self.maya_tree_widget.filter_changed()
     
     def set_tool_status(self, status=True):
         """
         当任务执行时, 禁用工具按钮
         """
         widgets = [self.scan_path_line, self.scan_bt, self.include_ck, self.ref_list_widget.switch_ori_bt,
-                   self.ref_list_widget.reset_bt, self.maya_tree_widget.extend_bt, self.maya_tree_widget.collapse_bt,
+                   self.ref_list_widget.reset_bt, self.ref_list_widget.bulk_remap_bt,
+                   self.maya_tree_widget.extend_bt, self.maya_tree_widget.collapse_bt,
                    self.export_bt, self.replace_bt]
         for widget in widgets:
             widget.setDisabled(not status)
@@ -267,20 +336,164 @@ class MayaRefListWidget(CommonWidget):
         self.list = QtWidgets.QListWidget()
         self.switch_ori_bt = dy.MCheckBox('显示原始路径')
         self.reset_bt = dy.MPushButton('重置').small()
+        self.bulk_remap_bt = dy.MPushButton('批量替换').small()
         
         self.init_ui()
         self.adjust_ui()
     
     def init_ui(self):
-        self.add_widgets_h_line(self.switch_ori_bt, self.reset_bt, stretch=1)
+        self.add_widgets_h_line(self.switch_ori_bt, self.reset_bt, self.bulk_remap_bt, stretch=1)
         self.add_widgets_h_line(self.list)
         self.setLayout(self.main_layout)
     
     def adjust_ui(self):
         self.switch_ori_bt.setFixedWidth(100)
         self.reset_bt.setFixedWidth(80)
+        self.bulk_remap_bt.setFixedWidth(80)
         self.main_layout.setContentsMargins(0, 3, 0, 3)
 
+    def set_item_status(self, item, status):
+        """
+        根据引用文件的校验状态, 设置条目颜色和提示
+        """
+        status_data = REF_STATUS_DICT[status]
+        if status_data['color']:
+            item.setForeground(QtGui.QColor(status_data['color']))
+        else:
+            item.setData(QtCore.Qt.ForegroundRole, None)
+        item.setToolTip(f'状态: {status_data["label"]}')
+
+
+class MayaFileTreeModel(QtCore.QAbstractItemModel):
+    """
+    maya文件树的数据模型
+    顶层为maya文件, 子条目为引用文件。顶层条目分批加载, 引用文件在第一次展开时才加载
+    过滤使用预先生成的小写文件名索引, 输入的关键字包含上一次的关键字时只在上一次的结果中查找
+    """
+
+    def __init__(self, parent=None):
+        super(MayaFileTreeModel, self).__init__(parent=parent)
+
+        # data
+        self.file_list = []  # 所有maya文件路径
+        self.name_index = []  # 和 file_list 对应的小写文件名
+        self.maya_files = {}  # {file_path: [ref_path1, ref_path2, ...]}
+        self.ref_status = {}  # {ref_path: status}
+        self.keyword = ''
+        self.match_rows = []  # 符合过滤条件的 file_list 下标
+        self.loaded_count = 0  # 已加载的顶层条目数量
+        self.fetched_rows = set()  # 已加载引用文件的顶层行号
+
+    def set_maya_files(self, maya_files, ref_status=None):
+        self.beginResetModel()
+        self.maya_files = maya_files
+        self.ref_status = ref_status if ref_status is not None else {}
+        self.file_list = list(maya_files)
+        self.name_index = [os.path.basename(file_path).lower() for file_path in self.file_list]
+        self.keyword = ''
+        self.match_rows = list(range(len(self.file_list)))
+        self.loaded_count = min(TREE_FETCH_BATCH, len(self.match_rows))
+        self.fetched_rows.clear()
+        self.endResetModel()
+
+    def set_keyword(self, keyword):
+        """
+        按文件名过滤
+        """
+        keyword = keyword.strip().lower()
+        if keyword == self.keyword:
+            return
+
+        if self.keyword and self.keyword in keyword:
+            candidate_rows = self.match_rows
+        else:
+            candidate_rows = range(len(self.file_list))
+
+        self.beginResetModel()
+        self.keyword = keyword
+        self.match_rows = [row for row in candidate_rows if keyword in self.name_index[row]]
+        self.loaded_count = min(TREE_FETCH_BATCH, len(self.match_rows))
+        self.fetched_rows.clear()
+        self.endResetModel()
+
+    def clear(self):
+        self.set_maya_files({})
+
+    def get_file_path(self, row):
+        return self.file_list[self.match_rows[row]]
+
+    def index(self, row, column, parent=QtCore.QModelIndex()):
+        if not self.hasIndex(row, column, parent):
+            return QtCore.QModelIndex()
+        # 顶层条目的 internalId 为0, 子条目为父条目的行号+1
+        if not parent.isValid():
+            return self.createIndex(row, column, 0)
+        return self.createIndex(row, column, parent.row() + 1)
+
+    def parent(self, index):
+        if not index.isValid() or not index.internalId():
+            return QtCore.QModelIndex()
+        return self.createIndex(index.internalId() - 1, 0, 0)
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return self.loaded_count
+        if parent.internalId() or parent.row() not in self.fetched_rows:
+            return 0
+        return len(self.maya_files[self.get_file_path(parent.row())])
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        return 1
+
+    def hasChildren(self, parent=QtCore.QModelIndex()):
+        if not parent.isValid():
+            return bool(self.loaded_count)
+        if parent.internalId():
+            return False
+        return bool(self.maya_files[self.get_file_path(parent.row())])
+
+    def canFetchMore(self, parent):
+        if not parent.isValid():
+            return self.loaded_count < len(self.match_rows)
+        if parent.internalId():
+            return False
+        return parent.row() not in self.fetched_rows
+
+    def fetchMore(self, parent):
+        if not parent.isValid():
+            count = min(TREE_FETCH_BATCH, len(self.match_rows) - self.loaded_count)
+            self.beginInsertRows(parent, self.loaded_count, self.loaded_count + count - 1)
+            self.loaded_count += count
+            self.endInsertRows()
+            return
+
+        ref_list = self.maya_files[self.get_file_path(parent.row())]
+        if not ref_list:
+            self.fetched_rows.add(parent.row())
+            return
+        self.beginInsertRows(parent, 0, len(ref_list) - 1)
+        self.fetched_rows.add(parent.row())
+        self.endInsertRows()
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+
+        if not index.internalId():
+            if role in (QtCore.Qt.DisplayRole, QtCore.Qt.ToolTipRole):
+                return self.get_file_path(index.row())
+            return None
+
+        ref_path = self.maya_files[self.get_file_path(index.internalId() - 1)][index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return ref_path
+        status_data = REF_STATUS_DICT[self.ref_status.get(ref_path, FileStatCache.OK)]
+        if role == QtCore.Qt.ForegroundRole and status_data['color']:
+            return QtGui.QColor(status_data['color'])
+        if role == QtCore.Qt.ToolTipRole:
+            return f'状态: {status_data["label"]}'
+        return None
+
 
 class MayaFileTreeWidget(CommonWidget):
     """
@@ -293,10 +506,13 @@ class MayaFileTreeWidget(CommonWidget):
         self.extend_bt = dy.MPushButton('展开所有').small()
         self.collapse_bt = dy.MPushButton('收起所有').small()
         self.search_line = dy.MLineEdit().search().small()
-        self.tree = QtWidgets.QTreeWidget()
+        self.tree = QtWidgets.QTreeView()
+        self.model = MayaFileTreeModel(parent=self)
+        self.filter_timer = QtCore.QTimer(self)
 
         self.init_ui()
         self.adjust_ui()
+        self.connect_command()
 
     def init_ui(self):
         self.add_widgets_h_line(dy.MLabel('搜索Maya文件'), self.search_line,
@@ -307,6 +523,20 @@ class MayaFileTreeWidget(CommonWidget):
     
     def adjust_ui(self):
         self.main_layout.setContentsMargins(0, 3, 0, 3)
+        self.tree.setModel(self.model)
+        self.tree.setHeaderHidden(True)
+        self.tree.setUniformRowHeights(True)
+        self.tree.setSelectionMode(QtWidgets.QAbstractItemView.ExtendedSelection)
+        self.filter_timer.setSingleShot(True)
+        self.filter_timer.setInterval(TREE_FILTER_DELAY)
+
+    def connect_command(self):
+        # 输入时重新计时, 停止输入后再过滤
+        self.search_line.textChanged.connect(self.filter_timer.start)
+        self.filter_timer.timeout.connect(self.filter_changed)
+
+    def filter_changed(self):
+        self.model.set_keyword(self.search_line.text())
 
 
 class ReplacePathDialog(CommonDialog):
@@ -349,6 +579,151 @@ class ReplacePathDialog(CommonDialog):
         self.cancel_bt.clicked.connect(self.reject)
 
 
+class BulkRemapDialog(CommonDialog):
+    """
+    批量替换路径对话框, 规则应用到所有匹配的引用文件, 预览匹配数量后才能应用
+    """
+
+    def __init__(self, ref_index, parent=None):
+        super(BulkRemapDialog, self).__init__(parent=parent)
+
+        # data
+        self.ref_index = ref_index
+        self.remap_result = {}  # {引用文件下标: 新路径}
+
+        # widgets
+        self.rule_cb = QtWidgets.QComboBox()
+        self.old_label = dy.MLabel()
+        self.new_label = dy.MLabel()
+        self.old_line = dy.MLineEdit().small()
+        self.new_line = dy.MLineEdit().small()
+        self.root_line = dy.MLineEdit().folder().small()
+        self.preview_label = dy.MLabel('')
+        self.preview_bt = dy.MPushButton('预览').small()
+        self.apply_bt = dy.MPushButton('应用').small().primary()
+        self.cancel_bt = dy.MPushButton('取消').small()
+
+        self.init_ui()
+        self.adjust_ui()
+        self.connect_command()
+
+    def init_ui(self):
+        self.add_widgets_h_line(dy.MLabel('规则'), self.rule_cb, stretch=True)
+        self.add_widgets_h_line(self.old_label, self.old_line)
+        self.add_widgets_h_line(self.new_label, self.new_line, self.root_line)
+        self.add_widgets_h_line(self.preview_label)
+        self.add_widgets_h_line(self.preview_bt, self.apply_bt, self.cancel_bt)
+        self.setLayout(self.main_layout)
+
+    def adjust_ui(self):
+        for rule, label in REMAP_RULE_LIST:
+            self.rule_cb.addItem(label, rule)
+        self.old_label.setFixedWidth(60)
+        self.new_label.setFixedWidth(60)
+        self.old_line.setMinimumWidth(400)
+        self.new_line.setMinimumWidth(400)
+        self.root_line.setMinimumWidth(400)
+        self.setWindowTitle('批量替换路径')
+        self.rule_changed()
+
+    def connect_command(self):
+        self.rule_cb.currentIndexChanged.connect(self.rule_changed)
+        for line in (self.old_line, self.new_line, self.root_line):
+            line.textChanged.connect(self.clear_preview)
+        self.preview_bt.clicked.connect(self.preview_bt_clicked)
+        self.apply_bt.clicked.connect(self.accept)
+        self.cancel_bt.clicked.connect(self.reject)
+
+    @property
+    def rule(self):
+        return self.rule_cb.currentData()
+
+    def rule_changed(self):
+        rule = self.rule
+        self.old_label.setText({'prefix': '旧前缀', 'regex': '正则'}.get(rule, ''))
+        self.new_label.setText({'prefix': '新前缀', 'regex': '替换为'}.get(rule, '新目录'))
+        self.old_label.setVisible(rule != 'root')
+        self.old_line.setVisible(rule != 'root')
+        self.new_line.setVisible(rule != 'root')
+        self.root_line.setVisible(rule == 'root')
+        self.clear_preview()
+
+    def clear_preview(self):
+        self.remap_result = {}
+        self.apply_bt.setEnabled(False)
+        self.preview_label.setText('点击"预览"查看匹配的引用文件数量')
+
+    def preview_bt_clicked(self):
+        if self.rule == 'root':
+            old_text, new_text = '', self.root_line.text()
+            if not os.path.isdir(new_text):
+                self.preview_label.setText('新目录不存在')
+                return
+        else:
+            old_text, new_text = self.old_line.text(), self.new_line.text()
+            if not old_text:
+                self.preview_label.setText(f'请输入{self.old_label.text()}')
+                return
+
+        self.preview_bt.setEnabled(False)
+        self.preview_label.setText('正在查找匹配的引用文件...')
+        task = RemapPreviewTask(ref_index=self.ref_index,
+                                rule=self.rule,
+                                old_text=old_text,
+                                new_text=new_text,
+                                parent=self)
+        task.result_sig.connect(self.show_preview)
+        task.error_sig.connect(self.preview_label.setText)
+        task.finished.connect(partial(self.preview_bt.setEnabled, True))
+        task.start()
+
+    def show_preview(self, remap_result, missing_count):
+        self.remap_result = remap_result
+        text = f'匹配到{len(remap_result)}个引用文件'
+        if missing_count:
+            text += f'，其中{missing_count}个新路径不存在'
+        self.preview_label.setText(text)
+        self.apply_bt.setEnabled(bool(remap_result))
+
+
+class RemapPreviewTask(QtCore.QThread):
+    """
+    计算批量替换的结果, 按目录查找时需要遍历新目录, 在后台执行
+    """
+
+    result_sig = QtCore.Signal(object, int)
+    error_sig = QtCore.Signal(str)
+
+    def __init__(self, ref_index, rule, old_text, new_text, parent=None):
+        super(RemapPreviewTask, self).__init__(parent=parent)
+        self.ref_index = ref_index
+        self.rule = rule
+        self.old_text = old_text
+        self.new_text = new_text
+
+    def run(self):
+        try:
+            if self.rule == 'prefix':
+                remap_result = remap_by_prefix(self.ref_index, self.old_text, self.new_text)
+            elif self.rule == 'regex':
+                remap_result = remap_by_regex(self.ref_index, self.old_text, self.new_text)
+            else:
+                remap_result = remap_by_root(self.ref_index, self.new_text)
+        except re.error as e:
+            self.error_sig.emit(f'正则表达式错误: {e}')
+            return
+        except Exception as e:
+            logger.error(traceback.format_exc())
+            self.error_sig.emit(f'计算失败: {e}')
+            return
+
+        # 按目录查找到的文件都是存在的, 其他规则检查新路径是否存在
+        missing_count = 0
+        if self.rule != 'root':
+            missing_count = sum(1 for new_path in remap_result.values() if not os.path.isfile(new_path))
+        self.result_sig.emit(remap_result, missing_count)
+
+
 class ScanReferenceTask(QtCore.QThread):
     """
     扫描maya引用文件任务
@@ -357,27 +732,40 @@ class ScanReferenceTask(QtCore.QThread):
     msg_sig = QtCore.Signal(str)
     ref_path_sig = QtCore.Signal(str)
     maya_files_sig = QtCore.Signal(dict)
+    ref_status_sig = QtCore.Signal(dict)
 
-    def __init__(self, scan_folder, is_include, parent=None):
+    def __init__(self, scan_folder, is_include, stat_cache=None, parent=None):
         super(ScanReferenceTask, self).__init__(parent=parent)
         
         # params
         self.scan_folder = scan_folder
         self.is_include = is_include
+        self.stat_cache = stat_cache or FileStatCache()
 
         # data
         self.maya_files = {}
 
+    @profile_task
     def run(self):
+        session = MetricsSession('扫描引用')
         files_list = scan_files(scan_folder=self.scan_folder,
                                 is_include=self.is_include,
-                                ext_list=['.ma'])
+                                ext_list=MAYA_EXT_LIST)
         
-        # 扫描文件
-        for count, file_path in enumerate(files_list, start=1):
+        # 并发读取文件, 按扫描顺序输出结果
+        ref_iter = scan_maya_references(files_list, max_workers=DEFAULT_MAX_WORKERS)
+        for count, (file_path, ref_list) in enumerate(ref_iter, start=1):
             self.maya_files.setdefault(file_path, [])
             self.msg_sig.emit(f'({count}/{len(files_list)}) 扫描文件: {file_path}')
-            self.get_maya_reference(file_path)
+
+            if ref_list is None:
+                self.msg_sig.emit(f'[error]读取文件失败(编码错误或无法解析) {file_path}，请查看日志')
+                continue
+
+            for ref_path in ref_list:
+                self.maya_files[file_path].append(ref_path)
+                self.msg_sig.emit(f' -  [引用] {ref_path}')
+                self.ref_path_sig.emit(ref_path)
         
         # 扫描完成，打印日志
         result_maya_count = len(self.maya_files)
@@ -386,51 +774,33 @@ class ScanReferenceTask(QtCore.QThread):
         self.msg_sig.emit(f'[pass]扫描完成，共有{result_maya_count}个maya文件，{result_ref_count}个引用文件')
         self.maya_files_sig.emit(self.maya_files)
 
-    def get_maya_reference(self, file_path):
+        # 校验引用文件是否存在
+        self.validate_references()
+        self.msg_sig.emit(session.finish(files=len(files_list), references=result_ref_count))
+
+    def validate_references(self):
         """
-        获取maya文件的引用文件
+        对所有引用文件去重后, 按目录并发获取文件状态
         """
-        # 尝试不同的编码方式读取文件
-        encodings = ['utf-8', 'latin1', 'cp1252']
-        content = None
-        
-        for encoding in encodings:
-            try:
-                with open(file_path, 'r', encoding=encoding) as f:
-                    content = f.readlines()
-                break
-            except UnicodeDecodeError:
-                logger.error(f'文件{file_path}编码错误, {traceback.format_exc()}')
-                continue
-
-        if content is None:
-            self.msg_sig.emit(f'[error]处理文件时出现编码错误 {file_path}，请查看日志')
+        ref_set = set(ref_path for ref_list in self.maya_files.values() for ref_path in ref_list)
+        if not ref_set:
             return
 
-        # 读取文件内容, 获取reference路径
-        for line in content:
-            line = line.strip()
+        self.msg_sig.emit(f'校验引用文件，共{len(ref_set)}个...')
+        ref_status = self.stat_cache.check(ref_set)
 
-            if not line or line[-5:-2] not in ('.ma', '.mb'):
-                continue
-
-            if '-rfn' in line:
-                line = line.split()[-1]
-
-            if '"mayaAscii"' in line:
-                line = line.split('"mayaAscii"')[-1].strip()
-            
-            if '"mayaBinary"' in line:
-                line = line.split('"mayaBinary"')[-1].strip()
-            
-            if line.startswith('"') and line.endswith(';'):
-                ref_path = line.replace('"', '')
-                ref_path = ref_path.replace(';', '')
+        for status in (FileStatCache.MISSING, FileStatCache.CHANGED):
+            ref_list = sorted(ref for ref, s in ref_status.items() if s == status)
+            for ref_path in ref_list:
+                self.msg_sig.emit(f'[warning] -  [{REF_STATUS_DICT[status]["label"]}] {ref_path}')
 
-                if ref_path not in self.maya_files[file_path]:
-                    self.maya_files[file_path].append(ref_path)
-                    self.msg_sig.emit(f' -  [引用] {ref_path}')
-                    self.ref_path_sig.emit(ref_path)
+        missing_count = list(ref_status.values()).count(FileStatCache.MISSING)
+        changed_count = list(ref_status.values()).count(FileStatCache.CHANGED)
+        if missing_count or changed_count:
+            self.msg_sig.emit(f'[warning]校验完成，{missing_count}个引用文件丢失，{changed_count}个引用文件已修改')
+        else:
+            self.msg_sig.emit('[pass]校验完成，所有引用文件均存在')
+        self.ref_status_sig.emit(ref_status)
 
 
 class ReplacePathTask(QtCore.QThread):
@@ -453,7 +823,9 @@ class ReplacePathTask(QtCore.QThread):
                                       for i in self.replace_map_list 
                                       if i.get('old_path') != i.get('new_path')}
 
+    @profile_task
     def run(self):
+        session = MetricsSession('替换引用')
         num = 0
         total = len(self.maya_files)
 
@@ -462,56 +834,30 @@ class ReplacePathTask(QtCore.QThread):
                 num += 1
                 self.msg_sig.emit(f'({num}/{total}) 执行替换操作...')
 
-                if self.is_read_only(f):
+                if is_maya_binary(f):
+                    self.msg_sig.emit(f'[warning][跳过，不支持替换mb文件] - {f}')
+                elif is_read_only(f):
                     self.msg_sig.emit(f'[error][只读文件] - {f}')
                 elif not ref_path_list:
                     self.msg_sig.emit(f'[跳过，没有任何引用] - {f}')
                 elif not self.check_need_replace(f):
                     self.msg_sig.emit(f'[跳过，不需要替换] - {f}')
                 else:
-                    self.do_replace(f)  # 执行实际替换操作
+                    # 只传入这个文件用到的引用路径, 每一行只需要和这几个路径比较
+                    file_map_dict = {ref_path: self.replace_path_map_dict[ref_path]
+                                     for ref_path in ref_path_list
+                                     if ref_path in self.replace_path_map_dict}
+                    replace_maya_references(f, file_map_dict)  # 执行实际替换操作
                     self.msg_sig.emit(f'[已替换] - {f}')
         except Exception as e:
             logger.error(f'替换任务执行失败，请查看日志获取详细信息')
             logger.error(f'{traceback.format_exc()}')
             return
+        finally:
+            self.msg_sig.emit(session.finish(files=total))
 
         self.msg_sig.emit('[pass]替换任务完成!')
 
-    def do_replace(self, f):
-        """
-        执行替换操作
-        """
-        bak_f = f[:-3] + '_bak.ma'
-        with open(bak_f, 'w') as new_data:
-            logger.debug(f'创建备份文件 {bak_f}')
-            with open(f, 'r') as old_data:
-                for line in old_data.readlines():
-                    line = self.replace_if_reference_line(line)
-                    new_data.writelines(line)
-        logger.debug(f'删除原文件 {f}')
-        os.remove(f)
-        logger.debug(f'重命名备份文件 {bak_f} 为 {f}')
-        os.rename(bak_f, f)
-
-    def replace_if_reference_line(self, line):
-        """
-        如果行是引用行，则替换路径
-        """
-        for old_path, new_path in self.replace_path_map_dict.items():
-            if old_path in line:
-                # 替换路径
-                line = line.replace(old_path, new_path)
-                # 如果旧路径和新路径的扩展名不同，则需要替换文件格式
-                old_ext = os.path.splitext(old_path)[1]
-                new_ext = os.path.splitext(new_path)[1]
-                if old_ext != new_ext:
-                    if new_ext == '.ma':
-                        line = line.replace('"mayaBinary"', '"mayaAscii"')
-                    elif new_ext == '.mb':
-                        line = line.replace('"mayaAscii"', '"mayaBinary"')
-        return line
-
     def check_need_replace(self, file_path):
         """
         检查该文件是否需要替换，如果需要返回True，否则返回False。
@@ -523,7 +869,3 @@ class ReplacePathTask(QtCore.QThread):
             if ref_path in self.replace_path_map_dict:
                 return True
         return False
-
-    @staticmethod
-    def is_read_only(f):
-        return True if os.stat(f).st_mode == 33060 else False
@@ -1,23 +1,23 @@
 import os
-import tempfile
 import traceback
 from functools import partial
 
-import openpyxl
-from openpyxl.drawing.image import Image
-from openpyxl.styles import Font, colors, Alignment
 import dayu_widgets as dy
 from PySide2 import QtWidgets, QtCore
 
-from pmtm.core import logger, user_setting
-from pmtm.common_widgets import CommonToolWidget, DropTabelView, message_box
-from pmtm.helper import g_pixmap, scan_files, check_depend_tool_exist, open_file, open_folder
-from pmtm.media_utils import (get_video_frame_count, extract_thumbnail_from_mov, extract_audio_from_mov,
-                              get_image_resolution, get_video_rate, get_video_codex, get_video_resolution,
-                              get_video_colorspace)
+from pmtm.core import logger, user_setting, metrics, MetricsSession, profile_task
+from pmtm.common_widgets import (CommonToolWidget, DropTabelView, ProgressDialog, ProgressiveTableModel,
+                                 ThumbnailLoader)
+from pmtm.helper import (g_file_size, scan_files, stat_files_by_dir, check_depend_tool_exist,
+                         open_file, open_folder, THUMBNAIL_HEIGHT)
+from pmtm.qt_utils import g_pixmap, ExportReportTask
+from pmtm.export_utils import get_export_filter
+from pmtm.engine import (DEFAULT_MAX_WORKERS, MOVIE_EXT_LIST, PriorityJobQueue, map_prioritized, iter_batches,
+                         get_movie_skeleton, get_movie_data, make_file_thumbnail, fill_thumbnails,
+                         export_audio_files)
 
 
-# 如果要添加Header，需要在下面的data也添加对应的数据获取方式，定位 if_add_header_list
+# 如果要添加Header，需要在 engine.get_movie_data 的data也添加对应的数据获取方式，定位 if_add_header_list
 HEADER_LIST = [
             {'label': '缩略图', 'key': 'thumbnail', 'icon': g_pixmap},
             {'label': '文件名', 'key': 'file_name', 'order': 0},
@@ -26,9 +26,13 @@ HEADER_LIST = [
             {'label': '分辨率', 'key': 'resolution', 'align': 'center'},
             {'label': '编码', 'key': 'codec', 'align': 'center'},
             {'label': '色彩空间', 'key': 'colorspace', 'align': 'center'},
+            {'label': '文件大小', 'key': 'file_size', 'align': 'center', 'display': g_file_size},
             {'label': '文件路径', 'key': 'file_path'}
         ]
 
+# 导出音频的处理方式, 导出结束时显示每种的数量
+AUDIO_STATUS_LABELS = (('copy', '复制'), ('transcode', '转码'), ('skip', '跳过'), ('error', '失败'))
+
 
 class ScanMovieDataUI(CommonToolWidget):
 
@@ -36,7 +40,9 @@ class ScanMovieDataUI(CommonToolWidget):
         super().__init__(**kwargs)
 
         # data
-        self.model = dy.MTableModel()
+        self.model = ProgressiveTableModel(key='file_path')
+        self.thumbnail_loader = ThumbnailLoader(make_file_thumbnail, parent=self)
+        self.task = None
 
         # widgets
         self.scan_path_line = dy.MLineEdit().folder().small()
@@ -60,6 +66,7 @@ class ScanMovieDataUI(CommonToolWidget):
     def adjust_ui(self):
         self.model.set_header_list(HEADER_LIST)
         self.table_view.setModel(self.model)
+        self.table_view.set_row_height(THUMBNAIL_HEIGHT + 4)
 
     def connect_command(self):
         self.scan_bt.clicked.connect(self.scan_bt_clicked)
@@ -67,10 +74,13 @@ class ScanMovieDataUI(CommonToolWidget):
         self.export_audio_bt.clicked.connect(self.export_audio_bt_clicked)
         self.clean_bt.clicked.connect(self.clean_bt_clicked)
         self.table_view.fileDropped.connect(partial(self.drop_to_table_function))
+        self.table_view.visibleRowsChanged.connect(self.visible_rows_changed)
+        self.thumbnail_loader.thumbnail_ready.connect(self.update_thumbnail)
 
     def scan_bt_clicked(self):
         # 清空数据
         self.model.clear()
+        self.thumbnail_loader.clear()
 
         #  打印日志
         logger.debug(f'点击扫描按钮, 扫描路径: {self.scan_folder}')
@@ -102,7 +112,7 @@ class ScanMovieDataUI(CommonToolWidget):
         logger.debug('点击导出表格按钮')
 
         # 获取保存路径
-        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export xlsx', '', 'XLSX Files(*.xlsx)')
+        export_file_path, _ = QtWidgets.QFileDialog.getSaveFileName(self, 'Export report', '', get_export_filter())
         if not export_file_path:
             return
 
@@ -115,13 +125,24 @@ class ScanMovieDataUI(CommonToolWidget):
                       parent=self).show()
             return
 
-        # 开始导出任务
-        task = ExportXLSXTask(data_list=data_list,
-                              output_path=export_file_path,
-                              parent=self)
-        task.finished.connect(partial(message_box, text='导出完成', parent=self))
+        # 创建导出进度对话框
+        dialog = ProgressDialog(title='导出表格', parent=self)
+
+        # 开始导出任务, 缩略图是按需生成的, 导出前在后台线程补全没有生成的缩略图
+        # 使用行数据的副本, 后台线程不修改表格中的数据
+        data_list = [dict(data) for data in data_list]
+        task = ExportReportTask(output_path=export_file_path,
+                                header_list=HEADER_LIST,
+                                data_list=partial(fill_thumbnails, data_list, max_workers=DEFAULT_MAX_WORKERS),
+                                total=len(data_list),
+                                parent=self)
+        task.progress_sig.connect(dialog.show_progress)
+        task.is_success_sig.connect(dialog.show_success)
         task.start()
 
+        # 显示进度对话框
+        dialog.exec_()
+
     def export_audio_bt_clicked(self):
         logger.debug('点击导出音频按钮')
 
@@ -144,14 +165,15 @@ class ScanMovieDataUI(CommonToolWidget):
             return
 
         # 创建导出进度对话框
-        dialog = ExportAudioDialog(parent=self)
+        dialog = ProgressDialog(title='导出音频', parent=self)
 
         # 开始导出任务
         task = ExportAudioTask(data_list=data_list,
                                output_folder=export_folder_path,
                                parent=self)
         task.progress_sig.connect(dialog.show_progress)
-        task.finished.connect(dialog.show_success)
+        task.detail_sig.connect(dialog.set_detail)
+        task.is_success_sig.connect(dialog.show_success)
         task.start()
 
         # 显示进度对话框
@@ -161,6 +183,7 @@ class ScanMovieDataUI(CommonToolWidget):
         logger.debug('点击清空按钮')
 
         self.model.clear()
+        self.thumbnail_loader.clear()
         self.total = 0
         self.total_frame = 0
 
@@ -184,19 +207,55 @@ class ScanMovieDataUI(CommonToolWidget):
         # 禁用按钮
         self.disable_all_button()
 
-        # 开始获取视频文件的数据
-        task = GetMDataTask(files_list=_list,
-                            parent=self)
-        task.data_sig.connect(partial(self.add_shot_data))
-        task.finished.connect(partial(self.disable_all_button))
-        task.start()
-
-    def add_shot_data(self, data):
-        logger.debug(f'添加数据: {data}')
-        self.model.append(data)
-
-        self.table_view.resizeColumnsToContents()
-        self.table_view.resizeRowsToContents()
+        # 开始获取视频文件的数据, 先添加只有文件名、大小和路径的行, 再逐行补全视频信息和缩略图
+        self.task = GetMDataTask(files_list=_list,
+                                 parent=self)
+        self.task.rows_sig.connect(self.add_shot_rows)
+        self.task.data_sig.connect(self.update_shot_data)
+        self.task.unsupported_sig.connect(partial(self.show_unsupported_file))
+        self.task.finished.connect(partial(self.disable_all_button))
+        self.task.finished.connect(self.table_view.resizeColumnsToContents)
+        self.task.start()
+
+    def add_shot_rows(self, data_list):
+        logger.debug('添加%s行', len(data_list))
+        with metrics.timer('ui_layout'):
+            is_first = not self.model.get_data_list()
+            # 已经在表格中的文件不会重复添加
+            self.total += len(self.model.append_rows(data_list))
+            if is_first:
+                self.table_view.resizeColumnsToContents()
+
+    def update_shot_data(self, data):
+        logger.debug('更新数据: %s', data)
+        with metrics.timer('ui_layout'):
+            row = self.model.row_dict.get(str(data['file_path']))
+            if row is None:
+                return
+            # 重复扫描同一个文件时, 只统计帧数的变化
+            old_frame_count = self.model.get_data_list()[row].get('frame_count', 0)
+            self.model.update_row(data['file_path'], data)
+            self.total_frame += data.get('frame_count', 0) - old_frame_count
+
+    def update_thumbnail(self, file_path, image_path):
+        self.model.update_row(file_path, {'image': image_path})
+
+    def visible_rows_changed(self, first, last):
+        """
+        可见的行优先获取视频信息, 并且只为可见的行生成缩略图
+        """
+        data_list = self.table_view.data_in_rows(first, last)
+        if self.task and self.task.isRunning():
+            self.task.prioritize([data['file_path'] for data in data_list])
+        self.thumbnail_loader.request([data['file_path'] for data in data_list if not data.get('image')])
+
+    def show_unsupported_file(self, file_path):
+        if self.model.remove_key(file_path):
+            self.total -= 1
+        dy.MMessage(text=f'不支持的文件: {file_path}',
+                    duration=3.0,
+                    dayu_type='warning',
+                    parent=self).show()
 
     def disable_all_button(self):
         for bt in (self.scan_bt, self.export_excel_bt, self.clean_bt, self.export_audio_bt, self.scan_path_line):
@@ -228,169 +287,85 @@ class ScanMovieDataUI(CommonToolWidget):
 class GetMDataTask(QtCore.QThread):
     """
     获取mov文件数据信息类
+    rows_sig 分批发送只有文件名、大小和路径的行, data_sig 逐个发送补全后的数据, 可见的行优先
+    缩略图不在这里生成, 由界面中的 ThumbnailLoader 按需生成
     """
 
-    data_sig = QtCore.Signal(dict)
+    rows_sig = QtCore.Signal(list)
+    data_sig = QtCore.Signal(object)
+    unsupported_sig = QtCore.Signal(str)
 
     def __init__(self, files_list, parent=None):
         super(GetMDataTask, self).__init__(parent=parent)
         self.files_list = files_list
+        self.job_queue = PriorityJobQueue()
 
-    def run(self):
-        for file_path in self.files_list:
-            self.data_from_file(file_path=file_path)
-            self.parent().total += 1
-
-    def data_from_file(self, file_path):
-        """
-        从文件中获取数据
-        """
-        file_name = os.path.basename(file_path)
-        real_name, ext = os.path.splitext(file_name)
-
-        if ext not in ['.mov', '.MOV', '.mp4', '.MP4']:
-            msg = dy.MMessage(text=f'不支持的文件: {file_path}',
-                              duration=3.0,
-                              dayu_type='warning',
-                              parent=self.parent())
-            msg.show()
-            return
+    def prioritize(self, files_list):
+        self.job_queue.prioritize(files_list)
 
-        # 输出一个缩略图
-        temp_dir = tempfile.mkdtemp()
-        thumbnail_path = os.path.join(temp_dir, 'thumbnail.jpg')
-        extract_thumbnail_from_mov(mov_file=file_path,
-                                   output_image_file=thumbnail_path)
-        image_w, image_h = get_image_resolution(thumbnail_path)
-
-        # if_add_header_list
-        data = {'file_name': real_name,
-                'frame_count': get_video_frame_count(file_path),
-                'fps': get_video_rate(file_path),
-                'resolution': get_video_resolution(file_path),
-                'codec': get_video_codex(file_path),
-                'colorspace': get_video_colorspace(file_path),
-                'image': thumbnail_path,
-                'image_w': image_w,
-                'image_h': image_h,
-                'file_path': file_path,
-                'thumbnail': ''
-                }
-        self.parent().total_frame += data.get('frame_count', 0)
-        self.data_sig.emit(data)
-
-
-class ExportAudioDialog(QtWidgets.QDialog):
-
-    def __init__(self, parent=None):
-        super(ExportAudioDialog, self).__init__(parent=parent)
-
-        # widgets
-        self.title = dy.MLabel('导出音频').h2().secondary().strong()
-        self.tips_label = dy.MLabel('')
-        self.progress = dy.MProgressBar()
-        self.close_bt = dy.MPushButton('程序正在运行').small()
-
-        # init ui
-        self.layout = QtWidgets.QVBoxLayout()
-        for widget in (self.title, self.tips_label, self.progress, self.close_bt):
-            self.layout.addWidget(widget)
-        self.setLayout(self.layout)
-        self.setFixedWidth(300)
-        self.setWindowTitle('进度显示')
-
-    def show_progress(self, progress_data_list):
-        file_name, current, total = progress_data_list
-        self.tips_label.setText(f'正在导出: {current}/{total} {file_name}')
-        self.progress.setValue(int(current / total * 100))
-
-    def show_success(self):
-        self.close_bt.setText('任务完成，关闭')
-        self.close_bt.clicked.connect(self.close)
-        self.tips_label.setText('导出完成!')
+    @profile_task
+    def run(self):
+        session = MetricsSession('获取视频信息')
+        try:
+            movie_list = []
+            for file_path in self.files_list:
+                if os.path.splitext(file_path)[1] in MOVIE_EXT_LIST:
+                    movie_list.append(file_path)
+                else:
+                    self.unsupported_sig.emit(file_path)
+
+            # 第一步: 只读取文件大小, 分批添加到表格
+            stat_dict = stat_files_by_dir(movie_list)
+            for batch in iter_batches(movie_list):
+                self.rows_sig.emit([get_movie_skeleton(f, stat_dict.get(f, ('',))[0]) for f in batch])
+
+            # 第二步: 并发获取视频信息, 按完成的顺序更新表格
+            self.job_queue.add(movie_list)
+            func = partial(get_movie_data, with_thumbnail=False)
+            for file_path, data in map_prioritized(func, self.job_queue, max_workers=DEFAULT_MAX_WORKERS):
+                if data is None:
+                    self.unsupported_sig.emit(file_path)
+                    continue
+                # 不覆盖表格中已经生成的缩略图
+                data.pop('image')
+                self.data_sig.emit(data)
+                metrics.add('rows_emitted')
+        except Exception as e:
+            logger.error(f'获取视频信息失败: {e}')
+            logger.error(traceback.format_exc())
+        session.finish(files=len(self.files_list))
 
 
 class ExportAudioTask(QtCore.QThread):
     """
-    导出音频任务
+    导出音频任务, 结束时发送各种处理方式的数量, 有文件导出失败时 is_success_sig 为 False
     """
 
     progress_sig = QtCore.Signal(list)
+    detail_sig = QtCore.Signal(str)
+    is_success_sig = QtCore.Signal(bool)
 
     def __init__(self, data_list, output_folder, parent=None):
         super(ExportAudioTask, self).__init__(parent=parent)
         self.data_list = data_list
         self.output_folder = output_folder
 
+    @profile_task
     def run(self):
-        current = 1
+        session = MetricsSession('导出音频')
         total = len(self.data_list)
-
-        for data in self.data_list:
-            self.progress_sig.emit([data['file_name'], current, total])
-            wav_path = os.path.join(self.output_folder, f'{data["file_name"]}.wav')
-            extract_audio_from_mov(mov_file=data['file_path'], output_audio_file=wav_path)
-            current += 1
-
-
-class ExportXLSXTask(QtCore.QThread):
-
-    def __init__(self, data_list, output_path, parent=None):
-        super(ExportXLSXTask, self).__init__(parent=parent)
-
-        self.data_list = data_list
-        self.output_path = output_path
-
-        title = [header['label'] for header in HEADER_LIST]
-        self.xls_data = [title]
-
-    def run(self):
-        try:
-            for data in self.data_list:
-                # 缩略图的key实际为image，这里列表排除它，之后添加
-                item_list = [str(data[header['key']]) 
-                             for header in HEADER_LIST 
-                             if header['key'] != 'thumbnail']
-                item_list.insert(0, data['image'])
-                self.xls_data.append(item_list)
-
-            self.make_xsl()
-
-        except Exception as e:
-            logger.error(f'导出表格失败: {traceback.format_exc()}')
-            return
-
-    def make_xsl(self):
-        if not self.xls_data:
-            return
-
-        wb = openpyxl.Workbook()
-        sheet = wb.active
-        columns = self.generate_alphabet_list(len(self.xls_data[0]))
-
-        for data in self.xls_data:
-            # row 为行数
-            row = self.xls_data.index(data) + 1
-            if row != 1:
-                sheet.row_dimensions[row].height = 108 / 1.333333
-            for column in columns:
-                sheet.column_dimensions[column].width = 190.0 / 8.2121 + 0.63
-                position = '{0}{1}'.format(column, row)
-                _index = columns.index(column)
-                if row != 1 and _index == 0:
-                    # 如果不是第一行标题，且是第一列，则设置图片大小
-                    img = Image(data[_index])
-                    img.width, img.height = (192, 108)
-                    sheet.add_image(img, position)
-                else:
-                    # 其它均为字符
-                    sheet[position].value = data[_index]
-                    sheet[position].alignment = Alignment(horizontal='center', vertical='center')
-                    t_font = Font(name='Heiti SC Light', size=12)
-                    sheet[position].font = t_font
-
-        wb.save(self.output_path)
-
-    @staticmethod
-    def generate_alphabet_list(length):
-        return [chr(i) for i in range(ord('A'), ord('A') + length)]
+        files_list = [data['file_path'] for data in self.data_list]
+        status_count = {}
+
+        self.progress_sig.emit(['', 0, total])
+        results = export_audio_files(files_list, self.output_folder, max_workers=DEFAULT_MAX_WORKERS)
+        for current, (file_path, wav_path, status) in enumerate(results, start=1):
+            status_count[status] = status_count.get(status, 0) + 1
+            if status == 'skip':
+                logger.info(f'没有音轨, 跳过: {file_path}')
+            self.progress_sig.emit([os.path.basename(file_path), current, total])
+        session.finish(files=total, **status_count)
+
+        self.detail_sig.emit(' '.join(f'{label}: {status_count.get(status, 0)}'
+                                      for status, label in AUDIO_STATUS_LABELS))
+        self.is_success_sig.emit(not status_count.get('error'))
@@ -1,21 +1,41 @@
 import os
 import subprocess as sp
+import threading
 from glob import glob
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
 
-from PySide2 import QtGui, QtCore
-from pmtm.core import user_setting
+from pmtm.core import user_setting, metrics, bind_metrics_session
 
 
-def g_pixmap(name, y):
+THUMBNAIL_WIDTH = 192
+THUMBNAIL_HEIGHT = 108
+
+# 目录中的文件数超过需要的文件数的这个倍数时, 不再列出目录, 改为逐个获取文件状态
+STAT_DIR_LIST_RATIO = 50
+
+
+@lru_cache(maxsize=32)
+def gamma_lut(gamma):
     """
-    用于缩略图显示
+    256项的gamma查找表, 和 magick -gamma 相同, 输出为 输入^(1/gamma)
     """
-    img = y.get('image')
-    image_w = 192
-    image_h = 108
-    result = QtGui.QPixmap(img)
-    result = result.scaled(image_w, image_h, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
-    return result
+    return [round(255 * (value / 255.0) ** (1.0 / gamma)) for value in range(256)]
+
+
+def g_file_size(size, y):
+    """
+    用于文件大小显示
+    """
+    if size in ('', None):
+        return ''
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            break
+        size /= 1024.0
+    else:
+        unit = 'TB'
+    return f'{size:.0f} {unit}' if unit == 'B' else f'{size:.1f} {unit}'
 
 
 def scan_files(scan_folder, is_include, ext_list):
@@ -38,6 +58,98 @@ def scan_files(scan_folder, is_include, ext_list):
     return file_list
 
 
+def stat_files_by_dir(file_list, max_workers=16):
+    """
+    批量获取文件状态, 同一目录下的文件只列出一次目录, 不同目录并发执行
+    只获取需要的文件的状态, 目录中的文件远多于需要的文件时, 改为逐个获取
+    返回字典 {file_path: (size, mtime)}, 不存在的文件不在结果中
+    """
+    dir_dict = {}
+    for file_path in set(file_list):
+        dir_dict.setdefault(os.path.dirname(file_path), []).append(file_path)
+
+    def _stat_files(files):
+        entries = {}
+        for file_path in files:
+            try:
+                st = os.stat(file_path)
+            except OSError:
+                continue
+            entries[os.path.normcase(os.path.basename(file_path))] = (st.st_size, st.st_mtime)
+        return entries
+
+    def _list_dir(dir_path):
+        files = dir_dict[dir_path]
+        if len(files) == 1:
+            with metrics.timer('file_stat'):
+                return dir_path, _stat_files(files)
+
+        names = {os.path.normcase(os.path.basename(file_path)) for file_path in files}
+        limit = len(names) * STAT_DIR_LIST_RATIO
+        entries = {}
+        with metrics.timer('file_stat'):
+            try:
+                with os.scandir(dir_path) as it:
+                    for count, entry in enumerate(it, start=1):
+                        if count > limit:
+                            return dir_path, _stat_files(files)
+                        name = os.path.normcase(entry.name)
+                        if name in names and entry.is_file():
+                            st = entry.stat()
+                            entries[name] = (st.st_size, st.st_mtime)
+            except OSError:
+                pass
+        # 同一目录下除第一个文件外, 其他文件都从目录列表中获取
+        metrics.add('cache_hit', max(len(entries) - 1, 0))
+        return dir_path, entries
+
+    result = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for dir_path, entries in executor.map(bind_metrics_session(_list_dir), dir_dict):
+            for file_path in dir_dict[dir_path]:
+                stat = entries.get(os.path.normcase(os.path.basename(file_path)))
+                if stat:
+                    result[file_path] = stat
+    return result
+
+
+class FileStatCache(object):
+    """
+    文件状态缓存, 记录上一次校验时的文件状态, 用于判断文件是否丢失或被修改
+    """
+
+    OK = 'ok'
+    MISSING = 'missing'
+    CHANGED = 'changed'
+
+    def __init__(self, max_workers=16):
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._history = {}  # {file_path: (size, mtime)}
+
+    def check(self, file_list):
+        """
+        校验文件列表, 返回字典 {file_path: 状态}
+        """
+        real_path_dict = {f: os.path.expandvars(f) for f in set(file_list)}
+        stat_dict = stat_files_by_dir(real_path_dict.values(), max_workers=self.max_workers)
+
+        result = {}
+        with self._lock:
+            for file_path, real_path in real_path_dict.items():
+                stat = stat_dict.get(real_path)
+                last_stat = self._history.get(file_path)
+                if stat is None:
+                    result[file_path] = self.MISSING
+                elif last_stat and last_stat != stat:
+                    result[file_path] = self.CHANGED
+                else:
+                    result[file_path] = self.OK
+                if stat:
+                    self._history[file_path] = stat
+        return result
+
+
 def get_resource_file(name):
     return os.path.join('./resource', name)
 
@@ -48,16 +160,9 @@ def list_resource_files(ext):
 
 def check_depend_tool_exist():
     """
-    检查依赖软件
+    检查依赖软件, 校验结果有缓存, 只在设置改变后重新校验
     """
-    ffmpeg = user_setting.get('ffmpeg')
-    ffprobe = user_setting.get('ffprobe')
-    magick = user_setting.get('magick')
-
-    for tool in (ffmpeg, ffprobe, magick):
-        if not tool or not tool.endswith('.exe'):
-            return False
-    return True
+    return all(user_setting.tool_info(tool)['valid'] for tool in user_setting.TOOL_LIST)
 
 
 def open_folder(path):
@@ -0,0 +1,172 @@
+"""
+历史记录存储, 使用一个sqlite数据库保存每次任务的设置、行数据和缩略图
+列表只读取记录表, 不需要读取行数据; 缩略图保存在数据库中, 恢复时不需要重新生成
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import threading
+
+from pmtm.core import get_subsystem_logger
+
+
+logger = get_subsystem_logger('history')
+
+HISTORY_DB_NAME = 'history.db'
+# 导入数据库后, 旧的json历史记录移动到这个目录
+MIGRATED_FOLDER_NAME = 'migrated'
+# 超过这个大小的缩略图不保存到数据库
+MAX_THUMBNAIL_SIZE = 256 * 1024
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL,
+    created REAL NOT NULL,
+    row_count INTEGER NOT NULL,
+    settings TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sessions_created ON sessions (created);
+CREATE TABLE IF NOT EXISTS rows (
+    session_id INTEGER NOT NULL REFERENCES sessions (id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    data TEXT NOT NULL,
+    thumbnail BLOB,
+    PRIMARY KEY (session_id, position)
+);
+'''
+
+
+def read_thumbnail(image_path):
+    """
+    读取缩略图文件, 文件不存在或太大时返回None
+    """
+    if not image_path:
+        return None
+    try:
+        if os.path.getsize(image_path) > MAX_THUMBNAIL_SIZE:
+            return None
+        with open(image_path, 'rb') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+class HistoryStore(object):
+    """
+    历史记录数据库
+    folder: 数据库所在目录, 也是旧的json历史记录所在的目录
+    thumbnail_folder: 恢复记录时, 缩略图写入这个目录
+    """
+
+    def __init__(self, folder, thumbnail_folder):
+        self.folder = folder
+        self.thumbnail_folder = thumbnail_folder
+        self.db_path = os.path.join(folder, HISTORY_DB_NAME)
+
+        os.makedirs(folder, exist_ok=True)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute('PRAGMA foreign_keys = ON')
+        self.conn.executescript(SCHEMA)
+
+    def save(self, name, data_list, settings=None, created=None):
+        """
+        保存一次任务的行数据, 缩略图一起保存, 返回记录id
+        """
+        with self.conn:
+            cursor = self.conn.execute('INSERT INTO sessions (name, created, row_count, settings) VALUES (?, ?, ?, ?)',
+                                       (name, created or time.time(), len(data_list),
+                                        json.dumps(settings or {}, ensure_ascii=False)))
+            session_id = cursor.lastrowid
+            self.conn.executemany('INSERT INTO rows (session_id, position, data, thumbnail) VALUES (?, ?, ?, ?)',
+                                  ((session_id, position, json.dumps(data, ensure_ascii=False, default=str),
+                                    read_thumbnail(data.get('image')))
+                                   for position, data in enumerate(data_list)))
+        logger.debug('保存历史记录: %s, %s行', name, len(data_list))
+        return session_id
+
+    def list_sessions(self):
+        """
+        按时间倒序返回所有记录 [{'id', 'name', 'created', 'row_count'}], 不读取行数据
+        """
+        cursor = self.conn.execute('SELECT id, name, created, row_count FROM sessions ORDER BY created DESC')
+        return [{'id': row[0], 'name': row[1], 'created': row[2], 'row_count': row[3]} for row in cursor]
+
+    def get_settings(self, session_id):
+        row = self.conn.execute('SELECT settings FROM sessions WHERE id = ?', (session_id,)).fetchone()
+        return json.loads(row[0]) if row else {}
+
+    def load_rows(self, session_id):
+        """
+        按保存时的顺序返回记录的行数据, 缩略图写入 thumbnail_folder, 行数据的 image 指向写出的文件
+        """
+        os.makedirs(self.thumbnail_folder, exist_ok=True)
+        data_list = []
+        cursor = self.conn.execute('SELECT data, thumbnail FROM rows WHERE session_id = ? ORDER BY position',
+                                   (session_id,))
+        for data, thumbnail in cursor:
+            data = json.loads(data)
+            data['image'] = self.write_thumbnail(thumbnail) if thumbnail else ''
+            data_list.append(data)
+        return data_list
+
+    def write_thumbnail(self, thumbnail):
+        """
+        按内容命名写出缩略图, 同样的缩略图只写一次, 已经存在时更新修改时间, 清理缓存时不会被当作很久没有使用
+        先写入临时文件再改名, 写入失败时不会留下不完整的文件
+        """
+        image_path = os.path.join(self.thumbnail_folder, f'history_{hashlib.sha1(thumbnail).hexdigest()}.jpg')
+        if os.path.isfile(image_path):
+            try:
+                os.utime(image_path, None)
+            except OSError:
+                pass
+            return image_path
+
+        temp_path = f'{image_path}.{threading.get_ident()}.tmp'
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(thumbnail)
+            os.replace(temp_path, image_path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.remove(temp_path)
+        return image_path
+
+    def delete(self, session_id):
+        with self.conn:
+            self.conn.execute('DELETE FROM sessions WHERE id = ?', (session_id,))
+
+    def migrate_legacy_files(self):
+        """
+        将目录中旧的json历史记录导入数据库, 导入后移动到 migrated 目录, 返回导入的数量
+        """
+        json_files = [f for f in os.listdir(self.folder) if f.endswith('.json')]
+        if not json_files:
+            return 0
+
+        migrated_folder = os.path.join(self.folder, MIGRATED_FOLDER_NAME)
+        os.makedirs(migrated_folder, exist_ok=True)
+        count = 0
+        for file_name in json_files:
+            file_path = os.path.join(self.folder, file_name)
+            try:
+                with open(file_path, 'r') as f:
+                    data_list = json.load(f)
+                data_list = sorted(data_list, key=lambda x: x.get('order', 0))
+                self.save(name=os.path.splitext(file_name)[0],
+                          data_list=data_list,
+                          created=os.path.getmtime(file_path))
+            except (OSError, ValueError) as e:
+                logger.error(f'导入历史记录失败: {file_path}, {e}')
+                continue
+            shutil.move(file_path, os.path.join(migrated_folder, file_name))
+            count += 1
+        logger.info(f'导入旧的历史记录: {count}个')
+        return count
+
+    def close(self):
+        self.conn.close()
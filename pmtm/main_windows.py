@@ -1,5 +1,6 @@
 import os
 import sys
+import time
 
 from PySide2 import QtWidgets, QtCore, QtGui
 import dayu_widgets as dy
@@ -9,7 +10,7 @@ from pmtm.common_widgets import CommonWidget
 from pmtm.tool_data import DATA_LIST
 from pmtm.settings_dialog import SettingDialog
 from pmtm import constant as const
-from pmtm.core import user_setting, get_log_file_path
+from pmtm.core import user_setting, get_log_file_path, logger, PROFILE_SETTING_KEY
 
 
 
@@ -61,13 +62,19 @@ class MainWindow(CommonWidget):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
 
+        # data
+        self.tool_list = []  # 功能选单中显示的工具
+        self.loaded_index_set = set()  # 已经创建界面的工具序号
+
         self.left_widget = LeftWidget(parent=self)
         self.stack = QtWidgets.QStackedWidget(parent=self)
 
+        start_time = time.perf_counter()
         self.init_ui()
         self.set_data()
         self.adjust_ui()
         self.connect_command()
+        logger.info(f'[启动耗时] 主窗口初始化: {time.perf_counter() - start_time:.3f}秒')
 
     def init_ui(self):
         self.add_widgets_h_line(self.left_widget, self.stack)
@@ -84,38 +91,64 @@ class MainWindow(CommonWidget):
         theme.apply(self)
         
         # 设置窗口大小
-        width = user_setting.get('window_width', 1100)
-        height = user_setting.get('window_height', 800)
+        width = user_setting.get('window_width', 1100, typ=int)
+        height = user_setting.get('window_height', 800, typ=int)
         self.resize(width, height)
     
     def set_data(self):
         """
-        添加功能选单的界面数据
+        添加功能选单的界面数据, 工具界面先用空白页占位, 第一次打开时才创建
         """
         model = QtGui.QStandardItemModel()
         for item in DATA_LIST:
             if not item.enable:
                 continue
-            kwargs = {'title': item.name,
-                      'description': item.description,
-                      'wiki_url': item.wiki_url,
-                      'parent': self}
+            self.tool_list.append(item)
             model.appendRow(QtGui.QStandardItem(QtGui.QIcon(item.icon), item.name))
-            self.stack.addWidget(item.widget(**kwargs))
+            self.stack.addWidget(QtWidgets.QWidget(parent=self))
         self.left_widget.list_view.setModel(model)
         self.left_widget.list_view.setFocusPolicy(QtCore.Qt.NoFocus)
 
         # 还原用户最近一次打开的工具界面
-        current_stack_index = user_setting.get('current_stack_index', '0')
-        self.left_widget.list_view.setCurrentIndex(model.index(int(current_stack_index), 0))
-        self.stack.setCurrentIndex(int(current_stack_index))
+        current_stack_index = user_setting.get('current_stack_index', 0, typ=int)
+        if not 0 <= current_stack_index < len(self.tool_list):
+            current_stack_index = 0
+        self.left_widget.list_view.setCurrentIndex(model.index(current_stack_index, 0))
+        self.switch_tool(current_stack_index)
+
+    def switch_tool(self, index):
+        """
+        切换到指定的工具界面, 如果界面还没有创建, 则先导入模块并创建
+        """
+        if index not in self.loaded_index_set:
+            item = self.tool_list[index]
+
+            start_time = time.perf_counter()
+            widget_class = item.load_widget()
+            import_time = time.perf_counter() - start_time
+
+            widget = widget_class(title=item.name,
+                                  description=item.description,
+                                  wiki_url=item.wiki_url,
+                                  parent=self)
+            build_time = time.perf_counter() - start_time - import_time
+            logger.info(f'[启动耗时] {item.name}: 导入模块 {import_time:.3f}秒, 创建界面 {build_time:.3f}秒')
+
+            # 替换占位的空白页
+            placeholder = self.stack.widget(index)
+            self.stack.removeWidget(placeholder)
+            placeholder.deleteLater()
+            self.stack.insertWidget(index, widget)
+            self.loaded_index_set.add(index)
+
+        self.stack.setCurrentIndex(index)
 
     def connect_command(self):
         self.left_widget.switch_theme_bt.clicked.connect(self.switch_theme_bt_clicked)
         self.left_widget.setting_bt.clicked.connect(self.setting_bt_clicked)
         self.left_widget.log_bt.clicked.connect(self.log_bt_clicked)
         self.left_widget.list_view.clicked.connect(
-            lambda index: self.stack.setCurrentIndex(index.row())
+            lambda index: self.switch_tool(index.row())
         )
     
     def switch_theme_bt_clicked(self):
@@ -138,15 +171,23 @@ class MainWindow(CommonWidget):
         dialog.ffmpeg = user_setting.get('ffmpeg')
         dialog.ffprobe = user_setting.get('ffprobe')
         dialog.magick = user_setting.get('magick')
+        dialog.profile_capture = user_setting.get(PROFILE_SETTING_KEY, False, typ=bool)
         
         if dialog.exec_():
             user_setting.set('ffmpeg', dialog.ffmpeg)
             user_setting.set('ffprobe', dialog.ffprobe)
             user_setting.set('magick', dialog.magick)
+            user_setting.set(PROFILE_SETTING_KEY, 'true' if dialog.profile_capture else 'false')
+            user_setting.sync()
     
     def closeEvent(self, event):
+        # 停止工具界面中的后台任务
+        for index in self.loaded_index_set:
+            self.stack.widget(index).close_tool()
+
         # 记录窗口大小和当前选单
         user_setting.set('window_width', self.width())
         user_setting.set('window_height', self.height())
         user_setting.set('current_stack_index', str(self.stack.currentIndex()))
+        user_setting.sync()
         event.accept()
@@ -0,0 +1,389 @@
+import os
+import re
+import mmap
+import struct
+import traceback
+
+from pmtm.core import metrics, get_subsystem_logger
+
+
+logger = get_subsystem_logger('maya')
+
+
+MAYA_EXT_LIST = ['.ma', '.mb']
+MAYA_ENCODINGS = ['utf-8', 'latin1', 'cp1252']
+PLAYBACK_PATTERN = re.compile(r"-(min|max|ast|aet)\s(\d+)")
+
+# 超过这个大小的ma文件使用mmap和字节正则扫描, 不需要为每一行生成字符串
+MMAP_SCAN_SIZE = 32 * 1024 * 1024
+# file 语句中最后一个以 .ma/.mb 结尾的字符串为引用路径, 语句可以换行, 引号中可以包含分号, 例如 -op "v=0;"
+# 正则以字面量开头时可以快速跳过不相关的内容, 所以是否在行首在匹配后再检查
+MA_REFERENCE_PATTERN = re.compile(rb'file[ \t](?:[^";]|"[^"]*")*?"([^"\r\n]+\.m[ab])"\s*;')
+MA_PLAYBACK_PATTERN = re.compile(rb'playbackOptions[^";\r\n]*')
+
+# maya binary 文件是IFF格式, FOR4/LIS4/CAT4 为32位的数据块组, FOR8/LIS8/CAT8 为64位
+# 格式: (数据块头的struct, 对齐字节数)
+MB_FORMAT_DICT = {
+    b'FOR4': (struct.Struct('>4sI'), 4),
+    b'FOR8': (struct.Struct('>4s4xQ'), 8),
+}
+MB_GROUP_TAGS = {b'FOR4', b'LIS4', b'CAT4', b'FOR8', b'LIS8', b'CAT8'}
+# 引用文件的数据块, 以及字符串属性的数据块(playbackOptions 保存在 sceneConfigurationScriptNode 的字符串属性中)
+MB_REFERENCE_TAG = b'FREF'
+MB_STRING_TAG = b'STR '
+# 超过这个大小的字符串数据块不读取
+MB_MAX_STRING_SIZE = 1024 * 1024
+MB_TAG_PATTERN = re.compile(rb'^[A-Za-z0-9 _]{4}$')
+
+
+def is_maya_binary(file_path):
+    return os.path.splitext(file_path)[1].lower() == '.mb'
+
+
+def iter_mb_chunks(file_path, read_tags, max_size=MB_MAX_STRING_SIZE):
+    """
+    遍历maya binary文件的数据块, 只读取 read_tags 中并且不超过 max_size 的数据块内容, 其他数据块直接跳过
+    按顺序返回 (tag, data), 遇到无法识别的数据块时抛出 ValueError
+    数据块组的子数据块紧跟在组类型之后, 所以不需要递归, 按顺序读取数据块头即可
+    """
+    file_size = os.path.getsize(file_path)
+    with metrics.timer('file_read'), open(file_path, 'rb') as f:
+        magic = f.read(4)
+        if magic not in MB_FORMAT_DICT:
+            raise ValueError(f'不是maya binary文件: {file_path}')
+        header_struct, alignment = MB_FORMAT_DICT[magic]
+
+        pos = 0
+        bytes_read = 0
+        try:
+            while pos + header_struct.size <= file_size:
+                f.seek(pos)
+                tag, size = header_struct.unpack(f.read(header_struct.size))
+                bytes_read += header_struct.size
+                if not MB_TAG_PATTERN.match(tag):
+                    raise ValueError(f'无法识别的数据块 {tag!r}, 位置 {pos}: {file_path}')
+
+                data_pos = pos + header_struct.size
+                if tag in MB_GROUP_TAGS:
+                    # 跳过4字节的组类型, 进入组内的第一个数据块
+                    pos = align_offset(data_pos + 4, alignment)
+                    continue
+
+                if tag in read_tags and size <= max_size:
+                    yield tag, f.read(size)
+                    bytes_read += size
+                pos = align_offset(data_pos + size, alignment)
+        finally:
+            metrics.add('bytes_read', bytes_read)
+
+
+def align_offset(offset, alignment):
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def read_mb_references(file_path):
+    """
+    获取maya binary文件的引用文件路径列表(按出现顺序去重), 读取失败返回None
+    FREF 数据块中是以 \\0 分隔的字符串, 其中以 .ma/.mb 结尾的是引用文件路径
+    """
+    ref_list = []
+    try:
+        for _, data in iter_mb_chunks(file_path, read_tags={MB_REFERENCE_TAG}):
+            for text in data.split(b'\0'):
+                ref_path = text.decode('utf-8', errors='replace').strip()
+                if os.path.splitext(ref_path)[1].lower() in MAYA_EXT_LIST and ref_path not in ref_list:
+                    ref_list.append(ref_path)
+    except (OSError, ValueError, struct.error):
+        logger.error(f'解析maya binary文件失败 {file_path}, {traceback.format_exc()}')
+        return None
+    return ref_list
+
+
+def read_mb_playback_line(file_path):
+    """
+    获取maya binary文件中包含 playbackOptions 的字符串, 没有找到或读取失败返回None
+    """
+    try:
+        for _, data in iter_mb_chunks(file_path, read_tags={MB_STRING_TAG}):
+            if b'playbackOptions' in data:
+                return data.decode('utf-8', errors='replace')
+    except (OSError, ValueError, struct.error):
+        logger.error(f'解析maya binary文件失败 {file_path}, {traceback.format_exc()}')
+    return None
+
+
+def read_maya_lines(file_path):
+    """
+    尝试不同的编码方式读取maya文件, 返回所有行, 读取失败返回None
+    """
+    for encoding in MAYA_ENCODINGS:
+        try:
+            with metrics.timer('file_read'), open(file_path, 'r', encoding=encoding) as f:
+                lines = f.readlines()
+            metrics.add('bytes_read', os.path.getsize(file_path))
+            return lines
+        except UnicodeDecodeError:
+            logger.error(f'文件{file_path}编码错误, {traceback.format_exc()}')
+            continue
+    return None
+
+
+def use_mmap_scan(file_path):
+    """
+    较大的ma文件使用mmap扫描
+    """
+    return not is_maya_binary(file_path) and os.path.getsize(file_path) >= MMAP_SCAN_SIZE
+
+
+def decode_maya_bytes(data):
+    for encoding in MAYA_ENCODINGS:
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode('utf-8', errors='replace')
+
+
+def scan_ma_file(file_path, pattern, first_only=False, line_start=False):
+    """
+    用mmap映射ma文件, 在字节数据上执行正则, 只解码匹配到的部分
+    line_start 为 True 时只保留在行首(前面只有空白)的匹配
+    返回匹配到的字符串列表(有分组时为第一个分组), 读取失败返回None
+    """
+    result = []
+    try:
+        with metrics.timer('file_read'), open(file_path, 'rb') as f, \
+                mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for match in pattern.finditer(data):
+                if line_start and data[data.rfind(b'\n', 0, match.start()) + 1:match.start()].strip():
+                    continue
+                result.append(decode_maya_bytes(match.group(match.lastindex or 0)))
+                if first_only:
+                    break
+        metrics.add('bytes_read', os.path.getsize(file_path))
+    except (OSError, ValueError):
+        logger.error(f'读取文件失败 {file_path}, {traceback.format_exc()}')
+        return None
+    return result
+
+
+def read_ma_references_mmap(file_path):
+    """
+    用mmap扫描ma文件中 file 语句的引用路径(按出现顺序去重), 读取失败返回None
+    """
+    ref_list = scan_ma_file(file_path, MA_REFERENCE_PATTERN, line_start=True)
+    if ref_list is None:
+        return None
+    return list(dict.fromkeys(ref_list))
+
+
+def read_maya_references(file_path):
+    """
+    获取maya文件的引用文件路径列表(按出现顺序去重), 读取失败返回None
+    """
+    if is_maya_binary(file_path):
+        return read_mb_references(file_path)
+    if use_mmap_scan(file_path):
+        return read_ma_references_mmap(file_path)
+    return read_ma_references_lines(file_path)
+
+
+def read_ma_references_lines(file_path):
+    """
+    逐行读取ma文件中的引用路径(按出现顺序去重), 读取失败返回None
+    """
+    content = read_maya_lines(file_path)
+    if content is None:
+        return None
+
+    ref_list = []
+    for line in content:
+        line = line.strip()
+
+        if not line or line[-5:-2] not in ('.ma', '.mb'):
+            continue
+
+        if '-rfn' in line:
+            line = line.split()[-1]
+
+        if '"mayaAscii"' in line:
+            line = line.split('"mayaAscii"')[-1].strip()
+
+        if '"mayaBinary"' in line:
+            line = line.split('"mayaBinary"')[-1].strip()
+
+        if line.startswith('"') and line.endswith(';'):
+            ref_path = line.replace('"', '')
+            ref_path = ref_path.replace(';', '')
+
+            if ref_path not in ref_list:
+                ref_list.append(ref_path)
+    return ref_list
+
+
+def read_maya_time_range(file_path):
+    """
+    通过正则，获取文件的帧数范围，并返回一个字典
+    字典格式:
+    {
+        'file_path': 文件路径,
+        'start_frame': 动画开始帧(ast),
+        'end_frame': 动画结束帧(aet),
+        'min_frame': 播放起始帧(min),
+        'max_frame': 播放结束帧(max),
+        'file_name': 文件名,
+    }
+    """
+    data_dict = {'file_path': file_path,
+                 'start_frame': '',
+                 'end_frame': '',
+                 'min_frame': '',
+                 'max_frame': '',
+                 'file_name': os.path.basename(file_path)}
+
+    if is_maya_binary(file_path):
+        playback_line = read_mb_playback_line(file_path)
+        content = [playback_line] if playback_line else None
+    elif use_mmap_scan(file_path):
+        content = scan_ma_file(file_path, MA_PLAYBACK_PATTERN, first_only=True)
+    else:
+        content = read_maya_lines(file_path)
+    if content is None:
+        return data_dict
+
+    # 从文件内容中获取帧数范围
+    for line in content:
+        if 'playbackOptions' in line:
+            result_dict = {key: int(value) for key, value in PLAYBACK_PATTERN.findall(line)}
+            data_dict.update({'start_frame': result_dict.get('ast', ''),
+                              'end_frame': result_dict.get('aet', ''),
+                              'min_frame': result_dict.get('min', ''),
+                              'max_frame': result_dict.get('max', '')})
+            break
+    return data_dict
+
+
+def replace_maya_references(file_path, replace_path_map_dict):
+    """
+    替换maya文件中的引用路径, 先写入备份文件, 再覆盖原文件, 不支持maya binary文件
+    replace_path_map_dict: {旧路径: 新路径}
+    """
+    if is_maya_binary(file_path):
+        raise ValueError(f'不支持替换maya binary文件的引用: {file_path}')
+    bak_f = file_path[:-3] + '_bak.ma'
+    with open(bak_f, 'w') as new_data:
+        logger.debug(f'创建备份文件 {bak_f}')
+        with open(file_path, 'r') as old_data:
+            for line in old_data.readlines():
+                line = replace_if_reference_line(line, replace_path_map_dict)
+                new_data.writelines(line)
+    metrics.add('bytes_read', os.path.getsize(file_path))
+    logger.debug(f'删除原文件 {file_path}')
+    os.remove(file_path)
+    logger.debug(f'重命名备份文件 {bak_f} 为 {file_path}')
+    os.rename(bak_f, file_path)
+
+
+def replace_if_reference_line(line, replace_path_map_dict):
+    """
+    如果行是引用行，则替换路径
+    """
+    for old_path, new_path in replace_path_map_dict.items():
+        if old_path in line:
+            # 替换路径
+            line = line.replace(old_path, new_path)
+            # 如果旧路径和新路径的扩展名不同，则需要替换文件格式
+            old_ext = os.path.splitext(old_path)[1]
+            new_ext = os.path.splitext(new_path)[1]
+            if old_ext != new_ext:
+                if new_ext == '.ma':
+                    line = line.replace('"mayaBinary"', '"mayaAscii"')
+                elif new_ext == '.mb':
+                    line = line.replace('"mayaAscii"', '"mayaBinary"')
+    return line
+
+
+class ReferenceIndex(object):
+    """
+    引用路径的索引, 用于批量替换路径
+    name_index: {小写文件名: [下标]}
+    dir_index: {小写目录: [下标]}, 按前缀查找时只需要比较目录, 目录数量通常远少于引用数量
+    下标和 path_list 的顺序一致, 路径中的反斜杠统一为正斜杠, 查找时不区分大小写
+    """
+
+    def __init__(self, path_list):
+        self.path_list = [path.replace('\\', '/') for path in path_list]
+        self.name_index = {}
+        self.dir_index = {}
+        for row, path in enumerate(self.path_list):
+            dir_name, file_name = path.rpartition('/')[::2]
+            self.name_index.setdefault(file_name.lower(), []).append(row)
+            self.dir_index.setdefault(dir_name.lower(), []).append(row)
+
+    def find_by_name(self, file_name):
+        return list(self.name_index.get(file_name.lower(), []))
+
+    def find_by_prefix(self, prefix):
+        """
+        查找目录在 prefix 下的引用, prefix 按完整的目录名匹配, D:/proj 不会匹配 D:/project
+        """
+        prefix = prefix.replace('\\', '/').rstrip('/').lower()
+        rows = []
+        for dir_name, dir_rows in self.dir_index.items():
+            if dir_name == prefix or dir_name.startswith(prefix + '/'):
+                rows.extend(dir_rows)
+        return sorted(rows)
+
+
+def remap_by_prefix(index, old_prefix, new_prefix):
+    """
+    把 old_prefix 开头的引用路径替换为 new_prefix 开头, 返回 {下标: 新路径}
+    """
+    old_prefix = old_prefix.replace('\\', '/').rstrip('/')
+    new_prefix = new_prefix.replace('\\', '/').rstrip('/')
+    return {row: new_prefix + index.path_list[row][len(old_prefix):]
+            for row in index.find_by_prefix(old_prefix)}
+
+
+def remap_by_regex(index, pattern, repl):
+    """
+    用正则替换引用路径, 只返回有变化的路径 {下标: 新路径}, 正则错误时抛出 re.error
+    """
+    pattern = re.compile(pattern, re.IGNORECASE)
+    result = {}
+    for row, path in enumerate(index.path_list):
+        new_path = pattern.sub(repl, path)
+        if new_path != path:
+            result[row] = new_path
+    return result
+
+
+def remap_by_root(index, root):
+    """
+    在 root 目录下按文件名查找引用文件, 只遍历一次目录, 返回 {下标: 新路径}
+    同名的文件有多个时使用第一个找到的文件, 并记录日志
+    """
+    found_dict = {}
+    duplicate_set = set()
+    for dir_path, dir_names, file_names in os.walk(root):
+        dir_names.sort()
+        for file_name in file_names:
+            key = file_name.lower()
+            if key not in index.name_index:
+                continue
+            if key in found_dict:
+                duplicate_set.add(file_name)
+                continue
+            found_dict[key] = os.path.join(dir_path, file_name).replace('\\', '/')
+
+    if duplicate_set:
+        logger.warning(f'{root} 下有{len(duplicate_set)}个文件名重复, 使用第一个找到的文件: '
+                       f'{sorted(duplicate_set)[:20]}')
+
+    return {row: new_path
+            for key, new_path in found_dict.items()
+            for row in index.name_index[key]}
+
+
+def is_read_only(file_path):
+    return True if os.stat(file_path).st_mode == 33060 else False
@@ -1,21 +1,54 @@
 import os
+import json
 import subprocess as sp
 import tempfile
 
-from pmtm.core import user_setting, logger
+from pmtm.core import user_setting, metrics, get_subsystem_logger
 from pmtm.helper import get_resource_file
 
 
+logger = get_subsystem_logger('media')
+
+# 缩略图的最大尺寸, 和表格中显示的尺寸一致
+THUMBNAIL_WIDTH = 192
+THUMBNAIL_HEIGHT = 108
+
+
+def run_cmd(cmd, tool, shell=True):
+    """
+    执行命令, 按工具统计调用次数和耗时, 返回 CompletedProcess
+    """
+    logger.debug('执行命令: %s', cmd)
+    with metrics.timer(f'subprocess.{tool}'):
+        return sp.run(cmd, shell=shell, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+
+
+def check_process(process, tool):
+    """
+    命令返回值不为0时抛出 RuntimeError, 错误信息取自 stderr
+    """
+    if process.returncode != 0:
+        error = process.stderr.decode(errors='ignore').strip()
+        raise RuntimeError(f'{tool} 执行失败({process.returncode}): {error}')
+
+
+def read_cmd_line(cmd, tool):
+    """
+    执行命令, 返回输出的第一行
+    """
+    process = run_cmd(cmd, tool=tool)
+    lines = process.stdout.decode().strip().splitlines()
+    return lines[0].strip() if lines else ''
+
+
 # -----------------------图像处理--------------------------------
 def get_image_resolution(image_path):
     """
     获取图片的长宽
     """
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     cmd = f'"{magick}" identify -format "%wx%h" "{image_path}"'
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    size = process.stdout.readline().strip().decode()
+    size = read_cmd_line(cmd, tool='magick')
     w, h = str(size).split('x')
     return w, h
 
@@ -25,41 +58,46 @@ def scale_image(source_image, target_image, scale=1.0):
     等比缩放图片
     """
     scale *= 100.0
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     cmd = f'{magick} identify {source_image} -resize {scale}% "{target_image}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='magick')
+
+
+def extract_preview_from_image(image_file, output_image_file, width, height):
+    """
+    输出图片为预览图, 大于 width x height 时等比缩小
+    """
+    magick = user_setting.tool_path('magick')
+    cmd = f'"{magick}" convert "{image_file}" -resize "{width}x{height}>" "{output_image_file}"'
+    run_cmd(cmd, tool='magick')
 
 
 def extract_thumbnail_from_image(image_file, output_image_file, gamma=1.0):
     """
     输出图片为缩略图
     """
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     cmd = f'"{magick}" convert "{image_file}" -thumbnail 192x108 -gamma {gamma} "{output_image_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='magick')
 
 
 def run_collage_images(image_files, output_image_file, horizontal_count, vertical_count):
     """
     将图片拼接为一张图片  
     """
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     cmd = f'"{magick}" montage {" ".join(image_files)} -tile {horizontal_count}x{vertical_count} -geometry +0+0 -background black "{output_image_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='magick')
 
 
 def run_add_text_to_image(image_file, output_image_file, text, color, size, gravity='South', gamma=1.0):
     """
     为图片添加文字，文字在图片底部中心位置
     """
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     font_file = get_resource_file('msyh.ttf')
     cmd = f'"{magick}" convert "{image_file}" -font {font_file} -gravity {gravity} -pointsize {size} -fill "{color}" -annotate +0+10 "{text}" -gamma {gamma} "{output_image_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='magick')
 
 
 def run_add_text_to_collage_image(output_image_file, data_list, horizontal_count, vertical_count, gravity='South', size=10, gamma=1.0):
@@ -67,7 +105,7 @@ def run_add_text_to_collage_image(output_image_file, data_list, horizontal_count
     为拼图图片添加文字
     data_list: example [{'text': '', 'color': '', 'file_path': ''}]
     """
-    magick = user_setting.get('magick')
+    magick = user_setting.tool_path('magick')
     font_file = get_resource_file('msyh.ttf')
     cmd = f'{magick} montage ^ '
     for data in data_list:
@@ -77,42 +115,105 @@ def run_add_text_to_collage_image(output_image_file, data_list, horizontal_count
         cmd += f'( {file_path} -font {font_file} -gravity {gravity} -pointsize {size} -fill "{color}" -annotate +0+10 "{text}" -gamma {gamma} ) ^ '
 
     cmd += f'-tile {horizontal_count}x{vertical_count} -geometry +0+0 -background black "{output_image_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    logger.debug(f'cmd长度: {len(cmd)}')
-    sp.run(cmd, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    logger.debug('cmd长度: %s', len(cmd))
+    run_cmd(cmd, tool='magick', shell=False)
 
 
 # -----------------------视频处理--------------------------------
-def extract_audio_from_mov(mov_file, output_audio_file):
+def extract_audio_from_mov(mov_file, output_audio_file, copy_stream=False):
     """
-    提取视频的音频为wav
+    提取视频的第一条音轨为wav, 失败或没有生成文件时抛出 RuntimeError
+    copy_stream 为 True 时直接复制音频流, 源音频已经是 pcm_s16le 44100Hz 双声道时使用, 不需要转码
     """
-    ffmpeg = user_setting.get('ffmpeg')
-    cmd = f'"{ffmpeg}" -i "{mov_file}" -vn -acodec pcm_s16le -ar 44100 -ac 2 "{output_audio_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    # 删除之前生成的文件, 失败时不会把旧文件当作结果
+    if os.path.isfile(output_audio_file):
+        os.remove(output_audio_file)
 
+    ffmpeg = user_setting.tool_path('ffmpeg')
+    if copy_stream:
+        codec = '-c:a copy'
+    else:
+        codec = '-acodec pcm_s16le -ar 44100 -ac 2'
+    cmd = f'"{ffmpeg}" -y -v error -i "{mov_file}" -vn -map 0:a:0 {codec} "{output_audio_file}"'
+    check_process(run_cmd(cmd, tool='ffmpeg'), 'ffmpeg')
+    if not os.path.isfile(output_audio_file):
+        raise RuntimeError(f'没有生成音频文件: {output_audio_file}')
 
-def extract_thumbnail_from_mov(mov_file, output_image_file, frame=1):
+
+def probe_audio_stream(file_path):
+    """
+    获取视频第一条音轨的编码, 采样率和声道数, 没有音轨时返回None, ffprobe 执行失败时抛出 RuntimeError
+    返回示例: {'codec_name': 'pcm_s16le', 'sample_rate': '44100', 'channels': 2}
+    """
+    ffprobe = user_setting.tool_path('ffprobe')
+    cmd = f'"{ffprobe}" -v error -select_streams a:0 -show_entries stream=codec_name,sample_rate,channels ' \
+          f'-of json "{file_path}"'
+    process = run_cmd(cmd, tool='ffprobe')
+    check_process(process, 'ffprobe')
+    try:
+        streams = json.loads(process.stdout.decode(errors='ignore') or '{}').get('streams', [])
+    except ValueError:
+        raise RuntimeError(f'无法解析ffprobe的输出: {file_path}')
+    return streams[0] if streams else None
+
+
+def extract_thumbnail_from_mov(mov_file, output_image_file, seconds=0.0,
+                               width=THUMBNAIL_WIDTH, height=THUMBNAIL_HEIGHT):
+    """
+    输出视频指定时间的画面为缩略图, 等比缩放到 width x height 以内
+    -ss 放在 -i 之前, 从附近的关键帧开始解码, 长视频也只需要解码很少的画面
+    """
+    ffmpeg = user_setting.tool_path('ffmpeg')
+    cmd = f'"{ffmpeg}" -y -v error -ss {seconds:.3f} -i "{mov_file}" -frames:v 1 ' \
+          f'-vf "scale={width}:{height}:force_original_aspect_ratio=decrease" -q:v 3 "{output_image_file}"'
+    run_cmd(cmd, tool='ffmpeg')
+
+
+def extract_frame_from_mov(mov_file, output_image_file, seconds=0.0):
     """
-    输出视频指定帧数为缩略图
+    输出视频指定时间的原尺寸画面
     """
-    ffmpeg = user_setting.get('ffmpeg')
-    cmd = f'"{ffmpeg}" -i "{mov_file}" -frames:v {frame} "{output_image_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    ffmpeg = user_setting.tool_path('ffmpeg')
+    cmd = f'"{ffmpeg}" -y -v error -ss {seconds:.3f} -i "{mov_file}" -frames:v 1 -q:v 2 "{output_image_file}"'
+    run_cmd(cmd, tool='ffmpeg')
+
+
+def extract_filmstrip_from_mov(mov_file, output_image_file, seconds_list, height=THUMBNAIL_HEIGHT):
+    """
+    在视频的多个时间点取画面, 缩放到同样的高度后横向拼成一张胶片条图片
+    每个时间点作为一个输入分别seek, 不需要解码中间的画面
+    """
+    ffmpeg = user_setting.tool_path('ffmpeg')
+    count = len(seconds_list)
+    inputs = ' '.join(f'-ss {seconds:.3f} -i "{mov_file}"' for seconds in seconds_list)
+    scale_filter = ';'.join(f'[{index}:v]scale=-2:{height},setsar=1[v{index}]' for index in range(count))
+    stack_filter = ''.join(f'[v{index}]' for index in range(count)) + f'hstack=inputs={count}'
+    cmd = f'"{ffmpeg}" -y -v error {inputs} -filter_complex "{scale_filter};{stack_filter}" ' \
+          f'-frames:v 1 -q:v 3 "{output_image_file}"'
+    run_cmd(cmd, tool='ffmpeg')
+
+
+def get_video_duration(file_path):
+    """
+    获取视频的时长(秒), 获取失败时返回0
+    """
+    ffprobe = user_setting.tool_path('ffprobe')
+    cmd = f'"{ffprobe}" -v error -show_entries format=duration ' \
+          f'-of default=noprint_wrappers=1:nokey=1 "{file_path}"'
+    try:
+        return float(read_cmd_line(cmd, tool='ffprobe'))
+    except ValueError:
+        return 0.0
 
 
 def get_video_frame_count(mov_file):
     """
     获取视频文件总帧数
     """
-    ffprobe = user_setting.get('ffprobe')
+    ffprobe = user_setting.tool_path('ffprobe')
     cmd = f'"{ffprobe}" -v error -select_streams v:0 -show_entries ' \
           f'stream=nb_frames -of default=noprint_wrappers=1:nokey=1 "{mov_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    duration = process.stdout.readline().strip().decode()
+    duration = read_cmd_line(cmd, tool='ffprobe')
     return int(duration)
 
 
@@ -120,13 +221,11 @@ def get_video_rate(file_path):
     """
     获取视频的帧数率
     """
-    ffprobe = user_setting.get('ffprobe')
+    ffprobe = user_setting.tool_path('ffprobe')
     cmd = f'"{ffprobe}" -v error -select_streams v:0 -show_entries stream=avg_frame_rate ' \
           f'-of default=noprint_wrappers=1:nokey=1 "{file_path}"'
     cmd = cmd.format(ffprobe, file_path)
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    rate = process.stdout.readline().strip().decode().split('/')[0]
+    rate = read_cmd_line(cmd, tool='ffprobe').split('/')[0]
     return rate
 
 
@@ -134,13 +233,11 @@ def get_video_colorspace(file_path):
     """
     获取视频的色彩空间
     """
-    ffprobe = user_setting.get('ffprobe')
+    ffprobe = user_setting.tool_path('ffprobe')
     cmd = '"{0}" -v error -select_streams v:0 -show_entries format_tags=uk.co.thefoundry.Colorspace ' \
           '-of default=noprint_wrappers=1:nokey=1 "{1}"'
     cmd = cmd.format(ffprobe, file_path)
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    colorspace = process.stdout.readline().strip().decode()
+    colorspace = read_cmd_line(cmd, tool='ffprobe')
     return colorspace
 
 
@@ -148,12 +245,10 @@ def get_video_resolution(file_path):
     """
     获取视频的分辨率
     """
-    ffprobe = user_setting.get('ffprobe')
+    ffprobe = user_setting.tool_path('ffprobe')
     cmd = '"{0}" -v error -show_entries stream=width,height -of csv=p=0:s=x "{1}"'
     cmd = cmd.format(ffprobe, file_path)
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    resolution = process.stdout.readline().strip().decode()
+    resolution = read_cmd_line(cmd, tool='ffprobe')
     return resolution
 
 
@@ -161,12 +256,10 @@ def get_video_codex(file_path):
     """
     获取视频的编码
     """
-    ffprobe = user_setting.get('ffprobe')
+    ffprobe = user_setting.tool_path('ffprobe')
     cmd = '"{0}" -v error -select_streams v:0 -show_entries stream=codec_name -of default=noprint_wrappers=1:nokey=1 "{1}"'
     cmd = cmd.format(ffprobe, file_path)
-    logger.debug(f'执行命令: {cmd}')
-    process = sp.Popen(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
-    codex = process.stdout.readline().strip().decode()
+    codex = read_cmd_line(cmd, tool='ffprobe')
     return codex
 
 
@@ -180,10 +273,9 @@ def convert_seq_to_video(seq_file, output_video_file, start_frame=1, fps=25):
         start_frame: 1
         fps: 25
     """
-    ffmpeg = user_setting.get('ffmpeg')
+    ffmpeg = user_setting.tool_path('ffmpeg')
     cmd = f'"{ffmpeg}" -y -start_number {start_frame} -r {fps} -i "{seq_file}" -vcodec h264 "{output_video_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='ffmpeg')
 
 
 def convert_video_to_seq(video_file, output_seq_file, start_frame=1):
@@ -194,10 +286,9 @@ def convert_video_to_seq(video_file, output_seq_file, start_frame=1):
         output_seq_file: D:\show\TST\0001.%04d.png
         start_frame: 1
     """
-    ffmpeg = user_setting.get('ffmpeg')
+    ffmpeg = user_setting.tool_path('ffmpeg')
     cmd = f'"{ffmpeg}" -i "{video_file}" -start_number {start_frame} "{output_seq_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='ffmpeg')
 
 
 def convert_seq_to_seq(source_seq_file, output_seq_file, source_start_frame=1, output_start_frame=1):
@@ -209,10 +300,9 @@ def convert_seq_to_seq(source_seq_file, output_seq_file, source_start_frame=1, o
         source_start_frame: 1
         output_start_frame: 1
     """
-    ffmpeg = user_setting.get('ffmpeg')
+    ffmpeg = user_setting.tool_path('ffmpeg')
     cmd = f'"{ffmpeg}" -start_number {source_start_frame} -i "{source_seq_file}" -qscale:v 2 -start_number {output_start_frame} "{output_seq_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='ffmpeg')
 
 
 def convert_video_to_video(source_video_file, output_video_file):
@@ -222,7 +312,6 @@ def convert_video_to_video(source_video_file, output_video_file):
         source_video_file: D:\show\TST\0001.mp4
         output_video_file: D:\show\TST\0001.mp4
     """
-    ffmpeg = user_setting.get('ffmpeg')
+    ffmpeg = user_setting.tool_path('ffmpeg')
     cmd = f'"{ffmpeg}" -i "{source_video_file}" -qscale:v 2 "{output_video_file}"'
-    logger.debug(f'执行命令: {cmd}')
-    sp.run(cmd, shell=True, stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.PIPE)
+    run_cmd(cmd, tool='ffmpeg')
@@ -0,0 +1,159 @@
+"""
+界面使用的Qt相关工具, 命令行模式不导入这个模块
+"""
+import os
+import time
+import traceback
+from functools import lru_cache
+
+from PIL import Image
+from PySide2 import QtGui, QtCore
+
+from pmtm.core import MetricsSession, profile_task, get_subsystem_logger
+from pmtm.helper import gamma_lut, get_resource_file, THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT
+from pmtm.export_utils import export_report, encode_thumbnails
+
+
+logger = get_subsystem_logger('export')
+
+
+class QtSettingStore(object):
+    """
+    使用QSettings保存用户设置
+    """
+
+    def __init__(self, flag):
+        self.flag = flag
+
+    def load(self):
+        setting = QtCore.QSettings(self.flag)
+        return {key: setting.value(key) for key in setting.allKeys()}
+
+    def save(self, values):
+        setting = QtCore.QSettings(self.flag)
+        for key, value in values.items():
+            setting.setValue(key, value)
+        setting.sync()
+
+
+def g_pixmap(name, y, gamma=1.0):
+    """
+    用于缩略图显示, 缩略图还没有生成时显示占位图
+    gamma 只在显示时应用, 不改变缩略图文件
+    """
+    img = y.get('image')
+    if not img:
+        return placeholder_pixmap()
+    return load_thumbnail_pixmap(img, round(gamma, 2))
+
+
+@lru_cache(maxsize=512)
+def load_thumbnail_pixmap(image_path, gamma=1.0):
+    """
+    读取并缩放缩略图, 表格重绘时不需要重新读取文件
+    """
+    if gamma == 1.0:
+        result = QtGui.QPixmap(image_path)
+    else:
+        result = gamma_pixmap(image_path, gamma)
+    return result.scaled(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+
+
+def gamma_pixmap(image_path, gamma):
+    """
+    读取图片并用查找表调整gamma, 读取失败返回空的QPixmap
+    """
+    try:
+        with Image.open(image_path) as img:
+            img = img.convert('RGB').point(gamma_lut(gamma) * 3)
+    except OSError:
+        return QtGui.QPixmap()
+    return pil_to_pixmap(img)
+
+
+def pil_to_pixmap(img):
+    """
+    将RGB模式的PIL图片转换为QPixmap
+    """
+    data = img.tobytes()
+    image = QtGui.QImage(data, img.width, img.height, img.width * 3, QtGui.QImage.Format_RGB888)
+    return QtGui.QPixmap.fromImage(image)
+
+
+@lru_cache(maxsize=1)
+def placeholder_pixmap():
+    """
+    缩略图占位图, 和缩略图同样大小, 生成缩略图后行高不会改变
+    """
+    result = QtGui.QPixmap(THUMBNAIL_WIDTH, THUMBNAIL_HEIGHT)
+    result.fill(QtGui.QColor(128, 128, 128, 40))
+    icon = QtGui.QPixmap(get_resource_file('media_line.svg'))
+    if not icon.isNull():
+        icon = icon.scaled(32, 32, QtCore.Qt.KeepAspectRatio, QtCore.Qt.SmoothTransformation)
+        painter = QtGui.QPainter(result)
+        painter.drawPixmap((THUMBNAIL_WIDTH - icon.width()) // 2, (THUMBNAIL_HEIGHT - icon.height()) // 2, icon)
+        painter.end()
+    return result
+
+
+class ExportReportTask(QtCore.QThread):
+    """
+    导出报告任务, 在后台线程中逐行生成数据并写入文件
+    """
+
+    progress_sig = QtCore.Signal(list)
+    is_success_sig = QtCore.Signal(bool)
+
+    def __init__(self, output_path, header_list, data_list, total=None, thumbnail_key='thumbnail', parent=None):
+        """
+        data_list: 行数据列表, 或者返回行数据生成器的函数(在后台线程中调用)
+        total: 总行数, 为空时从data_list获取, 无法获取则进度条显示为忙碌状态
+        """
+        super(ExportReportTask, self).__init__(parent=parent)
+
+        self.output_path = output_path
+        self.header_list = header_list
+        self.data_list = data_list
+        self.thumbnail_key = thumbnail_key
+        self.total = total if total is not None else len(data_list) if hasattr(data_list, '__len__') else 0
+
+        self.file_name = os.path.basename(output_path)
+        self.last_progress_time = 0
+
+    @profile_task
+    def run(self):
+        session = MetricsSession('导出报告')
+        try:
+            data_list = self.data_list() if callable(self.data_list) else self.data_list
+            kwargs = {}
+
+            # 导出xlsx时, 先并发编码所有缩略图, 再组装表格
+            has_thumbnail = any(header['key'] == self.thumbnail_key for header in self.header_list)
+            if self.output_path.lower().endswith('.xlsx') and has_thumbnail and isinstance(data_list, list):
+                self.progress_sig.emit([f'{self.file_name} (处理缩略图)', 0, 0])
+                kwargs['encoded_images'] = encode_thumbnails([data.get('image') for data in data_list])
+
+            export_report(output_path=self.output_path,
+                          header_list=self.header_list,
+                          data_list=data_list,
+                          thumbnail_key=self.thumbnail_key,
+                          progress_callback=self.update_progress,
+                          **kwargs)
+            self.progress_sig.emit([self.file_name, self.total, self.total])
+            logger.info(f'导出完成，文件路径: {self.output_path}')
+            self.is_success_sig.emit(True)
+
+        except Exception as e:
+            logger.error(f'导出报告失败: {traceback.format_exc()}')
+            self.is_success_sig.emit(False)
+        session.finish(output_path=self.output_path)
+
+    def update_progress(self, current):
+        """
+        限制进度信号的发送频率, 避免大量信号阻塞界面
+        """
+        now = time.time()
+        if now - self.last_progress_time < 0.1:
+            return
+        self.last_progress_time = now
+        self.progress_sig.emit([self.file_name, current, self.total])
@@ -18,6 +18,7 @@ class SettingDialog(CommonDialog):
         self.fmg_line = dy.MLineEdit().file(filters=['*.exe']).small()
         self.fpb_line = dy.MLineEdit().file(filters=['*.exe']).small()
         self.mag_line = dy.MLineEdit().file(filters=['*.exe']).small()
+        self.profile_ck = dy.MCheckBox('诊断模式 (记录任务的性能分析数据到日志目录, 会降低运行速度)')
         self.help_bt = dy.MPushButton('帮助文档').small()
         self.download_bt = dy.MPushButton('下载页面 (工具更新发布地址)').small()
         self.follow_bt = dy.MPushButton('关注公众号').small()
@@ -32,6 +33,8 @@ class SettingDialog(CommonDialog):
         self.add_widgets_h_line(dy.MLabel('ffmpeg路径'), self.fmg_line)
         self.add_widgets_h_line(dy.MLabel('ffprobe路径'), self.fpb_line)
         self.add_widgets_h_line(dy.MLabel('magick路径'), self.mag_line)
+        self.add_widgets_v_line(dy.MLabel('诊断').h4().secondary(), dy.MDivider())
+        self.add_widgets_v_line(self.profile_ck)
         self.add_widgets_v_line(dy.MLabel('关于').h4().secondary(), dy.MDivider())
         self.add_widgets_v_line(self.help_bt, self.download_bt, self.git_bt, self.follow_bt)
         self.setLayout(self.main_layout)
@@ -73,6 +76,10 @@ class SettingDialog(CommonDialog):
     def ffprobe(self):
         return self.fpb_line.text()
     
+    @property
+    def profile_capture(self):
+        return self.profile_ck.isChecked()
+
     @ffmpeg.setter
     def ffmpeg(self, value):
         self.fmg_line.setText(value)
@@ -84,3 +91,7 @@ class SettingDialog(CommonDialog):
     @ffprobe.setter
     def ffprobe(self, value):
         self.fpb_line.setText(value)
+
+    @profile_capture.setter
+    def profile_capture(self, value):
+        self.profile_ck.setChecked(value)
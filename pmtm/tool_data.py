@@ -1,12 +1,5 @@
+import importlib
 from dataclasses import dataclass
-from typing import Callable
-
-from pmtm.feature.scan_maya_ref import MayaRefScanUI
-from pmtm.feature.scan_maya_frame import MayaFrameScanUI
-from pmtm.feature.scan_movie_data import ScanMovieDataUI
-from pmtm.feature.convert_tool import ConvertToolUI
-from pmtm.feature.add_text_to_image import AddTextToImageUI
-from pmtm.feature.pr_tools import PRToolsUI
 
 
 @dataclass
@@ -17,16 +10,24 @@ class ToolData:
     group: str
     wiki_url: str
     icon: str
-    widget: Callable
+    module: str
+    widget: str
     enable: bool = True
 
+    def load_widget(self):
+        """
+        导入功能模块, 返回界面类。模块在第一次打开该功能时才会被导入
+        """
+        return getattr(importlib.import_module(self.module), self.widget)
+
 
 DATA_LIST = [
     ToolData(name='Maya Reference扫描',
              group='',
              icon=r'./resource/scan_maya.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#1-扫描-Maya-Reference',
-             widget=MayaRefScanUI,
+             module='pmtm.feature.scan_maya_ref',
+             widget='MayaRefScanUI',
              description="""
              扫描指定目录下的Maya文件（仅ma格式），获取其引用的reference路径。
              你可以对reference进行替换操作，也可以将扫描结果导出一个表格。
@@ -38,7 +39,8 @@ DATA_LIST = [
              group='',
              icon='./resource/frame_range.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#2-扫描Maya文件的时间范围',
-             widget=MayaFrameScanUI,
+             module='pmtm.feature.scan_maya_frame',
+             widget='MayaFrameScanUI',
              description="""
              扫描指定目录下的Maya文件（仅ma格式），获取其开始帧和结束帧，然后将结果导出一个表格。
 
@@ -53,7 +55,8 @@ DATA_LIST = [
              group='',
              icon='./resource/movie.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#3-扫描视频信息',
-             widget=ScanMovieDataUI,
+             module='pmtm.feature.scan_movie_data',
+             widget='ScanMovieDataUI',
              description="""
              扫描指定文件夹下的mov或mp4视频，也可以直接将文件拖拽到Table窗口中。
              工具会获取视频的'帧数','缩略图','帧数率'等信息，
@@ -64,7 +67,8 @@ DATA_LIST = [
              group='',
              icon='./resource/conversion.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#4-序列帧-视频互转',
-             widget=ConvertToolUI,
+             module='pmtm.feature.convert_tool',
+             widget='ConvertToolUI',
              description="""
              可以将视频转换为序列帧，或者将序列帧转换为视频。
 
@@ -79,7 +83,8 @@ DATA_LIST = [
              group='',
              icon='./resource/add_text_to_image.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#5-图片拼图-添加反馈文字',
-             widget=AddTextToImageUI,
+             module='pmtm.feature.add_text_to_image',
+             widget='AddTextToImageUI',
              description="""
              将多张图片拼成一张，也可以在图片上添加文字。
 
@@ -94,7 +99,8 @@ ToolData(name='PR工具集合',
              group='',
              icon='./resource/adobe_premiere_pro_200px.png',
              wiki_url='https://lingyunfx.com/pmtm-doc/#5-图片拼图-添加反馈文字',
-             widget=PRToolsUI,
+             module='pmtm.feature.pr_tools',
+             widget='PRToolsUI',
              description="""
              一些Premiere Pro的小工具集合，需安装 Pymiere Link，否则无法使用。（点击问号按钮参考帮助文档）
              功能包括: